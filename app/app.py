@@ -23,7 +23,7 @@ from PIL import Image
 from model import detect_scores_bboxes_classes, \
                   detr, createNullVideo
 from model import CLASSES, DEVICE 
-from model import inpaint, testContainerWrite, performInpainting
+from model import inpaint, inpaintCache, inpaintHistory, testContainerWrite, performInpainting, inpaintStatus
 
 libpath = "/home/appuser/scripts/" # to keep the dev repo in place, w/o linking
 sys.path.insert(1,libpath)
@@ -71,6 +71,16 @@ def getImageFileNames(dirPath):
     else:
         return fnames
 
+def getFrameCount(path):
+    # number of frames in a frame store or directory of frames
+    if imu.isFrameStore(path):
+        return len(imu.FrameStore(path))
+    elif os.path.isdir(path):
+        fnames = getImageFileNames(path)
+        return len(fnames) if fnames else 0
+    else:
+        return 0
+
 
 # ----------
 # Dash component wrappers
@@ -99,11 +109,11 @@ def save_file(name, content):
     return filepath
 
 def vfile_to_frames(fname):
+    # frames are decoded once into a memory-mapped frame store (see imu.FrameStore)
     assert os.path.exists(fname), "Could not determine path to video file"
-    dirPath = os.path.join(uploaddir,fname.split(".")[-2])
-    nfiles = imu.videofileToFramesDirectory(videofile=fname,dirPath=dirPath,
-                                            padlength=5, imgtype='png', cleanDirectory=True)
-    return dirPath 
+    storePath = os.path.join(uploaddir,fname.split(".")[-2] + ".frames")
+    nframes = imu.videofileToFrameStore(videofile=fname,filePath=storePath)
+    return storePath 
 
 # PIL images
 def pil_to_b64(im, enc="png"):
@@ -387,6 +397,10 @@ app.layout = html.Div(className='container', children=[
                         type='circle',
                         children=html.Div(id='loading-inpaint'))
         ]),
+        Column(width=6,children=[
+            html.P("", id='inpaint-progress'),
+            dcc.Interval(id='interval-inpaint', interval=2000, n_intervals=0)
+        ]),
         Column(width=2,children=[]), # place holder
         Row([
             Column(width=4, children=[
@@ -472,9 +486,9 @@ def update_dirpath(nc_single, nc_sequence, nc_inpaint, s_dirpath,
         return 100, {'0':'0', '100':'100'}, [0,100], '(none)' 
 
     dirpath = s_dirpath
-    fnames = getImageFileNames(s_dirpath)
-    if fnames:
-        fnmax = len(fnames)-1
+    n_frames = getFrameCount(s_dirpath)
+    if n_frames:
+        fnmax = n_frames-1
         if fnmax != s_fnmax: 
             fnmarks = {0: '0', fnmax: f"{fnmax}"}
             fnvalue = [0, fnmax]
@@ -506,7 +520,10 @@ def update_dirpath(nc_single, nc_sequence, nc_inpaint, s_dirpath,
 def run_single(n_clicks, dirpath, framerange, confidence,
                cb_person, cb_vehicle, cb_environment):
 
-    if dirpath is not None and os.path.isdir(dirpath):
+    if dirpath is not None and imu.isFrameStore(dirpath):
+        imgfile = imu.FrameStore(dirpath)[framerange[0]]  # BGR frame (view of the store)
+        im = Image.fromarray(imgfile[:, :, ::-1])
+    elif dirpath is not None and os.path.isdir(dirpath):
         fnames = getImageFileNames(dirpath)
         imgfile = fnames[framerange[0]]
         im = Image.open(imgfile)
@@ -585,7 +602,9 @@ def run_sequence(n_clicks, dirpath, framerange, confidence,figure,
                  cb_person, cb_vehicle, cb_environment, 
                  cb_options, dilationhwidth, minsequencelength):
 
-    if dirpath is not None and os.path.isdir(dirpath):
+    if dirpath is not None and imu.isFrameStore(dirpath):
+        fnames = None
+    elif dirpath is not None and os.path.isdir(dirpath):
         fnames = getImageFileNames(dirpath)
     else: 
         return "", "Null:None" 
@@ -596,7 +615,8 @@ def run_sequence(n_clicks, dirpath, framerange, confidence,figure,
     useBBmasks = 'useBBmasks' in cb_options
     
     fmin, fmax = framerange
-    fnames = fnames[fmin:fmax]
+    # frame stores are selected by (path, start, finish)
+    fnames = fnames[fmin:fmax] if fnames is not None else (dirpath, fmin, fmax)
 
     # was this a repeat?
     if len(detr.imglist) != 0:
@@ -621,7 +641,10 @@ def compute_sequence(fnames,framerange,confidence,
     detr.selectFiles = fnames
 
     staticdir = os.path.join(os.getcwd(),"static")
-    detr.load_images(filelist=fnames)
+    if isinstance(fnames,tuple):
+        detr.load_frameStore(*fnames)
+    else:
+        detr.load_images(filelist=fnames)
     detr.predict_sequence(useBBmasks=useBBmasks,selObjectNames=selectObjectNames)
     detr.groupObjBBMaskSequence()
 
@@ -701,11 +724,33 @@ def run_inpaint(n_clicks):
     performInpainting(detrObj=detr,
                       inpaintObj=inpaint,
                       workDir = "../data",
-                      outputVideo=os.path.join(staticdir,vfile))
+                      outputVideo=os.path.join(staticdir,vfile),
+                      skipEmptyFrames=True,
+                      compositeFullRes=True,
+                      streamResults=True,
+                      stallTimeout=600,         # seconds without job output, the job is then stopped
+                      cache=inpaintCache,
+                      history=inpaintHistory)
 
     return "", f"inpaintvid:{vfile}"
 
 
+@app.callback(Output('inpaint-progress','children'),
+              [Input('interval-inpaint','n_intervals')])
+def update_inpaint_progress(n_intervals):
+    # stage, frames, throughput and ETA parsed from the remote job output
+    # (an InpaintProgress, or the InpaintChunkScheduler: both set 'exit_status' when done)
+    progress = inpaintStatus['progress']
+    if progress is None:
+        return ""
+    elif progress.exit_status == 0:
+        return f"Inpaint finished: {progress}"
+    elif progress.exit_status is not None:
+        return f"Inpaint failed: {progress}"
+    else:
+        return f"Inpainting: {progress}"
+
+
 @app.callback(Output('inpaint-output','url'),
               [Input('signal-inpaint','children')],
               [State('inpaint-output','url')])
@@ -1,33 +1,18 @@
 import os
 import sys
 import tempfile
-import cv2
-from threading import Thread
-from time import sleep
 from glob import glob
 
 libpath = "/home/appuser/scripts/" # to keep the dev repo in place, w/o linking
 sys.path.insert(1,libpath)
 import ObjectDetection.imutils as imu
 from ObjectDetection.detect import DetectSingle, TrackSequence, GroupSequence
-from ObjectDetection.inpaintRemote import InpaintRemote
+from ObjectDetection.inpaintRemote import InpaintRemote, runInpaintJob
+from ObjectDetection.inpaintCache import InpaintCache, InpaintHistory
 
 # ------------
 # helper functions
 
-class ThreadWithReturnValue(Thread):
-    def __init__(self, group=None, target=None, name=None,
-                 args=(), kwargs={}, Verbose=None):
-        Thread.__init__(self, group, target, name, args, kwargs)
-        self._return = None
-    def run(self):
-        if self._target is not None:
-            self._return = self._target(*self._args, **self._kwargs)
-    def join(self, *args):
-        Thread.join(self, *args)
-        return self._return
-
-
 # for output bounding box post-processing
 #def box_cxcywh_to_xyxy(x):
 #    x_c, y_c, w, h = x.unbind(1)
@@ -63,6 +48,7 @@ def createNullVideo(filePath,message="No Images", heightWidth=(100,100)):
 
 def testContainerWrite(inpaintObj, workDir=None, hardFail=True):
     # workDir must be accessible from both containers
+    # (not required when inpainting with transferOverSSH=True)
     if workDir is None:
         workDir = os.getcwd()
 
@@ -100,11 +86,50 @@ def testContainerWrite(inpaintObj, workDir=None, hardFail=True):
     return not hasErrors 
 
 
-def performInpainting(detrObj,inpaintObj,workDir,outputVideo, useFFMPEGdirect=False):
+# latest InpaintProgress of the running job (polled by the app)
+inpaintStatus = { 'progress': None }
+
+def performInpainting(detrObj,inpaintObj,workDir,outputVideo, useFFMPEGdirect=False,
+                      sourceVideo=None, startframe=0, stallTimeout=None, transferOverSSH=False,
+                      scheduler=None, skipEmptyFrames=False, contextMargin=5,
+                      cropROI=False, roiPadding=32, compositeFullRes=False, useDaemon=False,
+                      streamResults=False, cache=None, history=None, spliceFade=3,
+                      preResize=False, inputSize=None):
+    # 'inpaintObj': any InpaintBackend (InpaintRemote, InpaintLocal, ...)
+    # 'sourceVideo' given: output the full source video, re-encoding only the
+    # GOPs which contain masked frames (see imu.smartRenderVideo), the results are then
+    # always composited into the source frames (as with 'compositeFullRes')
+    # 'transferOverSSH': frames, masks and results are sent over the SSH connection,
+    # the inpaint host does not need access to 'workDir'
+    # 'scheduler': an InpaintChunkScheduler, splits the job into temporal chunks
+    # run on its workers ('inpaintObj' is not used then, its own 'stallTimeout' applies)
+    # 'skipEmptyFrames': only runs of masked frames (+/- 'contextMargin' frames) are
+    # inpainted, the other frames pass through untouched
+    # 'cropROI': only the region around the masks (+ 'roiPadding' pixels) is inpainted
+    # and pasted back into the full resolution frames
+    # 'compositeFullRes': only the masked pixels (dilated, feathered) are taken from the
+    # upsampled inpaint result, the output keeps the source resolution
+    # 'useDaemon': jobs go to the resident inpaint daemon (inpaint/scripts/inpaint_daemon.py)
+    # 'streamResults': result frames are decoded and encoded while the job is still
+    # running (also chunk-wise, as the stitched frames are written), not with
+    # 'transferOverSSH' or smart rendering; a failed job leaves no partial 'outputVideo'
+    # 'cache': an InpaintCache, identical inputs and settings return the stored results
+    # (per chunk when inpainting with a scheduler, a given 'scheduler' uses its own cache)
+    # 'history': an InpaintHistory, on a rerun of the same sequence only frames whose masks
+    # changed (+/- 'contextMargin') are inpainted, spliced into the previous results
+    # (cross-faded over 'spliceFade' frames)
+    # 'inputSize': (height, width) inpaint working size, default: the scheduler's maxInputSize
+    # or 512x1024, used by the job and the cache keys
+    # 'preResize': frames and masks are written at 'inputSize' (masks resized mask-aware),
+    # the results are brought back to the original resolution with 'compositeFullRes'
 
     # perform inpainting
     # (write access tested previously)
     workDir = os.path.abspath(workDir)
+    if inputSize is None:
+        inputSize = scheduler.maxInputSize if scheduler is not None else (512,1024)
+    assert scheduler is None or tuple(scheduler.maxInputSize) == tuple(inputSize), \
+        f"inputSize {inputSize} differs from the scheduler's maxInputSize {scheduler.maxInputSize}"
 
     with tempfile.TemporaryDirectory(dir=workDir) as tempdir:
 
@@ -112,41 +137,57 @@ def performInpainting(detrObj,inpaintObj,workDir,outputVideo, useFFMPEGdirect=Fa
         maskDirPath = os.path.join(tempdir,"masks")
         resultDirPath = os.path.join(os.path.join(tempdir,"Inpaint_Res"),"inpaint_res")
 
+        def encodeResults(results):
+            # 'results': result frames or file paths, in frame order
+            imu.writeInpaintResultsToVideo(results, outputVideo, fps=30, useFFMPEGdirect=True,
+                                           originals=detrObj.imglist if compositeFullRes else None,
+                                           maskList=detrObj.combinedMaskList)
+
         if detrObj.combinedMaskList is None:
             detrObj.combine_MaskSequence()
 
         detrObj.write_ImageMaskSequence(
             writeImagesToDirectory=frameDirPath,
-            writeMasksToDirectory=maskDirPath)
-
-        inpaintObj.connectInpaint()
-
-        trd1 = ThreadWithReturnValue(target=inpaintObj.runInpaint,
-                                 kwargs={'frameDirPath':frameDirPath,'maskDirPath':maskDirPath})
-        trd1.start() 
-
-        print("working:",end='',flush=True)
-        while trd1.is_alive():
-            print('.',end='',flush=True)
-            sleep(1)
-
-        print("\nfinished")
-        inpaintObj.disconnectInpaint()
-
-        stdin,stdout,stderr = trd1.join()
-        ok = False
-        for l in stdout:
-            print(l.strip())
-            if "Propagation has been finished" in l: 
-                ok = True
-        
-        assert ok, "Could not determine if results were valid!"
-        
-        print(f"\n....Writing results to {outputVideo}")
-
-        resultfiles = sorted(glob(os.path.join(resultDirPath,"*.png")))
-        imgres = [ cv2.imread(f) for f in resultfiles]
-        imu.writeFramesToVideo(imgres, filePath=outputVideo, fps=30, useFFMPEGdirect=True)
+            writeMasksToDirectory=maskDirPath,
+            resizeTo=inputSize if preResize else None)
+
+        segments = None
+        if skipEmptyFrames:
+            segments = imu.maskedFrameRuns(detrObj.combinedMaskList, margin=contextMargin)
+            print(f"Inpainting {sum([f - s for s,f in segments])} of {len(detrObj.combinedMaskList)} frames")
+
+        historyKey, passthroughFiles = None, None
+        if history is not None:
+            historyKey = history.sequenceKey(sorted(glob(os.path.join(frameDirPath,"*.png"))),
+                                             cropROI=cropROI, inputSize=inputSize, **inpaintObj.cacheSettings())
+            runs = history.changedRuns(historyKey, detrObj.combinedMaskList, margin=contextMargin)
+            if runs is not None:
+                segments, passthroughFiles = runs, history.resultFiles()
+                print(f"Re-inpainting {sum([f - s for s,f in runs])} of {len(detrObj.combinedMaskList)} frames (masks changed)")
+
+        if sourceVideo is not None:
+            encode = lambda resultfiles: imu.smartRenderInpaintResults(sourceVideo, resultfiles, detrObj.imglist,
+                                                                       detrObj.combinedMaskList,
+                                                                       filePath=outputVideo, startframe=startframe)
+        else:
+            encode = encodeResults
+
+        # a scheduler runs overlapping temporal chunks concurrently on its workers,
+        # stitched frames are written (and streamed) in order as the chunks finish
+        # (restricted jobs without 'scheduler' get one on 'inpaintObj', see runInpaintJob)
+        inpaintStatus['progress'] = None
+        runInpaintJob(inpaintObj, frameDirPath, maskDirPath, resultDirPath,
+                      scheduler=scheduler,
+                      schedulerArgs={'workDir': tempdir, 'segments': segments,
+                                     'passthroughFiles': passthroughFiles, 'spliceFade': spliceFade},
+                      transferOverSSH=transferOverSSH, useDaemon=useDaemon, stallTimeout=stallTimeout,
+                      inputSize=inputSize, cropROI=cropROI, roiPadding=roiPadding, cache=cache,
+                      statusCallback=lambda p: inpaintStatus.update(progress=p),
+                      encode=encode, outputFile=outputVideo,
+                      streamResults=streamResults and sourceVideo is None)
+
+        if historyKey is not None:
+            history.update(historyKey, detrObj.combinedMaskList, sorted(glob(os.path.join(resultDirPath,"*.png"))))
 
         return True
 
@@ -162,6 +203,8 @@ DEVICE = detr.DEVICE
 
 # load Inpaint remote
 inpaint = InpaintRemote()
+inpaintCache = InpaintCache("../data/inpaint_cache")
+inpaintHistory = InpaintHistory("../data/inpaint_history")
 
 
 # The following are imported in app: 
@@ -132,26 +132,29 @@ class DetectSingle:
 
         return res 
 
-    def annotate(self, im=None, masks=None, bboxes=None, addIndices=True):
+    def annotate(self, im=None, masks=None, bboxes=None, addIndices=True, alpha=1.0, out=None):
         """
             Adds annotation of the selected instances to the image 
             Indices are added according to the order of prediction 
+            All instances are drawn in one pass (label map + colour table), optionally
+            alpha blended, into 'out' (None: a copy of the image, im: in place, or a reused buffer)
         """
         if im is None: 
             im = self.im
 
-        outim = im.copy()
         if masks is None:
             masks = self.masks
         
         if bboxes is None:
             bboxes = self.bboxes
 
-        for i,(msk,bbox) in enumerate(zip(masks,bboxes)):
-            color = self.thing_colors[i]
-            x,y = [round(c) for c in imu.bboxCenter(bbox)]
-            outim = imu.maskImage(outim,msk,color)
-            if addIndices:
+        labels = imu.masksToLabelMap(masks, im.shape[:2])
+        lut = imu.colorLUT(self.thing_colors[:len(masks)])
+        outim = imu.overlayLabels(im, labels, lut, alpha=alpha, out=out)
+
+        if addIndices:
+            for i,bbox in enumerate(bboxes):
+                x,y = [round(c) for c in imu.bboxCenter(bbox)]
                 cv2.putText(outim,str(i), (x,y), **self.fontconfig)
         
         return outim
@@ -188,6 +191,12 @@ class TrackSequence(DetectSingle):
         self.bboxlist = []
         self.objclasslist = []
 
+    def reset_sequence(self):
+        # per-sequence results, cleared when other frames are loaded
+        self.masklist = []
+        self.bboxlist = []
+        self.objclasslist = []
+
 
     def load_images(self,fileglob=None, filelist=None):
         if fileglob is not None:
@@ -210,6 +219,21 @@ class TrackSequence(DetectSingle):
         
         return len(self.imglist)
     
+    def load_frameStore(self, filePath, startframe=0, finishframe=None):
+        """
+            uses the frames of a memory-mapped frame store (see imu.FrameStore)
+            as the image list, frames are views of the store (no decode, no copies)
+            the frames are read-only, copy a frame before modifying it in place
+            results of a previous sequence (masks, boxes, groups) are cleared
+        """
+        store = imu.FrameStore(filePath)
+        if finishframe is None:
+            finishframe = len(store)
+
+        self.reset_sequence()
+        self.imglist = [ store[i] for i in range(startframe, finishframe) ]
+        return len(self.imglist)
+
     def set_imagelist(self,imglist):
         self.imglist = imglist
 
@@ -282,6 +306,13 @@ class GroupSequence(TrackSequence):
             'bitrate' : 1800
         }
 
+    def reset_sequence(self):
+        super(GroupSequence,self).reset_sequence()
+        self.objBBMaskSeqDict = None
+        self.objBBMaskSeqGrpDict = None
+        self.combinedMaskList = None
+        self.orginalSequenceMap = None
+
     @staticmethod
     def __assignBBMaskToGroupByDistIndex(attainedGroups, trialBBs, trialMasks, index=None, widthFactor=2.0):
         """
@@ -631,7 +662,7 @@ class GroupSequence(TrackSequence):
                 for bbx,msk,ind in objgrp:
                     seqMasks[ind].append(msk)
 
-        combinedMasks = [imu.combineMasks(msks) for msks in seqMasks]
+        combinedMasks = [imu.combineMasks(msks, shape=img.shape) for msks,img in zip(seqMasks,self.imglist)]
         if inPlace:
             self.combinedMaskList = combinedMasks
             return True
@@ -643,7 +674,23 @@ class GroupSequence(TrackSequence):
                                 masklist=None,
                                 writeMasksToDirectory=None, 
                                 writeImagesToDirectory=None,
-                                cleanDirectory=False):
+                                cleanDirectory=False,
+                                pngCompression=1,
+                                n_workers=None,
+                                verbose=False,
+                                maskBitDepth=8,
+                                writeMasksToVideo=None,
+                                writeImagesToFrameStore=None,
+                                resizeTo=None):
+        """
+            Writes the paired images and (combined) masks as numbered PNGs,
+            encoded on 'n_workers' threads with the given 'pngCompression' (0..9)
+            masks are single channel, 8-bit (0/255) or 1-bit ('maskBitDepth')
+            'writeMasksToVideo' (.mkv) writes the masks as a single lossless mask video
+            'writeImagesToFrameStore' writes the images as a memory-mapped frame store
+            'resizeTo' (height, width): images (area) and masks (mask-aware, see imu.resizeMask)
+            are resized while writing, e.g. to the inpaint working size
+        """
 
         if imagelist is None:
             if self.imglist is not None:
@@ -653,17 +700,38 @@ class GroupSequence(TrackSequence):
             if self.combinedMaskList is not None:
                 masklist = self.combinedMaskList
 
+        if resizeTo is not None:
+            height, width = resizeTo
+            if imagelist is not None:
+                imagelist = imu.MappedSequence(imagelist, 
+                    lambda im: cv2.resize(im, (width, height), interpolation=cv2.INTER_AREA))
+            if masklist is not None:
+                masklist = imu.MappedSequence(masklist, lambda msk: imu.resizeMask(msk, resizeTo))
+
         # write images (which are paired with masks)
         if (writeImagesToDirectory is not None) and (imagelist is not None):
             imu.writeImagesToDirectory(imagelist,writeImagesToDirectory,
                                        minPadLength=5,
-                                       cleanDirectory=cleanDirectory)
+                                       cleanDirectory=cleanDirectory,
+                                       pngCompression=pngCompression,
+                                       n_workers=n_workers,
+                                       verbose=verbose)
+
+        if (writeImagesToFrameStore is not None) and (imagelist is not None):
+            imu.FrameStore.fromFrames(writeImagesToFrameStore, imagelist)
 
         # write masks (which are paired with masks)
         if (writeMasksToDirectory is not None) and (masklist is not None) :
             imu.writeMasksToDirectory(masklist,writeMasksToDirectory,
                                        minPadLength=5,
-                                       cleanDirectory=cleanDirectory)
+                                       cleanDirectory=cleanDirectory,
+                                       pngCompression=pngCompression,
+                                       n_workers=n_workers,
+                                       verbose=verbose,
+                                       bitDepth=maskBitDepth)
+
+        if (writeMasksToVideo is not None) and (masklist is not None):
+            imu.writeMaskVideo(masklist, writeMasksToVideo)
         
         return True
 
@@ -713,14 +781,19 @@ class GroupSequence(TrackSequence):
 
         outims = []
         outrenders = []
+        labels = None
+        lut = imu.colorLUT(self.thing_colors)
         for i,im in enumerate(self.imglist):
             if useMasks:
                 msks = seqMasks[i] 
-                if isinstance(msks,list):
-                    for gi,msk in enumerate(msks):
-                        im = imu.maskImage(im,msk,self.thing_colors[gi])
-                else:
-                    im = imu.maskImage(im,msks,self.thing_colors[0])
+                if not isinstance(msks,list):
+                    msks = [msks]
+                if any([len(m) for m in msks]):
+                    # all instances are drawn in one pass, the label map buffer is reused
+                    if labels is None:
+                        labels = np.zeros(im.shape[:2], dtype=np.uint16)
+                    labels = imu.masksToLabelMap(msks, labelmap=labels)
+                    im = imu.overlayLabels(im, labels, lut)
 
                 
             outims.append(im)
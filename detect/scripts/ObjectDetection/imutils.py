@@ -1,8 +1,18 @@
 # Basic image utilities 
 
 import os
+import json
+import struct
+import tempfile
+import warnings
 from glob import glob
+from time import time, sleep
+from collections import deque
 import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Thread
+from itertools import chain
 
 # import some common libraries
 import cv2
@@ -16,11 +26,131 @@ fontconfig = {
     "lineType"     : 3
 }
 
+# ---------------
+# Memory-mapped frame store
+
+class FrameStore:
+    """
+        Raw frame store: a single file holding a (frames,h,w,channels) uint8 array
+        behind a small header, accessed through np.memmap. Frames are neither encoded
+        nor decoded, indexing returns views (no copies), and processes opening the 
+        same store share the frames through the page cache.
+    """
+    magic = b'VORFRAME'
+    headerFormat = '<8sIIIIId'  # magic, version, n_frames, height, width, channels, fps
+    headerSize = 4096           # frame data is page aligned
+
+    def __init__(self, filePath, mode='r'):
+        assert mode in ('r', 'r+'), f"Invalid frame store mode '{mode}' given"
+        with open(filePath, 'rb') as fp:
+            header = fp.read(struct.calcsize(self.headerFormat))
+
+        magic,version,n_frames,height,width,channels,fps = struct.unpack(self.headerFormat, header)
+        assert magic == self.magic, f"Not a frame store file: {filePath}"
+
+        self.filePath = filePath
+        self.fps = fps
+        self.frames = np.memmap(filePath, dtype=np.uint8, mode=mode, offset=self.headerSize,
+                                shape=(n_frames,height,width,channels))
+
+    @classmethod
+    def __header(cls, n_frames, height, width, channels, fps):
+        return struct.pack(cls.headerFormat, cls.magic, 1, n_frames, height, width, channels, fps) \
+                     .ljust(cls.headerSize, b'\0')
+
+    @classmethod
+    def create(cls, filePath, n_frames, heightWidth, channels=3, fps=0.0):
+        """
+            creates an empty (zero filled, sparse) store, opened for writing
+        """
+        height,width = heightWidth
+        with open(filePath, 'wb') as fp:
+            fp.write(cls.__header(n_frames, height, width, channels, fps))
+            fp.truncate(cls.headerSize + n_frames * height * width * channels)
+
+        return cls(filePath, mode='r+')
+
+    @classmethod
+    def fromFrames(cls, filePath, frames, fps=0.0):
+        """
+            writes an iterable of frames (e.g. a generator) to a new store,
+            one frame at a time, the frame count does not need to be known
+        """
+        n_frames = 0
+        shape = None
+        with open(filePath, 'wb') as fp:
+            fp.write(b'\0' * cls.headerSize)
+            for frame in frames:
+                if shape is None:
+                    shape = frame.shape
+                assert frame.shape == shape, f"Frame shape {frame.shape} does not match store shape {shape}"
+                fp.write(memoryview(np.ascontiguousarray(frame, dtype=np.uint8)))
+                n_frames += 1
+
+            assert n_frames > 0, "Cannot make frame store without frames"
+            height,width = shape[:2]
+            channels = shape[2] if len(shape) == 3 else 1
+            fp.seek(0)
+            fp.write(cls.__header(n_frames, height, width, channels, fps))
+
+        return cls(filePath)
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    def __getitem__(self, index):
+        return np.asarray(self.frames[index])   # ndarray view of the mapped frames
+
+    def __setitem__(self, index, frame):
+        self.frames[index] = frame
+
+    def __iter__(self):
+        return ( self[i] for i in range(len(self)) )
+
+    @property
+    def shape(self):
+        return self.frames.shape
+
+    def flush(self):
+        self.frames.flush()
+
+    def close(self):
+        if self.frames.mode != 'r':
+            self.flush()
+        del self.frames
+
+
+def isFrameStore(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as fp:
+        return fp.read(len(FrameStore.magic)) == FrameStore.magic
+
+
+def videofileToFrameStore(videofile, filePath):
+    """
+        decodes a video file (.mp4, .avi, or .mov) into a frame store
+        returns the number of frames
+    """
+    def frames():
+        cap = cv2.VideoCapture(videofile)
+        while True:
+            ret,frame = cap.read()
+            if not ret:
+                cap.release()
+                break
+            yield frame
+
+    return len(FrameStore.fromFrames(filePath, frames(), fps=get_fps(videofile)))
+
+
 # ---------------
 # video editing tools
 
 def get_fourcc_string(vfile):
-    if not os.path.isdir(vfile):
+    if isFrameStore(vfile):
+        return None
+    elif not os.path.isdir(vfile):
         cap = cv2.VideoCapture(vfile)
         vcodec = cap.get(cv2.CAP_PROP_FOURCC)
         vcodecstr = "".join([chr((int(vcodec) >> 8 * i) & 0xFF) for i in range(4)])
@@ -30,7 +160,9 @@ def get_fourcc_string(vfile):
         return None
 
 def get_fps(vfile):
-    if not os.path.isdir(vfile):
+    if isFrameStore(vfile):
+        return FrameStore(vfile).fps or None
+    elif not os.path.isdir(vfile):
         cap = cv2.VideoCapture(vfile)
         fps = cap.get(cv2.CAP_PROP_FPS)
         cap.release()
@@ -40,7 +172,9 @@ def get_fps(vfile):
 
 
 def get_nframes(vfile):
-    if not os.path.isdir(vfile):
+    if isFrameStore(vfile):
+        n_frames = len(FrameStore(vfile))
+    elif not os.path.isdir(vfile):
         cap = cv2.VideoCapture(vfile)
         n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         cap.release()
@@ -55,7 +189,9 @@ def get_nframes(vfile):
 
 
 def get_WidthHeight(vfile):
-    if not os.path.isdir(vfile):
+    if isFrameStore(vfile):
+        height,width = FrameStore(vfile).shape[1:3]
+    elif not os.path.isdir(vfile):
         cap = cv2.VideoCapture(vfile)
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
@@ -71,8 +207,115 @@ def get_WidthHeight(vfile):
     return (width, height) 
 
 
-def get_frame(vfile, n_frames, startframe=0, finishframe=None):
-    if os.path.isdir(vfile):
+class FFMPEGFrameReader:
+    """
+        Alternative decode backend to cv2.VideoCapture: ffmpeg decodes on 'threads'
+        threads (0=auto), optionally crops (x,y,w,h) and scales (w,h) in the filter
+        graph, and writes bgr24 frames to a rawvideo pipe.
+        With 'ringSize' frames are read into a ring of preallocated buffers (no allocation
+        per frame), a yielded frame is then only valid for the next 'ringSize'-1 frames.
+        Without 'ringSize' every frame is read into a new array.
+    """
+    def __init__(self, vfile, startframe=0, finishframe=None, crop=None, scale=None,
+                 threads=0, ringSize=None):
+        width,height = get_WidthHeight(vfile)
+        fps = get_fps(vfile)
+
+        filters = []
+        if crop is not None:
+            x,y,width,height = crop
+            filters.append(f"crop={width}:{height}:{x}:{y}")
+        if scale is not None:
+            width,height = scale
+            filters.append(f"scale={width}:{height}")
+
+        command = ['ffmpeg', '-loglevel', 'error',
+                   '-threads', str(threads),
+                   *(['-ss', f"{startframe / fps:.6f}"] if startframe else []),  # accurate input seek
+                   '-i', vfile,
+                   *(['-vf', ",".join(filters)] if filters else []),
+                   *(['-frames:v', str(finishframe - startframe)] if finishframe is not None else []),
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+                   '-']
+
+        self.frameShape = (height,width,3)
+        self.ring = [ np.empty(self.frameShape, dtype=np.uint8) for _ in range(ringSize) ] \
+                    if ringSize else None
+        self.pipe = sp.Popen(command, stdout=sp.PIPE, stderr=sp.DEVNULL, bufsize=10**7)
+
+    def __readInto(self, frame):
+        view = memoryview(frame).cast('B')
+        nread = 0
+        while nread < len(view):
+            n = self.pipe.stdout.readinto(view[nread:])
+            if not n:
+                return False
+            nread += n
+        return True
+
+    def __iter__(self):
+        i = 0
+        try:
+            while True:
+                frame = self.ring[i % len(self.ring)] if self.ring else \
+                        np.empty(self.frameShape, dtype=np.uint8)
+                if not self.__readInto(frame):
+                    break
+                yield frame
+                i += 1
+        finally:
+            self.release()
+
+    def release(self):
+        if self.pipe.poll() is None:
+            self.pipe.stdout.close()
+            self.pipe.terminate()
+        self.pipe.wait()
+
+
+def compareDecodeBackends(vfile, n_frames=None, threads=0):
+    """
+        Decodes (up to 'n_frames' of) 'vfile' with cv2.VideoCapture and with the
+        ffmpeg rawvideo reader (buffer ring), returns the decode rates (frames/s)
+    """
+    res = {}
+
+    start = time()
+    cap = cv2.VideoCapture(vfile)
+    n = 0
+    while n_frames is None or n < n_frames:
+        ret,frame = cap.read()
+        if not ret: break
+        n += 1
+    cap.release()
+    res['opencv'] = n / (time() - start)
+
+    start = time()
+    n = 0
+    for frame in FFMPEGFrameReader(vfile, finishframe=n_frames, threads=threads, ringSize=2):
+        n += 1
+    res['ffmpeg'] = n / (time() - start)
+
+    res['speedup'] = res['ffmpeg'] / res['opencv']
+    return res
+
+
+def get_frame(vfile, n_frames, startframe=0, finishframe=None, backend='opencv', ringSize=None):
+    """
+        generator of frames from a video file, directory of frames or frame store
+        video files are decoded by 'backend': 'opencv' (cv2.VideoCapture) or 
+        'ffmpeg' (FFMPEGFrameReader, optionally reusing a ring of 'ringSize' buffers)
+    """
+    if isFrameStore(vfile):
+        # frames are views of the mapped store (no decode, no copy)
+        store = FrameStore(vfile)
+        if finishframe is None:
+            finishframe = len(store)
+
+        for i in range(startframe, min(finishframe, len(store))):
+            yield store[i]
+
+    elif os.path.isdir(vfile):
         images = glob(os.path.join(vfile, '*.jp*'))
         if not images:
             images = glob(os.path.join(vfile, '*.png'))
@@ -94,6 +337,12 @@ def get_frame(vfile, n_frames, startframe=0, finishframe=None):
             frame = cv2.imread(img)
             yield frame
 
+    elif backend == 'ffmpeg':
+        # finish frame is included, as for the opencv backend
+        yield from FFMPEGFrameReader(vfile, startframe=startframe, 
+                                     finishframe=finishframe + 1 if finishframe is not None else None,
+                                     ringSize=ringSize)
+
     else:
         cap = cv2.VideoCapture(vfile)
 
@@ -167,15 +416,19 @@ def bboxToMask(bbox,maskShape):
     return bbmask
 
 
-def combineMasks(maskList):
+def combineMasks(maskList, shape=None):
     """
         Combines the list of masks into a single mask
+        'shape': (height, width) of the empty mask returned for an empty list
     """
     # single mask passed
     if not isinstance(maskList,list):
         return maskList   
     elif len(maskList) == 1:
         return maskList[0]     
+    elif len(maskList) == 0:
+        assert shape is not None, "Shape required to combine an empty mask list"
+        return np.zeros(shape[:2], dtype=bool)
 
     masks = [ m for m in maskList if len(m) ]
     maskcomb = masks.pop(0).copy() 
@@ -185,6 +438,79 @@ def combineMasks(maskList):
     return maskcomb
 
 
+def maskedFrameRuns(maskList, margin=5):
+    """
+        Frame ranges [(start, finish), ...] that need inpainting: runs of frames
+        with masked pixels, extended by 'margin' context frames on each side.
+        Overlapping or touching ranges are merged.
+    """
+    return frameRuns([ np.any(msk) for msk in maskList ], margin)
+
+
+def frameRuns(flags, margin=5):
+    """
+        Frame ranges [(start, finish), ...] covering the frames where 'flags' is True,
+        extended by 'margin' frames on each side, overlapping or touching ranges merged
+    """
+    n_frames = len(flags)
+    runs = []
+    for i,flag in enumerate(flags):
+        if not flag:
+            continue
+        start, finish = max(0, i - margin), min(n_frames, i + margin + 1)
+        if runs and start <= runs[-1][1]:
+            runs[-1] = (runs[-1][0], finish)
+        else:
+            runs.append((start, finish))
+
+    return runs
+
+
+def maskUnionROI(maskList, padding=32, multiple=8):
+    """
+        Bounding region (y0, y1, x0, x1) of the union of all masks in 'maskList',
+        grown by 'padding' pixels and rounded out to a 'multiple' of pixels, 
+        clipped to the frame. None if nothing is masked
+    """
+    union = np.zeros(maskList[0].shape[:2], dtype=bool)
+    for msk in maskList:
+        union |= msk.astype(bool)
+    rows, cols = np.flatnonzero(union.any(axis=1)), np.flatnonzero(union.any(axis=0))
+    if len(rows) == 0:
+        return None
+
+    height, width = union.shape
+    y0 = max(0, (rows[0] - padding) // multiple * multiple)
+    x0 = max(0, (cols[0] - padding) // multiple * multiple)
+    y1 = min(height, int(ceil((rows[-1] + 1 + padding) / multiple)) * multiple)
+    x1 = min(width, int(ceil((cols[-1] + 1 + padding) / multiple)) * multiple)
+    return (int(y0), int(y1), int(x0), int(x1))
+
+
+def inpaintInputSize(heightWidth, maxHeightWidth=(512,1024), multiple=64):
+    """
+        Inpaint working size for a region of 'heightWidth': downscaled to fit
+        'maxHeightWidth' (aspect kept, never upscaled), rounded up to a 'multiple'
+    """
+    height, width = heightWidth
+    scale = min(1.0, maxHeightWidth[0] / height, maxHeightWidth[1] / width)
+    return (min(maxHeightWidth[0], int(ceil(height * scale / multiple)) * multiple),
+            min(maxHeightWidth[1], int(ceil(width * scale / multiple)) * multiple))
+
+
+def pasteROI(im, patch, roi):
+    """
+        Pastes 'patch' (resized to the region if needed) into a copy of 'im' at 
+        roi = (y0, y1, x0, x1)
+    """
+    y0,y1,x0,x1 = roi
+    if patch.shape[:2] != (y1 - y0, x1 - x0):
+        patch = cv2.resize(patch, (x1 - x0, y1 - y0), interpolation=cv2.INTER_CUBIC)
+    res = im.copy()
+    res[y0:y1,x0:x1] = patch
+    return res
+
+
 def maskImage(im, mask, mask_color=(0,0,255), inplace=False):
     if inplace:
         outim = im
@@ -192,11 +518,62 @@ def maskImage(im, mask, mask_color=(0,0,255), inplace=False):
         outim = im.copy()
 
     if not isinstance(mask,list):
-        for i in range(3):
-            outim[:,:,i] = (mask > 0) * mask_color[i] + (mask == 0) * outim[:, :, i]
+        # only the masked pixels are written
+        outim[mask if mask.dtype == np.bool_ else mask > 0] = mask_color
 
     return outim
 
+
+def colorLUT(colors):
+    """
+        colour lookup table for overlayLabels(), row 0 (background) is unused
+    """
+    return np.array([(0,0,0), *colors], dtype=np.uint8).reshape(-1,3)
+
+
+def masksToLabelMap(masks, heightWidth=None, labelmap=None):
+    """
+        converts a list of masks (bool or uint8) to a label map (dtype=np.uint16),
+        where pixels are the index+1 of the last mask covering them and 0 elsewhere
+        'heightWidth' is the frame shape (masks may be empty [] placeholders, or none at all)
+        'labelmap' is an optional (h,w) uint16 buffer to reuse
+    """
+    if labelmap is None:
+        assert heightWidth is not None, "Frame shape ('heightWidth' or 'labelmap') required"
+        labelmap = np.zeros(heightWidth[:2], dtype=np.uint16)
+    else:
+        labelmap.fill(0)
+
+    for i,msk in enumerate(masks):
+        if not len(msk): continue
+        labelmap[msk if msk.dtype == np.bool_ else msk > 0] = i + 1
+
+    return labelmap
+
+
+def overlayLabels(im, labelmap, lut, alpha=1.0, out=None):
+    """
+        draws every labelled instance of a frame in one vectorized pass:
+        pixels with label l > 0 get colour lut[l] (alpha=1) or are blended with it (alpha<1)
+        'out' is the output buffer: None (copy of im), im (in place) or a reused buffer
+    """
+    if out is None:
+        out = im.copy()
+    elif out is not im:
+        np.copyto(out, im)
+
+    if labelmap.dtype == np.bool_:
+        labelmap = labelmap.view(np.uint8)
+
+    sel = labelmap > 0
+    colors = lut[labelmap[sel]]
+    if alpha >= 1.0:
+        out[sel] = colors
+    else:
+        out[sel] = (out[sel] * (1.0 - alpha) + colors * alpha).astype(np.uint8)
+
+    return out
+
 def maskToImg(mask, toThreeChannel=False):
     """
         converts a mask(dtype=np.bool) to cv2 compatable image (dytpe=np.uint8)
@@ -257,14 +634,144 @@ def dilateErodeMask(mask, actionList=['dilate'], kernelShape='rect', maskHalfWid
     return maskout
 
 
-def videofileToFramesDirectory(videofile,dirPath,padlength=5,imgtype='png',cleanDirectory=True):
+def fillFromBackground(frame, mask, sampleFrames, sampleMasks):
     """
-        writes a video file (.mp4, .avi, or .mov) to frames directory
-        Here, it is understood that images are an np.array, dtype='uint8' 
-        of shape (w,h,3)
+        Fills the masked pixels of 'frame' with the per-pixel median of the unmasked 
+        samples at the same position in 'sampleFrames' (static camera background plate).
+        Only the masked pixels are gathered from the samples.
+        Returns (filled frame, uint8 mask of the pixels without any valid sample)
     """
-    assert imgtype in ('png', 'jpg'), f"Invalid image type '{imgtype}' given"
+    ys, xs = np.nonzero(mask)
+    res = frame.copy()
+    missing = np.zeros(mask.shape[:2], dtype=np.uint8)
+    if len(ys) == 0:
+        return res, missing
+
+    samples = np.stack([ f[ys,xs] for f in sampleFrames ]).astype(np.float32)    # (n, K, 3)
+    valid = ~np.stack([ m[ys,xs] for m in sampleMasks ]).astype(bool)           # (n, K)
+    samples[~valid] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)   # all-NaN columns: no valid sample
+        median = np.nanmedian(samples, axis=0)
+
+    found = valid.any(axis=0)
+    res[ys[found],xs[found]] = np.clip(median[found] + 0.5, 0, 255).astype(np.uint8)
+    missing[ys[~found],xs[~found]] = 255
+    return res, missing
+
+
+def resizeMask(mask, heightWidth):
+    """
+        Mask-aware resizing to 'heightWidth': when downsizing, a target pixel is masked
+        if any part of its source area is (area resampling > 0), so thin masks are not lost.
+        Upsizing is nearest neighbour. Returns a bool mask
+    """
+    height, width = heightWidth
+    if height <= mask.shape[0] and width <= mask.shape[1]:
+        return cv2.resize(mask.astype(np.float32), (width, height), interpolation=cv2.INTER_AREA) > 0
+    return cv2.resize(mask.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST) > 0
+
+
+class MappedSequence:
+    """
+        Read-only sequence applying 'fn' to the items of 'seq' on access,
+        no transformed copies are held
+    """
+    def __init__(self, seq, fn):
+        self.seq = seq
+        self.fn = fn
+
+    def __len__(self):
+        return len(self.seq)
+
+    def __getitem__(self, i):
+        return self.fn(self.seq[i])
 
+    def __iter__(self):
+        return ( self.fn(item) for item in self.seq )
+
+
+def featherMask(mask, dilation=7, feather=7):
+    """
+        Blending weights (float32, 0..1) for 'mask': dilated by 'dilation' pixels,
+        the edge ramps down over 'feather' pixels, the mask itself is always 1
+    """
+    alpha = mask.astype(np.float32)
+    if dilation > 0:
+        alpha = cv2.dilate(alpha, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2*dilation+1, 2*dilation+1)))
+    if feather > 0:
+        alpha = cv2.GaussianBlur(alpha, (2*feather+1, 2*feather+1), 0)
+    return np.maximum(alpha, mask.astype(np.float32))
+
+
+def compositeInpainted(original, inpainted, mask, dilation=7, feather=7):
+    """
+        Blends the (lower resolution) inpaint result into the full resolution 'original'.
+        Only the bounding region of the feathered, dilated 'mask' is upsampled (bicubic),
+        all other pixels remain the original ones
+    """
+    alpha = featherMask(mask, dilation, feather)
+    rows, cols = np.flatnonzero(alpha.any(axis=1)), np.flatnonzero(alpha.any(axis=0))
+    res = original.copy()
+    if len(rows) == 0:
+        return res
+
+    y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    sy = inpainted.shape[0] / original.shape[0]
+    sx = inpainted.shape[1] / original.shape[1]
+    # maps region pixel (u,v) to its (pixel center aligned) position in 'inpainted'
+    M = np.float32([[sx, 0, (x0 + 0.5) * sx - 0.5],
+                    [0, sy, (y0 + 0.5) * sy - 0.5]])
+    upsampled = cv2.warpAffine(inpainted, M, (int(x1 - x0), int(y1 - y0)),
+                               flags=cv2.INTER_CUBIC | cv2.WARP_INVERSE_MAP,
+                               borderMode=cv2.BORDER_REPLICATE)
+
+    a = alpha[y0:y1,x0:x1,None]
+    res[y0:y1,x0:x1] = np.clip(a * upsampled + (1.0 - a) * original[y0:y1,x0:x1] + 0.5, 0, 255).astype(np.uint8)
+    return res
+
+
+def compositeInpaintedSequence(originals, inpaintedList, maskList, dilation=7, feather=7, n_workers=None):
+    """
+        Generator of the full resolution composites (see compositeInpainted), in order.
+        'inpaintedList' holds frames or image file paths, frames are composited on a
+        thread pool with at most 2*n_workers frames pending
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    def composite(original, inpainted, mask):
+        inpainted = cv2.imread(inpainted) if isinstance(inpainted,str) else inpainted
+        return compositeInpainted(original, inpainted, mask, dilation, feather)
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for original,inpainted,mask in zip(originals, inpaintedList, maskList):
+            pending.append(pool.submit(composite, original, inpainted, mask))
+            if len(pending) > 2 * n_workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def writeInpaintResultsToVideo(results, filePath, fps=30, originals=None, maskList=None, useFFMPEGdirect=True):
+    """
+        Writes inpaint 'results' (frames or image file paths, in frame order) to 'filePath',
+        with 'originals' and 'maskList' only the masked pixels are composited into the 
+        full resolution originals (see compositeInpaintedSequence).
+        Image files are decoded in parallel, frames are streamed to the encoder
+    """
+    if originals is not None:
+        frames = compositeInpaintedSequence(originals, results, maskList)
+    elif isinstance(results, (list, tuple)) and len(results) and isinstance(results[0], str):
+        frames = readImageFiles(results)
+    else:
+        frames = results
+    return writeFramesToVideo(frames, filePath=filePath, fps=fps, useFFMPEGdirect=useFFMPEGdirect)
+
+
+def __prepareDirectory(dirPath, imgtype, cleanDirectory):
     if not os.path.isdir(dirPath):
         path = '/' if dirPath.startswith("/") else ''
         for d in dirPath.split('/'):
@@ -276,88 +783,346 @@ def videofileToFramesDirectory(videofile,dirPath,padlength=5,imgtype='png',clean
         for f in glob(os.path.join(dirPath,"*." + imgtype)):
             os.remove(f) # danger Will Robinson
 
-    cap = cv2.VideoCapture(videofile)
+
+def imwriteParams(imgtype='png', pngCompression=1, jpgQuality=95):
+    """
+        cv2.imwrite parameters for the given image type
+        'pngCompression' 0 (fastest, largest) .. 9 (slowest, smallest), OpenCV default=1
+        'jpgQuality' 0 .. 100 (best), OpenCV default=95
+    """
+    if imgtype == 'png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(pngCompression)]
+    elif imgtype == 'jpg':
+        return [cv2.IMWRITE_JPEG_QUALITY, int(jpgQuality)]
+    else:
+        return []
+
+
+def writeImageFiles(fnameImagePairs, params=None, n_workers=None, verbose=False):
+    """
+        writes (filename, image) pairs, with the encoding performed on a thread pool
+        (cv2.imwrite releases the GIL). 'fnameImagePairs' may be a generator,
+        at most 2*n_workers images are held pending
+        returns the number of images written
+    """
+    if params is None:
+        params = []
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    def imwrite(fname, img):
+        assert cv2.imwrite(fname, img, params), f"Could not write image file {fname}"
+
+    start = time()
     n = 0
-    while True:
-        ret,frame = cap.read()
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for fname,img in fnameImagePairs:
+            pending.append(pool.submit(imwrite, fname, img))
+            if len(pending) > 2 * n_workers:
+                pending.popleft().result()
+            n += 1
 
-        if not ret:
-            cap.release()
-            break
-        fname = str(n).rjust(padlength,'0') + '.' + imgtype
-        cv2.imwrite(os.path.join(dirPath,fname),frame)
+        for job in pending:
+            job.result()
 
-        n += 1
+    elapsed = time() - start
+    if verbose and n:
+        print(f"Wrote {n} images in {elapsed:.2f}s ({n / max(elapsed,1e-6):.1f} images/s)")
 
     return n
 
 
-def writeImagesToDirectory(imageList,dirPath,minPadLength=None,imgtype='png',cleanDirectory=False):
+def readImageFiles(fileList, n_workers=None):
     """
-        writes flat list of image arrays to directory
+        Generator of the decoded images of 'fileList', in order. Decoding runs on 
+        a thread pool (cv2.imread releases the GIL), at most 2*n_workers images pending
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for fname in fileList:
+            pending.append(pool.submit(cv2.imread, fname))
+            if len(pending) > 2 * n_workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def watchImageFiles(dirPath, isFinished, n_frames=None, n_workers=None, pollInterval=0.5, pattern="*.png"):
+    """
+        Generator of the images written to 'dirPath' by a running job, in frame order.
+        File names are the frame indices (0, 1, ... zero padded, e.g. 00012.png), written in
+        any order: frame i is taken once its file exists and its size is stable between
+        two polls (or the job is finished), and decoded on a thread pool.
+        'isFinished()' tells if the job ended, the generator then drains the remaining
+        frames, up to 'n_frames' if given (else up to the highest index written).
+        A frame still missing after the job finished raises an exception
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    def imread(fname):
+        img = cv2.imread(fname)
+        assert img is not None, f"Could not read image file {fname}"
+        return img
+
+    def frameIndex(fname):
+        stem = os.path.splitext(os.path.basename(fname))[0]
+        if not stem.isdigit():
+            raise Exception(f"Result file name is not a frame index: {fname}")
+        return int(stem)
+
+    nextIndex = 0
+    sizes = {}
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        while n_frames is None or nextIndex < n_frames:
+            finished = isFinished()     # checked first: files listed afterwards are complete
+            files = { frameIndex(f): f for f in glob(os.path.join(dirPath, pattern)) } \
+                    if os.path.isdir(dirPath) else {}
+
+            while nextIndex in files and (n_frames is None or nextIndex < n_frames):
+                fname = files[nextIndex]
+                size = os.path.getsize(fname)
+                if not finished and (size == 0 or sizes.get(fname) != size):
+                    sizes[fname] = size     # possibly still being written
+                    break
+                pending.append(pool.submit(imread, fname))
+                nextIndex += 1
+
+            while pending and (pending[0].done() or len(pending) > 2 * n_workers):
+                yield pending.popleft().result()
+
+            if finished and nextIndex not in files:
+                expected = n_frames if n_frames is not None else max(files, default=-1) + 1
+                if nextIndex < expected:
+                    raise Exception(f"Result frame {nextIndex} is missing in {dirPath}")
+                break
+            if not pending or not pending[0].done():
+                sleep(pollInterval)
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def videofileToFramesDirectory(videofile,dirPath,padlength=5,imgtype='png',cleanDirectory=True,
+                               pngCompression=1, jpgQuality=95, n_workers=None, verbose=False,
+                               backend='opencv'):
+    """
+        writes a video file (.mp4, .avi, or .mov) to frames directory
         Here, it is understood that images are an np.array, dtype='uint8' 
         of shape (w,h,3)
+        frames are decoded here ('backend' = 'opencv' or 'ffmpeg') and encoded on 'n_workers' threads
     """
     assert imgtype in ('png', 'jpg'), f"Invalid image type '{imgtype}' given"
+    assert backend in ('opencv', 'ffmpeg'), f"Invalid decode backend '{backend}' given"
+    __prepareDirectory(dirPath, imgtype, cleanDirectory)
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    def frames():
+        if backend == 'ffmpeg':
+            # ring must outlast the frames pending in writeImageFiles
+            decoded = FFMPEGFrameReader(videofile, ringSize=2 * n_workers + 2)
+            for n,frame in enumerate(decoded):
+                fname = str(n).rjust(padlength,'0') + '.' + imgtype
+                yield os.path.join(dirPath,fname), frame
+            return
+
+        cap = cv2.VideoCapture(videofile)
+        n = 0
+        while True:
+            ret,frame = cap.read()
 
-    if not os.path.isdir(dirPath):
-        path = '/' if dirPath.startswith("/") else ''
-        for d in dirPath.split('/'):
-            if not d: continue
-            path += d + '/'
-            if not os.path.isdir(path):
-                os.mkdir(path)
-    elif cleanDirectory:
-        for f in glob(os.path.join(dirPath,"*." + imgtype)):
-            os.remove(f) # danger Will Robinson
+            if not ret:
+                cap.release()
+                break
+            fname = str(n).rjust(padlength,'0') + '.' + imgtype
+            yield os.path.join(dirPath,fname), frame
+
+            n += 1
+
+    return writeImageFiles(frames(), params=imwriteParams(imgtype, pngCompression, jpgQuality),
+                           n_workers=n_workers, verbose=verbose)
+
+
+def writeImagesToDirectory(imageList,dirPath,minPadLength=None,imgtype='png',cleanDirectory=False,
+                           pngCompression=1, jpgQuality=95, n_workers=None, verbose=False):
+    """
+        writes flat list of image arrays to directory
+        Here, it is understood that images are an np.array, dtype='uint8' 
+        of shape (w,h,3)
+    """
+    assert imgtype in ('png', 'jpg'), f"Invalid image type '{imgtype}' given"
+    __prepareDirectory(dirPath, imgtype, cleanDirectory)
 
     n_frames = len(imageList)
     padlength = ceil(log10(n_frames)) if minPadLength is None else minPadLength    
-    for i,img in enumerate(imageList):
-        fname = str(i).rjust(padlength,'0') + '.' + imgtype
-        fname = os.path.join(dirPath,fname)
-        cv2.imwrite(fname,img)
-    
-    return n_frames
+    fnames = [ os.path.join(dirPath, str(i).rjust(padlength,'0') + '.' + imgtype) for i in range(n_frames) ]
 
+    return writeImageFiles(zip(fnames,imageList), params=imwriteParams(imgtype, pngCompression, jpgQuality),
+                           n_workers=n_workers, verbose=verbose)
 
-def writeMasksToDirectory(maskList,dirPath,minPadLength=None,imgtype='png',cleanDirectory=False):
+
+def maskToUint8(mask):
+    """
+        converts a single mask (dtype bool or uint8, shape (h,w)) to a single channel
+        0/255 uint8 image in one pass, without widened temporaries
+    """
+    if mask.dtype == np.bool_:
+        mask = mask.view(np.uint8)
+    assert mask.dtype == np.uint8, f"Expected bool or uint8 mask, got dtype={mask.dtype}"
+    return cv2.compare(mask, 0, cv2.CMP_GT)
+
+
+def writeMasksToDirectory(maskList,dirPath,minPadLength=None,imgtype='png',cleanDirectory=False,
+                          pngCompression=1, jpgQuality=95, n_workers=None, verbose=False,
+                          bitDepth=8):
     """
         writes flat list of mask arrays to directory
-        Here, it is understood that mask is an np.array,dtype='bool'
-        of shape (w,h), will be output to (w,h,3) for compatibility
+        Here, it is understood that mask is an np.array, dtype='bool' or 'uint8'
+        of shape (h,w), or 'maskList' is a preallocated (frames,h,w) mask stack
+        Masks are output as single channel PNGs, 8-bit (0/255) or, for
+        bitDepth=1 (png only), as 1-bit PNGs written straight from the mask buffer
     """
     assert imgtype in ('png', 'jpg'), f"Invalid image type '{imgtype}' given"
-
-    if not os.path.isdir(dirPath):
-        path = '/' if dirPath.startswith("/") else ''
-        for d in dirPath.split('/'):
-            if not d: continue
-            path += d + '/'
-            if not os.path.isdir(path):
-                os.mkdir(path)
-    elif cleanDirectory:
-        for f in glob(os.path.join(dirPath,"*." + imgtype)):
-            os.remove(f) # danger Will Robinson
+    assert bitDepth in (1, 8), f"Invalid mask bit depth '{bitDepth}' given"
+    assert bitDepth == 8 or imgtype == 'png', "1-bit masks are only supported for png"
+    __prepareDirectory(dirPath, imgtype, cleanDirectory)
 
     n_frames = len(maskList)
     padlength = ceil(log10(n_frames)) if minPadLength is None else minPadLength    
-    for i,msk in enumerate(maskList):
-        fname = str(i).rjust(padlength,'0') + '.' + imgtype
-        fname = os.path.join(dirPath,fname)
-        cv2.imwrite(fname,msk * 255)
-    
-    return n_frames
+    fnames = [ os.path.join(dirPath, str(i).rjust(padlength,'0') + '.' + imgtype) for i in range(n_frames) ]
+
+    params = imwriteParams(imgtype, pngCompression, jpgQuality)
+    if bitDepth == 1:
+        # libpng packs any non-zero value to 1, bool masks are used as is (0/1 uint8 view)
+        params += [cv2.IMWRITE_PNG_BILEVEL, 1]
+        pairs = ( (fname, msk.view(np.uint8) if msk.dtype == np.bool_ else msk) 
+                  for fname,msk in zip(fnames,maskList) )
+    else:
+        pairs = ( (fname, maskToUint8(msk)) for fname,msk in zip(fnames,maskList) )
+
+    return writeImageFiles(pairs, params=params, n_workers=n_workers, verbose=verbose)
+
+
+class FFMPEGVideoWriter:
+    """
+        Streaming H264 encoder, with a cv2.VideoWriter-like interface (write/release)
+        Frames (BGR, dtype='uint8') are piped to ffmpeg as 'bgr24' by a background
+        thread, so at most 'queueSize' frames are held in memory at any time.
+        'pixFmt'='gray' with 'codecArgs' (e.g. ffv1) writes single channel frames
+        Note: frames are queued by reference, do not modify a frame after write()
+    """
+    def __init__(self, filePath, fps, widthHeight, bitrate='1500k', queueSize=16, extraArgs=None,
+                 pixFmt='bgr24', codecArgs=None):
+        assert filePath.endswith((".mp4",".ts",".mkv")), "Cannot use non-mp4 formats with ffmpeg"
+        assert pixFmt in ('bgr24','gray'), f"Unsupported input pixel format {pixFmt}"
+        width,height = widthHeight
+        self.filePath = filePath
+        self.frameShape = (height,width,3) if pixFmt == 'bgr24' else (height,width)
+        self.n_frames = 0
+        self.__error = None
+        self.__stderr = []
+
+        command = ['ffmpeg',
+                   '-y',  # overwrite output file if it exists
+                   '-loglevel', 'error',
+                   '-f', 'rawvideo',
+                   '-s', f'{width}x{height}',  # size of one frame
+                   '-pix_fmt', pixFmt,         # bgr24 is the OpenCV channel order, no channel swap needed
+                   '-r', str(fps),             # frames per second
+                   '-an',  # Tells FFMPEG not to expect any audio
+                   '-i', '-',  # The input comes from a pipe
+                   *(codecArgs if codecArgs else ['-vcodec', 'libx264', '-b:v', bitrate]),
+                   *(extraArgs if extraArgs else []),
+                   filePath]
+
+        self.pipe = sp.Popen(command, stdin=sp.PIPE, stderr=sp.PIPE)
+        self.queue = Queue(maxsize=queueSize)
+
+        self.writerThread = Thread(target=self.__writeFrames, daemon=True)
+        self.errorThread = Thread(target=self.__readErrors, daemon=True)
+        self.writerThread.start()
+        self.errorThread.start()
+
+    def __writeFrames(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if self.__error is not None:
+                continue    # drain the queue, so that write() never blocks
+            try:
+                self.pipe.stdin.write(memoryview(frame))
+            except (BrokenPipeError, OSError) as e:
+                self.__error = e
+
+        try:
+            self.pipe.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+    def __readErrors(self):
+        for l in self.pipe.stderr:
+            self.__stderr.append(l.decode(errors='replace'))
+
+    def write(self, frame):
+        if self.__error is not None:
+            raise Exception(f"ffmpeg stopped accepting frames: {self.__error}\n" + "".join(self.__stderr))
+
+        assert frame.shape == self.frameShape, \
+            f"Frame shape {frame.shape} does not match video shape {self.frameShape}"
+        
+        self.queue.put(np.ascontiguousarray(frame, dtype=np.uint8))
+        self.n_frames += 1
+
+    def release(self):
+        self.queue.put(None)
+        self.writerThread.join()
+        returncode = self.pipe.wait()
+        self.errorThread.join()
+
+        if returncode != 0 or self.__error is not None:
+            raise Exception(f"ffmpeg failed writing {self.filePath} (code={returncode}):\n" + \
+                            "".join(self.__stderr))
+
+        return self.n_frames
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
 
 
 def writeFramesToVideo(imageList,filePath,fps=30,
-                       fourccstr=None, useFFMPEGdirect=False):
+                       fourccstr=None, useFFMPEGdirect=False,
+                       n_segments=None, gopSize=250):
     """
         Writes given set of frames to video file (platform specific coding)
         format is 'mp4' or 'avi'
+        'imageList' may be any iterable of frames (list, generator, etc.)
+        'n_segments' > 1 encodes GOP-aligned segments in parallel (ffmpeg only,
+        iterables which are not indexable are materialized), see writeFramesToVideoSegmented()
     """
-    assert len(imageList) > 1, "Cannot make video with single frame"
-    height,width =imageList[0].shape[:2]
+    if useFFMPEGdirect and n_segments is not None and n_segments > 1:
+        return writeFramesToVideoSegmented(imageList, filePath, fps=fps,
+                                           n_segments=n_segments, gopSize=gopSize)
+
+    if hasattr(imageList,'__len__'):
+        assert len(imageList) > 1, "Cannot make video with single frame"
+
+    frames = iter(imageList)
+    firstFrame = next(frames, None)
+    assert firstFrame is not None, "Cannot make video without frames"
+    height,width = firstFrame.shape[:2]
+    frames = chain([firstFrame], frames)
 
     dirPath = os.path.dirname(filePath)
     if not os.path.isdir(dirPath):
@@ -372,15 +1137,13 @@ def writeFramesToVideo(imageList,filePath,fps=30,
         # use ffmpeg installed in container (assuming were in container)
         # the ffmpeg, as compiled for Linux, contains the H264 codec 
         # as available in the libx264 library
-        assert filePath.endswith(".mp4"), "Cannot use non-mp4 formats with ffmpeg"
-
-        # assume image list is from OpenCV read.  Thus reverse the channels for the correct colors
-        clip = [ im[:, :, ::-1] for im in imageList]
-        h,w = clip[0].shape[:2] 
+        # frames are streamed (bgr24) to ffmpeg as they are produced
+        outvid = FFMPEGVideoWriter(filePath, fps=fps, widthHeight=(width,height))
+        for im in frames:
+            outvid.write(im)
 
-        clippack = np.stack(clip)
-        out,err = __ffmpegDirect(clippack,outputfile=filePath,fps=fps, size=[h,w])
-        assert os.path.exists(filePath), print(err) 
+        n_frames = outvid.release()
+        assert os.path.exists(filePath), f"Could not write {filePath}"
 
     else:
         # use openCV method
@@ -399,38 +1162,317 @@ def writeFramesToVideo(imageList,filePath,fps=30,
         outvid = cv2.VideoWriter(filePath, fourcc, fps, (width,height) )
 
         # write out frames to video
-        for im in imageList:
+        n_frames = 0
+        for im in frames:
             outvid.write(im)
+            n_frames += 1
 
         outvid.release()
 
-    return len(imageList)
+    return n_frames
+
+
+def __loadFrame(item, transform=None):
+    # frames are either arrays or image file paths
+    frame = cv2.imread(item) if isinstance(item,str) else item
+    return transform(frame) if transform is not None else frame
+
+
+def writeFramesToVideoSegmented(imageList, filePath, fps=30, n_segments=None,
+                                gopSize=250, bitrate='1500k', transform=None):
+    """
+        Splits the frame range into GOP-aligned segments, encodes the segments
+        in parallel ffmpeg processes and joins them (stream copy, lossless) with
+        the ffmpeg concat demuxer.
+        'imageList' is a list of frames or of image file paths (read by the workers),
+        other iterables (e.g. generators) are materialized first, segments index the frames
+        'transform' is an optional function applied to each frame before encoding
+    """
+    assert filePath.endswith(".mp4"), "Cannot use non-mp4 formats with ffmpeg"
+    if not (hasattr(imageList,'__len__') and hasattr(imageList,'__getitem__')):
+        imageList = list(imageList)
+    n_frames = len(imageList)
+    assert n_frames > 1, "Cannot make video with single frame"
+
+    if n_segments is None:
+        n_segments = os.cpu_count() or 1
+
+    # segment lengths are multiples of the GOP size, so keyframe placement
+    # is the same as for the single process encoding
+    n_gops = ceil(n_frames / gopSize)
+    segLength = ceil(n_gops / min(n_segments, n_gops)) * gopSize
+    segRanges = [ (i, min(i + segLength, n_frames)) for i in range(0, n_frames, segLength) ]
+
+    height,width = __loadFrame(imageList[0], transform).shape[:2]
+
+    dirPath = os.path.dirname(os.path.abspath(filePath))
+    if not os.path.isdir(dirPath):
+        os.makedirs(dirPath)
+
+    def encodeSegment(segFile, start, finish):
+        # fixed GOPs: no scene cut keyframes, so every segment starts on a GOP boundary
+        outvid = FFMPEGVideoWriter(segFile, fps=fps, widthHeight=(width,height), bitrate=bitrate,
+                                   extraArgs=['-g', str(gopSize), '-keyint_min', str(gopSize),
+                                              '-x264-params', 'scenecut=0'])
+        for i in range(start, finish):
+            outvid.write(__loadFrame(imageList[i], transform))
+        return outvid.release()
+
+    with tempfile.TemporaryDirectory(dir=dirPath) as tempdir:
+        segFiles = [ os.path.join(tempdir, f"segment_{i:04d}.mp4") for i in range(len(segRanges)) ]
+
+        # ffmpeg (and cv2.imread) release the GIL, threads are sufficient
+        with ThreadPoolExecutor(max_workers=len(segRanges)) as pool:
+            jobs = [ pool.submit(encodeSegment, f, start, finish) 
+                     for f,(start,finish) in zip(segFiles,segRanges) ]
+            written = sum([ j.result() for j in jobs ])
+
+        listFile = os.path.join(tempdir, "segments.txt")
+        with open(listFile, 'w') as fp:
+            fp.writelines([ f"file '{f}'\n" for f in segFiles ])
+
+        command = ['ffmpeg', '-y', '-loglevel', 'error',
+                   '-f', 'concat', '-safe', '0',
+                   '-i', listFile,
+                   '-c', 'copy',
+                   filePath]
+        res = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE)
+        assert res.returncode == 0, \
+            f"ffmpeg concat failed for {filePath}:\n" + res.stderr.decode(errors='replace')
+
+    return written
+
+
+def compareSegmentedEncoding(imageList, filePath, fps=30, n_segments=None,
+                             gopSize=250, transform=None):
+    """
+        Encodes 'imageList' once with the single process path and once segmented,
+        returns the wall clock times and speedup of the segmented path
+    """
+    root,ext = os.path.splitext(filePath)
+    singleFile = root + "_single" + ext
+
+    start = time()
+    writeFramesToVideo( (__loadFrame(f, transform) for f in imageList), 
+                        filePath=singleFile, fps=fps, useFFMPEGdirect=True)
+    t_single = time() - start
+
+    start = time()
+    writeFramesToVideoSegmented(imageList, filePath, fps=fps, n_segments=n_segments,
+                                gopSize=gopSize, transform=transform)
+    t_segmented = time() - start
+
+    os.remove(singleFile)
+    return { 'single': t_single, 'segmented': t_segmented, 'speedup': t_single / t_segmented }
+
 
+# ------------
+# Mask sequence container: the whole mask stack as one lossless FFV1 (gray) video
+
+def isMaskVideo(path):
+    return os.path.isfile(path) and path.endswith(".mkv")
+
+
+def writeMaskVideo(maskList, filePath, fps=30):
+    """
+        writes a list (or (frames,h,w) stack) of masks, dtype='bool' or 'uint8',
+        to a single lossless FFV1 gray video (.mkv), as 0/255 values
+        returns the number of masks written
+    """
+    assert filePath.endswith(".mkv"), "Mask videos must be written to .mkv"
+    assert len(maskList) > 0, "Cannot make mask video without masks"
+    height,width = maskList[0].shape[:2]
+
+    dirPath = os.path.dirname(os.path.abspath(filePath))
+    if not os.path.isdir(dirPath):
+        os.makedirs(dirPath)
+
+    outvid = FFMPEGVideoWriter(filePath, fps=fps, widthHeight=(width,height), pixFmt='gray',
+                               codecArgs=['-vcodec', 'ffv1', '-level', '3', '-pix_fmt', 'gray'])
+    for msk in maskList:
+        outvid.write(maskToUint8(msk))
+
+    return outvid.release()
+
+
+def readMaskVideo(filePath, startframe=0, finishframe=None):
+    """
+        generator of masks (dtype='bool', shape (h,w)) from a mask video,
+        for frames startframe .. finishframe-1
+    """
+    assert isMaskVideo(filePath), f"Not a mask video file: {filePath}"
+    width,height = get_WidthHeight(filePath)
+    trim = f"trim=start_frame={startframe}" + (f":end_frame={finishframe}" if finishframe is not None else "")
+
+    command = ['ffmpeg', '-loglevel', 'error',
+               '-i', filePath,
+               '-vf', trim,
+               '-f', 'rawvideo', '-pix_fmt', 'gray',
+               '-']
+    pipe = sp.Popen(command, stdout=sp.PIPE, stderr=sp.DEVNULL)
+    framesize = width * height
+    try:
+        while True:
+            buf = pipe.stdout.read(framesize)
+            if len(buf) < framesize:
+                break
+            yield np.frombuffer(buf, dtype=np.uint8).reshape(height,width) > 0
+    finally:
+        pipe.stdout.close()
+        pipe.terminate()
+        pipe.wait()
+
+
+def maskVideoToDirectory(filePath, dirPath, padlength=5, cleanDirectory=False, bitDepth=8,
+                         n_workers=None, verbose=False):
+    """
+        conversion shim: writes the masks of a mask video as a PNG mask directory
+        (same layout as writeMasksToDirectory), for consumers requiring files
+    """
+    __prepareDirectory(dirPath, 'png', cleanDirectory)
+
+    params = imwriteParams('png')
+    if bitDepth == 1:
+        params += [cv2.IMWRITE_PNG_BILEVEL, 1]
+
+    pairs = ( (os.path.join(dirPath, str(i).rjust(padlength,'0') + '.png'), msk.view(np.uint8))
+              for i,msk in enumerate(readMaskVideo(filePath)) )
+    if bitDepth == 8:
+        pairs = ( (fname, maskToUint8(msk)) for fname,msk in pairs )
 
-def __ffmpegDirect(clip, outputfile, fps, size=[256, 256]):
+    return writeImageFiles(pairs, params=params, n_workers=n_workers, verbose=verbose)
+
+
+def probeVideoStream(vfile):
+    """
+        Returns the ffprobe description (dict) of the first video stream of 'vfile'
+        together with the packet list (pts_time, isKeyframe), sorted in presentation order
+    """
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'stream=codec_name,pix_fmt,bit_rate,avg_frame_rate:packet=pts_time,flags',
+               '-of', 'json', vfile]
+    res = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE)
+    assert res.returncode == 0, f"ffprobe failed for {vfile}:\n" + res.stderr.decode(errors='replace')
 
-    vf = clip.shape[0]
-    command = ['ffmpeg',
-               '-y',  # overwrite output file if it exists
-               '-f', 'rawvideo',
-               '-s', '%dx%d' % (size[1], size[0]),  # '256x256', # size of one frame
-               '-pix_fmt', 'rgb24',
-               '-r', '25',  # frames per second
-               '-an',  # Tells FFMPEG not to expect any audio
-               '-i', '-',  # The input comes from a pipe
-               '-vcodec', 'libx264',
-               '-b:v', '1500k',
-               '-vframes', str(vf),  # 5*25
-               '-s', '%dx%d' % (size[1], size[0]),  # '256x256', # size of one frame
-               outputfile]
+    info = json.loads(res.stdout.decode())
+    packets = [ (float(p['pts_time']), 'K' in p.get('flags','')) 
+                for p in info.get('packets',[]) if p.get('pts_time','N/A') != 'N/A' ]
 
-    pipe = sp.Popen(command, stdin=sp.PIPE, stderr=sp.PIPE)
-    out, err = pipe.communicate(clip.tostring())
-    pipe.wait()
-    pipe.terminate()
-    return out,err
+    return info['streams'][0], sorted(packets)
 
 
+def smartRenderVideo(sourceVideo, imageList, maskList, filePath, startframe=0, n_workers=None):
+    """
+        Writes 'sourceVideo' to 'filePath' (.mp4), re-encoding only the GOPs which overlap
+        frames with masked pixels. All other GOPs are stream copied from 'sourceVideo'.
+        'imageList' (frames or image file paths) and 'maskList' are paired and
+        correspond to source frames startframe, startframe+1, ...
+        Frames of another size (e.g. inpaint results at 512x1024) are resized to the source,
+        composite them into the source frames first (compositeInpaintedSequence) to keep its detail
+        Pieces are written as MPEG-TS (in-band parameter sets) and spliced by the concat demuxer.
+        Returns the number of re-encoded and copied frames
+    """
+    assert filePath.endswith(".mp4"), "Cannot use non-mp4 formats with ffmpeg"
+    assert len(imageList) == len(maskList), "Mismatch in number of frames versus number of masks"
+
+    stream, packets = probeVideoStream(sourceVideo)
+    n_frames = len(packets)
+    times = [ t for t,_ in packets ]
+    fps = get_fps(sourceVideo)
+    width,height = get_WidthHeight(sourceVideo)
+    bitrate = stream.get('bit_rate', '1500k')
+
+    # GOP boundaries, only h264 sources can be spliced without re-encoding
+    if stream['codec_name'] == 'h264':
+        keyframes = [ i for i,(_,isKey) in enumerate(packets) if isKey ]
+    else:
+        keyframes = [0]
+    if not keyframes or keyframes[0] != 0:
+        keyframes = [0, *keyframes]
+    bounds = [ *keyframes, n_frames ]
+
+    edited = { startframe + i for i,m in enumerate(maskList) if len(m) and np.any(m) }
+
+    # merge consecutive GOPs of the same kind into pieces: [start, finish, reencode]
+    pieces = []
+    for a,b in zip(bounds[:-1], bounds[1:]):
+        reencode = any([ i in edited for i in range(a,b) ])
+        if pieces and pieces[-1][2] == reencode:
+            pieces[-1][1] = b
+        else:
+            pieces.append([a, b, reencode])
+
+    resultRange = range(startframe, startframe + len(imageList))
+
+    def reencodePiece(pieceFile, a, b):
+        outvid = FFMPEGVideoWriter(pieceFile, fps=fps, widthHeight=(width,height), bitrate=str(bitrate),
+                                   extraArgs=['-pix_fmt', stream.get('pix_fmt','yuv420p')])
+        # decode the source only when the piece extends outside of the result frames
+        source = get_frame(sourceVideo, n_frames, startframe=a, finishframe=b-1) \
+                 if a < resultRange.start or b > resultRange.stop else None
+
+        for i in range(a,b):
+            frame = next(source) if source is not None else None
+            if i in resultRange:
+                frame = __loadFrame(imageList[i - startframe])
+                if frame.shape[:2] != (height,width):
+                    frame = cv2.resize(frame, (width,height), interpolation=cv2.INTER_CUBIC)
+            outvid.write(frame)
+        return outvid.release()
+
+    def copyPiece(pieceFile, a, b):
+        command = ['ffmpeg', '-y', '-loglevel', 'error',
+                   '-ss', f"{times[a] - times[0]:.6f}",  # keyframe, so the copy is exact
+                   '-i', sourceVideo,
+                   '-map', '0:v:0',
+                   '-frames:v', str(b - a),
+                   '-c', 'copy',
+                   '-bsf:v', 'h264_mp4toannexb',
+                   '-f', 'mpegts', pieceFile]
+        res = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE)
+        assert res.returncode == 0, \
+            f"ffmpeg stream copy failed for {sourceVideo}:\n" + res.stderr.decode(errors='replace')
+        return b - a
+
+    dirPath = os.path.dirname(os.path.abspath(filePath))
+    with tempfile.TemporaryDirectory(dir=dirPath) as tempdir:
+        pieceFiles = [ os.path.join(tempdir, f"piece_{i:04d}.ts") for i in range(len(pieces)) ]
+
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            jobs = [ pool.submit(reencodePiece if reencode else copyPiece, f, a, b)
+                     for f,(a,b,reencode) in zip(pieceFiles,pieces) ]
+            counts = [ j.result() for j in jobs ]
+
+        listFile = os.path.join(tempdir, "pieces.txt")
+        with open(listFile, 'w') as fp:
+            fp.writelines([ f"file '{f}'\n" for f in pieceFiles ])
+
+        command = ['ffmpeg', '-y', '-loglevel', 'error',
+                   '-f', 'concat', '-safe', '0',
+                   '-i', listFile,
+                   '-c', 'copy',
+                   filePath]
+        res = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE)
+        assert res.returncode == 0, \
+            f"ffmpeg concat failed for {filePath}:\n" + res.stderr.decode(errors='replace')
+
+    return { 'reencoded': sum([ n for n,p in zip(counts,pieces) if p[2] ]),
+             'copied': sum([ n for n,p in zip(counts,pieces) if not p[2] ]) }
+
+
+
+def smartRenderInpaintResults(sourceVideo, resultFiles, originals, maskList, filePath, startframe=0):
+    """
+        Writes 'sourceVideo' with the inpaint results to 'filePath' (see smartRenderVideo).
+        The full resolution composites replace 'resultFiles' first, the smart renderer
+        reads them as needed (always composited: re-encoded GOPs must match the resolution
+        of the stream copied ones). Returns the smartRenderVideo counts
+    """
+    writeImageFiles(zip(resultFiles, compositeInpaintedSequence(originals, resultFiles, maskList)))
+    res = smartRenderVideo(sourceVideo, resultFiles, maskList, filePath=filePath, startframe=startframe)
+    print(f"Re-encoded {res['reencoded']} frames, stream copied {res['copied']} frames")
+    return res
+
 def createNullVideo(filePath,message="No Image",heightWidth=(100,100)):
     h,w = heightWidth
     imgblank = np.zeros((h,w,3),dtype=np.uint8)
@@ -0,0 +1,106 @@
+# Common interface of the inpaint backends (remote Deep-Flow, local OpenCV, ...)
+import re
+from time import time
+
+
+class InpaintBackend:
+    """
+        Interface of the inpaint backends. A backend inpaints the frames and masks 
+        directories (same file names, sorted) and writes the results in the Deep-Flow 
+        layout: <parent of frameDirPath>/Inpaint_Res/inpaint_res/*.png
+        runInpaint returns (stdin, stdout lines, stderr lines), a successful job
+        reports "Propagation has been finished" in its stdout lines.
+    """
+    isConnected = False
+
+    def connectInpaint(self, **kwargs):
+        raise NotImplementedError
+
+    def testConnectionInpaint(self, **kwargs):
+        return True
+
+    def runInpaint(self, frameDirPath, maskDirPath, progressCallback=None, stallTimeout=None, **kwargs):
+        raise NotImplementedError
+
+    def disconnectInpaint(self, **kwargs):
+        self.isConnected = False
+
+    def cacheSettings(self):
+        # settings which change the results, part of the InpaintCache keys
+        return {'backend': type(self).__name__}
+
+
+class InpaintProgress:
+    """
+        Progress of a remote Deep-Flow inpaint job, parsed from its output lines:
+        stage ('flow', 'completion', 'propagation'), frame count, throughput (frames/s), ETA
+        Counters of the form 'n/N' and rates 'x it/s' or 'x task/s' (tqdm, mmcv) are recognized
+    """
+    stagePatterns = [ ('flow', re.compile(r'flownet|optical flow|flow estimat|extract.*flow', re.I)),
+                      ('completion', re.compile(r'dfc|flow complet|completion', re.I)),
+                      ('propagation', re.compile(r'propagat', re.I)) ]
+    counterPattern = re.compile(r'(\d+)\s*/\s*(\d+)')
+    ratePattern = re.compile(r'([\d.]+)\s*(?:it|task|frame)s?/s', re.I)
+
+    def __init__(self):
+        self.stage = None
+        self.frame = 0
+        self.n_frames = None
+        self.rate = None
+        self.finished = False
+        self.stalled = False
+        self.exit_status = None
+        self.pid = None             # remote process group of the job, if reported
+        self.stdin = None
+        self.stdoutLines = []
+        self.stderrLines = []
+        self.started = time()
+        self.lastOutput = self.started
+        self.__stageStart = (self.started, 0)
+
+    def update(self, line):
+        now = time()
+        self.lastOutput = now
+
+        if "Propagation has been finished" in line:
+            self.finished = True
+
+        for stage,pattern in self.stagePatterns:
+            if pattern.search(line) and stage != self.stage:
+                self.stage = stage
+                self.frame, self.rate = 0, None
+                self.__stageStart = (now, 0)
+
+        counter = self.counterPattern.search(line)
+        if counter:
+            self.frame, self.n_frames = int(counter.group(1)), int(counter.group(2))
+
+            rate = self.ratePattern.search(line)
+            if rate:
+                self.rate = float(rate.group(1))
+            elif now > self.__stageStart[0] and self.frame > self.__stageStart[1]:
+                self.rate = (self.frame - self.__stageStart[1]) / (now - self.__stageStart[0])
+
+    @property
+    def eta(self):
+        # seconds remaining in the current stage
+        if not self.rate or self.n_frames is None:
+            return None
+        return max(self.n_frames - self.frame, 0) / self.rate
+
+    @property
+    def elapsed(self):
+        return time() - self.started
+
+    def __str__(self):
+        status = f"[{self.stage or 'starting'}]"
+        if self.n_frames:
+            status += f" {self.frame}/{self.n_frames}"
+        if self.rate:
+            status += f" {self.rate:.2f} frames/s"
+        if self.eta is not None:
+            status += f" ETA {self.eta:.0f}s"
+        status += f" (elapsed {self.elapsed:.0f}s)"
+        if self.stalled:
+            status += " STALLED"
+        return status
@@ -0,0 +1,198 @@
+# Local caches of inpaint results: keyed by the content of the inputs, and the
+# previous run of a sequence (incremental re-inpainting)
+import os
+import json
+import shutil
+import hashlib
+from glob import glob
+from time import time
+from threading import Lock
+from itertools import chain
+
+import numpy as np
+import ObjectDetection.imutils as imu
+
+
+def contentHash(files, **settings):
+    """
+        SHA-256 over the content of the (ordered) 'files' and the 'settings'
+    """
+    h = hashlib.sha256()
+    h.update(repr(sorted(settings.items())).encode())
+    h.update(repr(len(files)).encode())
+    for fname in files:
+        with open(fname, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+class InpaintCache:
+    """
+        Inpaint results stored under 'cacheDir', one directory per key. The key is a
+        content hash over the frame and mask files and the inpaint settings (size,
+        options string, backend, ...). The least recently used entries are evicted
+        once the cache holds more than 'maxBytes'.
+    """
+    def __init__(self, cacheDir, maxBytes=20 * 2**30):
+        self.cacheDir = os.path.abspath(cacheDir)
+        self.maxBytes = maxBytes
+        self.__lock = Lock()
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    @staticmethod
+    def key(frameFiles, maskFiles, **settings):
+        """
+            Content hash of the (ordered) frame and mask files and the 'settings'
+        """
+        assert len(frameFiles) == len(maskFiles), "Mismatch in number of frames versus number of masks"
+        return contentHash(list(chain(frameFiles, maskFiles)), **settings)
+
+    def __entry(self, key):
+        return os.path.join(self.cacheDir, key)
+
+    def get(self, key):
+        """
+            Sorted result files of 'key', or None if not cached (empty entries are misses)
+        """
+        entry = self.__entry(key)
+        files = sorted(glob(os.path.join(entry, "*.png"))) if os.path.isdir(entry) else []
+        if not files:
+            return None
+        now = time()
+        os.utime(entry, (now, now))   # recently used
+        return files
+
+    def restore(self, key, dirPath):
+        """
+            Places the cached results of 'key' in 'dirPath' (hard links if possible),
+            returns the number of files or None if not cached
+        """
+        files = self.get(key)
+        if files is None:
+            return None
+        os.makedirs(dirPath, exist_ok=True)
+        for f in files:
+            target = os.path.join(dirPath, os.path.basename(f))
+            try:
+                os.link(f, target)
+            except OSError:
+                shutil.copy(f, target)
+        return len(files)
+
+    def put(self, key, resultFiles):
+        """
+            Stores copies of 'resultFiles' under 'key', then evicts if over size
+            (empty results are not stored, an existing empty entry is replaced)
+        """
+        if not resultFiles:
+            return
+        entry = self.__entry(key)
+        if self.get(key) is not None:
+            return
+        shutil.rmtree(entry, ignore_errors=True)
+
+        tmpEntry = entry + f".tmp{os.getpid()}_{id(resultFiles)}"
+        os.makedirs(tmpEntry, exist_ok=True)
+        for f in resultFiles:
+            shutil.copy(f, tmpEntry)
+        try:
+            os.rename(tmpEntry, entry)    # entries appear complete
+        except OSError:
+            shutil.rmtree(tmpEntry, ignore_errors=True)   # stored concurrently
+
+        self.evict()
+
+    def size(self):
+        return sum([ os.path.getsize(f) for f in glob(os.path.join(self.cacheDir, "*", "*")) ])
+
+    def evict(self):
+        """
+            Removes least recently used entries until the cache fits 'maxBytes'
+        """
+        with self.__lock:
+            entries = [ e for e in glob(os.path.join(self.cacheDir, "*"))
+                        if os.path.isdir(e) and '.tmp' not in os.path.basename(e) ]
+            sizes = { e: sum([ os.path.getsize(f) for f in glob(os.path.join(e, "*")) ]) for e in entries }
+            total = sum(sizes.values())
+            for e in sorted(entries, key=os.path.getmtime):
+                if total <= self.maxBytes:
+                    break
+                shutil.rmtree(e, ignore_errors=True)
+                total -= sizes[e]
+
+
+class InpaintHistory:
+    """
+        Combined mask stack and inpaint results of the previous run on a frame sequence,
+        kept in 'historyDir' for incremental re-inpainting: only the frames whose masks
+        changed (plus margins) are inpainted again and spliced into the previous results.
+        The sequence is identified by a content hash of its frames and the settings.
+        Key and masks are stored with the results, so the history survives a restart.
+    """
+    def __init__(self, historyDir):
+        self.historyDir = os.path.abspath(historyDir)
+        self.resultDir = os.path.join(self.historyDir, "results")
+        self.statePath = os.path.join(self.historyDir, "history.json")
+        self.maskPath = os.path.join(self.historyDir, "masks.npz")
+        self.lastKey = None
+        self.masks = None
+        self.load()
+
+    def load(self):
+        """
+            Reads the previous run from 'historyDir' (if any), returns True if found
+        """
+        try:
+            with open(self.statePath) as f:
+                state = json.load(f)
+            with np.load(self.maskPath) as data:
+                masks = np.unpackbits(data['masks'], axis=-1)[..., :state['width']].astype(bool)
+        except (OSError, ValueError, KeyError):
+            return False
+        if len(masks) != state['n_frames'] or len(self.resultFiles()) != state['n_frames']:
+            return False
+        self.masks, self.lastKey = list(masks), state['sequenceKey']
+        return True
+
+    @staticmethod
+    def sequenceKey(frameFiles, **settings):
+        return contentHash(frameFiles, **settings)
+
+    def changedRuns(self, sequenceKey, masks, margin=5):
+        """
+            Frame ranges [(start, finish), ...] to inpaint again (see imu.frameRuns),
+            or None if there is no previous run of this sequence
+        """
+        if sequenceKey != self.lastKey or self.masks is None or len(masks) != len(self.masks):
+            return None
+        changed = [ not np.array_equal(prev, msk) for prev,msk in zip(self.masks, masks) ]
+        return imu.frameRuns(changed, margin)
+
+    def resultFiles(self):
+        return sorted(glob(os.path.join(self.resultDir, "*.png")))
+
+    def update(self, sequenceKey, masks, resultFiles):
+        """
+            Keeps copies of 'masks' and 'resultFiles' as the previous run
+        """
+        if os.path.exists(self.statePath):
+            os.remove(self.statePath)   # invalid until all parts are written
+        tmpDir = self.resultDir + ".tmp"
+        shutil.rmtree(tmpDir, ignore_errors=True)
+        os.makedirs(tmpDir)
+        for f in resultFiles:
+            shutil.copy(f, tmpDir)
+        shutil.rmtree(self.resultDir, ignore_errors=True)
+        os.rename(tmpDir, self.resultDir)
+
+        self.masks = [ np.array(msk, dtype=bool) for msk in masks ]
+        self.lastKey = sequenceKey
+
+        # masks bit-packed, the state file is written last (it validates the others)
+        np.savez_compressed(self.maskPath + ".tmp.npz", masks=np.packbits(np.stack(self.masks), axis=-1))
+        os.replace(self.maskPath + ".tmp.npz", self.maskPath)
+        with open(self.statePath + ".tmp", 'w') as f:
+            json.dump({'sequenceKey': sequenceKey, 'n_frames': len(self.masks),
+                       'width': self.masks[0].shape[-1]}, f)
+        os.replace(self.statePath + ".tmp", self.statePath)
@@ -0,0 +1,166 @@
+# Local OpenCV inpainting, a drop-in for InpaintRemote (previews, CI, no inpaint container)
+import os
+from glob import glob
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import ObjectDetection.imutils as imu
+from ObjectDetection.inpaintBackend import InpaintBackend, InpaintProgress
+
+
+def inpaintFile(framePath, maskPath, resultPath, method='telea', radius=5):
+    """
+        Inpaints one frame file with cv2.inpaint (method 'telea' or 'ns'), 
+        frames without masked pixels are written unchanged
+    """
+    img = cv2.imread(framePath)
+    mask = cv2.imread(maskPath, cv2.IMREAD_GRAYSCALE)
+    assert img is not None and mask is not None, f"Could not read {framePath} or {maskPath}"
+
+    if mask.shape != img.shape[:2]:
+        mask = cv2.resize(mask, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_NEAREST)
+
+    if mask.any():
+        flags = cv2.INPAINT_TELEA if method == 'telea' else cv2.INPAINT_NS
+        img = cv2.inpaint(img, mask, radius, flags)
+
+    assert cv2.imwrite(resultPath, img), f"Could not write image file {resultPath}"
+    return resultPath
+
+
+class InpaintLocal(InpaintBackend):
+    """
+        Inpaints each frame independently with cv2.inpaint (Telea or Navier-Stokes),
+        frames are distributed over a process pool of 'n_workers'.
+        Reads the same frames/masks directories and writes the same result layout
+        as the Deep-Flow job; results keep the frame resolution.
+    """
+    def __init__(self, method='telea', radius=5, n_workers=None):
+        assert method in ('telea', 'ns'), f"Unknown inpaint method: {method}"
+        self.method = method
+        self.radius = radius
+        self.n_workers = n_workers if n_workers is not None else (os.cpu_count() or 1)
+
+    def connectInpaint(self, **kwargs):
+        # nothing to connect to, host arguments are ignored
+        self.isConnected = True
+
+    def cacheSettings(self):
+        return {'backend': type(self).__name__, 'method': self.method, 'radius': self.radius}
+
+    def runInpaint(self, frameDirPath, maskDirPath, progressCallback=None, stallTimeout=None, **kwargs):
+        """
+            Inpaints all frames, results are written to <parent>/Inpaint_Res/inpaint_res
+            Returns (None, stdout lines, stderr lines)
+        """
+        assert self.isConnected, "Client was not connected!"
+
+        frames = sorted(glob(os.path.join(frameDirPath, "*.png")))
+        masks = sorted(glob(os.path.join(maskDirPath, "*.png")))
+        assert len(frames) == len(masks), "Mismatch in number of frames versus number of masks"
+
+        resultDirPath = os.path.join(os.path.dirname(os.path.abspath(frameDirPath)), "Inpaint_Res", "inpaint_res")
+        os.makedirs(resultDirPath, exist_ok=True)
+
+        progress = InpaintProgress()
+        progress.stage = 'local'
+        progress.n_frames = len(frames)
+
+        with ProcessPoolExecutor(max_workers=self.n_workers) as pool:
+            jobs = [ pool.submit(inpaintFile, f, m, os.path.join(resultDirPath, os.path.basename(f)),
+                                 self.method, self.radius)
+                     for f,m in zip(frames, masks) ]
+            for i,job in enumerate(as_completed(jobs)):
+                job.result()
+                line = f"cv2.inpaint ({self.method}) {i + 1}/{len(frames)}"
+                progress.stdoutLines.append(line)
+                progress.update(line)
+                if progressCallback is not None:
+                    progressCallback(progress)
+
+        progress.stdoutLines.append("Propagation has been finished")
+        progress.update("Propagation has been finished")
+        progress.exit_status = 0
+        if progressCallback is not None:
+            progressCallback(progress)
+
+        return (progress.stdin, progress.stdoutLines, progress.stderrLines)
+
+
+class InpaintPlate(InpaintBackend):
+    """
+        Static camera fast path: masked pixels are filled from a background plate, the
+        per-pixel median of the unmasked samples within a sliding window of 'windowSize'
+        frames centered on each frame (imu.fillFromBackground). Frames are read once
+        as the window slides. Pixels without any unmasked sample in the window are
+        filled by cv2.inpaint ('fallbackMethod' 'telea' or 'ns').
+    """
+    def __init__(self, windowSize=31, fallbackMethod='telea', radius=5):
+        assert fallbackMethod in ('telea', 'ns'), f"Unknown inpaint method: {fallbackMethod}"
+        self.windowSize = windowSize
+        self.fallbackMethod = fallbackMethod
+        self.radius = radius
+
+    def connectInpaint(self, **kwargs):
+        # nothing to connect to, host arguments are ignored
+        self.isConnected = True
+
+    def cacheSettings(self):
+        return {'backend': type(self).__name__, 'windowSize': self.windowSize,
+                'fallbackMethod': self.fallbackMethod, 'radius': self.radius}
+
+    def runInpaint(self, frameDirPath, maskDirPath, progressCallback=None, stallTimeout=None, **kwargs):
+        """
+            Inpaints all frames, results are written to <parent>/Inpaint_Res/inpaint_res
+            Returns (None, stdout lines, stderr lines)
+        """
+        assert self.isConnected, "Client was not connected!"
+
+        frames = sorted(glob(os.path.join(frameDirPath, "*.png")))
+        masks = sorted(glob(os.path.join(maskDirPath, "*.png")))
+        assert len(frames) == len(masks), "Mismatch in number of frames versus number of masks"
+
+        resultDirPath = os.path.join(os.path.dirname(os.path.abspath(frameDirPath)), "Inpaint_Res", "inpaint_res")
+        os.makedirs(resultDirPath, exist_ok=True)
+
+        progress = InpaintProgress()
+        progress.stage = 'plate'
+        progress.n_frames = len(frames)
+        flags = cv2.INPAINT_TELEA if self.fallbackMethod == 'telea' else cv2.INPAINT_NS
+
+        half = self.windowSize // 2
+        window = deque()    # (index, frame, mask) of frames t-half .. t+half
+        n_loaded = 0
+        n_fallback = 0
+        for t in range(len(frames)):
+            while n_loaded < min(len(frames), t + half + 1):
+                window.append((n_loaded, cv2.imread(frames[n_loaded]), 
+                               cv2.imread(masks[n_loaded], cv2.IMREAD_GRAYSCALE) > 0))
+                n_loaded += 1
+            while window[0][0] < t - half:
+                window.popleft()
+
+            _, frame, mask = window[t - window[0][0]]
+            res, missing = imu.fillFromBackground(frame, mask, [ f for _,f,_ in window ], [ m for _,_,m in window ])
+            if missing.any():
+                res = cv2.inpaint(res, missing, self.radius, flags)
+                n_fallback += 1
+
+            out = os.path.join(resultDirPath, os.path.basename(frames[t]))
+            assert cv2.imwrite(out, res), f"Could not write image file {out}"
+
+            line = f"background plate {t + 1}/{len(frames)}"
+            progress.stdoutLines.append(line)
+            progress.update(line)
+            if progressCallback is not None:
+                progressCallback(progress)
+
+        for line in (f"{n_fallback} frames needed the fallback inpainter", "Propagation has been finished"):
+            progress.stdoutLines.append(line)
+            progress.update(line)
+        progress.exit_status = 0
+        if progressCallback is not None:
+            progressCallback(progress)
+
+        return (progress.stdin, progress.stdoutLines, progress.stderrLines)
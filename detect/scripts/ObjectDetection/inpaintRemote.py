@@ -1,52 +1,223 @@
 # Utilities to run DeepFlow Inpaint from remote container
-from time import time
+import os
+import json
+import shlex
+import shutil
+import tarfile
+from glob import glob
+from queue import Queue, Empty
+from time import time, sleep
+from select import select
 from paramiko import SSHClient, AutoAddPolicy
-from threading import Thread
+from threading import Thread, Lock, Condition, Event
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import ObjectDetection.imutils as imu
+from ObjectDetection.inpaintBackend import InpaintBackend, InpaintProgress
+
+
+class SSHSessionPool:
+    """
+        Keeps authenticated SSH sessions alive between operations, up to 'poolSize' sessions
+        per (hostname, port, username), with transport keepalives every 'keepalive' seconds.
+        Channels are multiplexed over a session, so a borrowed session is not held exclusively:
+        borrow() reuses the least busy live session, another one is only opened while all
+        live sessions have channels open. Sessions are opened outside of the pool lock,
+        bounded by 'connectTimeout' seconds (TCP connect, banner and authentication).
+    """
+    def __init__(self, poolSize=2, keepalive=30, connectTimeout=20):
+        self.poolSize = poolSize
+        self.keepalive = keepalive
+        self.connectTimeout = connectTimeout
+        self.__lock = Lock()
+        self.__changed = Condition(self.__lock)
+        self.__sessions = {}   # (hostname, port, username) : [live SSHClient, ...]
+        self.__opening = {}    # (hostname, port, username) : number of sessions being opened
+
+    @staticmethod
+    def isAlive(client):
+        transport = client.get_transport() if client is not None else None
+        return transport is not None and transport.is_active()
+
+    @staticmethod
+    def openChannels(client):
+        # paramiko has no public channel count, the transport's channel map is sized
+        return len(client.get_transport()._channels)
+
+    def connect(self, hostname, port, username, password, timeout=None):
+        """
+            opens a new session (not pooled), 'timeout' defaults to 'connectTimeout'
+        """
+        timeout = self.connectTimeout if timeout is None else timeout
+        client = SSHClient()
+        client.set_missing_host_key_policy(AutoAddPolicy())
+        try:
+            client.connect(hostname, port=port, username=username, password=password,
+                           timeout=timeout, banner_timeout=timeout, auth_timeout=timeout)
+        except Exception:
+            client.close()
+            raise
+        client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+    def borrow(self, hostname, username, password, port=22):
+        key = (hostname, port, username)
+        with self.__lock:
+            while True:
+                sessions = self.__sessions.setdefault(key, [])
+                for client in [ c for c in sessions if not self.isAlive(c) ]:
+                    sessions.remove(client)
+                    client.close()
+
+                opening = self.__opening.get(key, 0)
+                idlest = min(sessions, key=self.openChannels, default=None)
+                if idlest is not None and (self.openChannels(idlest) == 0
+                                           or len(sessions) + opening >= self.poolSize):
+                    return idlest
+                if len(sessions) + opening < self.poolSize:
+                    self.__opening[key] = opening + 1
+                    break
+                self.__changed.wait()   # all slots are being opened
+
+        client = None
+        try:
+            client = self.connect(hostname, port, username, password)
+        finally:
+            with self.__lock:
+                self.__opening[key] -= 1
+                if client is not None:
+                    self.__sessions.setdefault(key, []).append(client)
+                self.__changed.notify_all()
+        return client
+
+    def close(self, hostname=None):
+        """
+            closes all sessions (or only those of 'hostname')
+        """
+        with self.__lock:
+            for key in list(self.__sessions.keys()):
+                if hostname is not None and key[0] != hostname:
+                    continue
+                for client in self.__sessions.pop(key):
+                    client.close()
+
+
+# shared by all InpaintRemote instances
+sessionPool = SSHSessionPool()
+
 
 # primarily utilize parent methods, where possible
-class InpaintRemote(SSHClient):
-    def __init__(self, *args, **kwargs):
+# commands are executed on sessions borrowed from the (keep-alive) session pool
+class InpaintRemote(SSHClient, InpaintBackend):
+    def __init__(self, *args, pool=None, **kwargs):
         super(InpaintRemote,self).__init__(*args, **kwargs)
         self.isConnected = False
         self.set_missing_host_key_policy(AutoAddPolicy())
+        self.pool = pool if pool is not None else sessionPool
+        self.hostConfig = None
+        self.executor = None
         self.c = { 
                    'pythonPath': "/usr/bin/python3",
                    'workingDir': "/home/appuser/Deep-Flow",
                    'scriptPath': "/home/appuser/Deep-Flow/tools/video_inpaint.py",
                    'pretrainedModel': "/home/appuser/Deep-Flow/pretrained_models/FlowNet2_checkpoint.pth.tar",
-                   'optionsString' : "--FlowNet2 --DFC --ResNet101 --Propagation"
+                   'optionsString' : "--FlowNet2 --DFC --ResNet101 --Propagation",
+                   'daemonPort': 48200      # resident job runner, inpaint/scripts/inpaint_daemon.py
                  }
+        self.useDaemon = False
     
     def __del__(self):
         self.close()
     
-    def connectInpaint(self,hostname='inpaint', username='appuser', password='appuser'):
-        self.connect(hostname,username=username,password=password)
+    def connectInpaint(self,hostname='inpaint', username='appuser', password='appuser', port=22,
+                       useDaemon=False, daemonPort=None):
+        # only pays for the connection setup if no live pooled session exists
+        # 'useDaemon': jobs are submitted to the resident inpaint daemon (torch initialized and
+        # checkpoints read once, models are still built per job, abandoned jobs are cancelled)
+        self.useDaemon = useDaemon
+        if daemonPort is not None:
+            self.c['daemonPort'] = daemonPort
+        self.hostConfig = {'hostname': hostname, 'username': username, 
+                           'password': password, 'port': port}
+        self.session()
         self.isConnected = True
 
-    def executeCommandsInpaint(self,commands):
+    def session(self):
+        """
+            borrows a live session (SSHClient) for the connected host from the pool
+        """
+        assert self.hostConfig is not None, "Client was not connected!"
+        return self.pool.borrow(**self.hostConfig)
+
+    def exec_command(self, command, **kwargs):
+        return self.session().exec_command(command, **kwargs)
+
+    def executeCommandsInpaint(self,commands,concurrent=False):
         """
             Executes specified commands in container, returns results 
+            'concurrent' opens all command channels before waiting on any of them
+            (only for commands which do not depend on each other)
         """
         assert self.isConnected, "Client was not connected!"
 
         start = time()
         results = { 'stdin': [], 'stdout': [], 'stderr': [] }
-        for cmd in commands:
-            stdin, stdout, stderr = self.exec_command(cmd)  # non-blocking call
-            exit_status = stdout.channel.recv_exit_status() # blocking call
-            results['stdin'].append(stdin)
-            results['stdout'].append(stdout)
-            results['stderr'].append(stderr)
+        if concurrent:
+            channels = [ self.exec_command(cmd) for cmd in commands ]  # non-blocking calls
+            for stdin, stdout, stderr in channels:
+                exit_status = stdout.channel.recv_exit_status() # blocking call
+                results['stdin'].append(stdin)
+                results['stdout'].append(stdout)
+                results['stderr'].append(stderr)
+        else:
+            for cmd in commands:
+                stdin, stdout, stderr = self.exec_command(cmd)  # non-blocking call
+                exit_status = stdout.channel.recv_exit_status() # blocking call
+                results['stdin'].append(stdin)
+                results['stdout'].append(stdout)
+                results['stderr'].append(stderr)
 
         finish = time()
         return results
 
 
+    def executeCommandsAsync(self,commands):
+        """
+            Executes the commands concurrently, each on its own channel multiplexed
+            over the pooled session. All channels are opened before returning, so N
+            independent commands take about one round trip time.
+            Returns a list of futures (concurrent.futures, use asyncio.wrap_future for
+            awaitables), each resolving to 
+            { 'cmd': str, 'exit_status': int, 'stdout': [lines], 'stderr': [lines] }
+        """
+        assert self.isConnected, "Client was not connected!"
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=8)
+
+        def collect(cmd, stdout, stderr):
+            out = stdout.read().decode(errors='replace').splitlines()
+            err = stderr.read().decode(errors='replace').splitlines()
+            return { 'cmd': cmd, 
+                     'exit_status': stdout.channel.recv_exit_status(),
+                     'stdout': out, 
+                     'stderr': err }
+
+        futures = []
+        for cmd in commands:
+            stdin, stdout, stderr = self.exec_command(cmd)  # non-blocking call
+            futures.append(self.executor.submit(collect, cmd, stdout, stderr))
+
+        return futures
+
+
     def testConnectionInpaint(self,testCommands=None,hardErrors=True):
         """
             Tests simple connectivity to the container
             to see if host is accessible, and all command paths are accessible
+            (all test commands are executed concurrently)
         """
         assert self.isConnected, "Client was not connected!"
 
@@ -54,27 +225,22 @@ class InpaintRemote(SSHClient):
             testCommands = [ f'cd {self.c["workingDir"]} ; pwd',
                              f'ls {self.c["pythonPath"]}',
                              f'ls {self.c["scriptPath"]}',
-                             f'ls {self.c["pretrainedModle"]}',
+                             f'ls {self.c["pretrainedModel"]}',
                            ] 
 
         start = time()
-        errors = []
-        for cmd in testCommands:
-            stdin, stdout, stderr = self.exec_command(cmd)  # non-blocking call
-            exit_status = stdout.channel.recv_exit_status() # blocking call
-            if stderr:
-                errors.append({'cmd': cmd, 'message': stderr})
-            finish = time()
+        results = [ f.result() for f in self.executeCommandsAsync(testCommands) ]
+        errors = [ {'cmd': r['cmd'], 'message': r['stderr']} for r in results if r['exit_status'] != 0 ]
+        finish = time()
 
         if any(errors):
-            disconnectInpaint()
+            self.disconnectInpaint()
             if hardErrors:
                 for err in errors:
                     print(f"Error executing remote command:\n<<{err['cmd']}>>")
                     print(f"\nResult output:\n")
                     for l in err['message']:
                         print(l.strip())
-                    return False
 
                 raise Exception("Errors encountered while testing remote execution")
             else:
@@ -83,42 +249,965 @@ class InpaintRemote(SSHClient):
         return True 
 
 
-    def disconnectInpaint(self):
-        self.close()
+    def makeRemoteTempDir(self):
+        """
+            creates a temporary working directory on the inpaint host, returns its path
+        """
+        stdin, stdout, stderr = self.exec_command("mktemp -d")
+        assert stdout.channel.recv_exit_status() == 0, \
+            "Could not create remote directory: " + stderr.read().decode(errors='replace')
+        return stdout.read().decode().strip()
+
+    def removeRemoteDir(self, remoteDir):
+        stdin, stdout, stderr = self.exec_command(f"rm -rf {shlex.quote(remoteDir)}")
+        return stdout.channel.recv_exit_status() == 0
+
+    def uploadDirectory(self, localDir, remoteDir, compress=False):
+        """
+            streams the files of 'localDir' to 'remoteDir' on the inpaint host as a tar
+            stream over the SSH channel (no shared filesystem required).
+            PNG files are already compressed, 'compress' (gzip) is mostly useful for masks
+            returns the number of (uncompressed) file bytes sent
+        """
+        assert self.isConnected, "Client was not connected!"
+        flags = "-xzf" if compress else "-xf"
+        stdin, stdout, stderr = self.exec_command(
+            f"mkdir -p {shlex.quote(remoteDir)} && tar {flags} - -C {shlex.quote(remoteDir)}")
+
+        sent = 0
+        with tarfile.open(fileobj=stdin, mode='w|gz' if compress else 'w|') as tar:
+            for fname in sorted(os.listdir(localDir)):
+                fpath = os.path.join(localDir, fname)
+                tar.add(fpath, arcname=fname)
+                sent += os.path.getsize(fpath)
+
+        stdin.flush()
+        stdin.channel.shutdown_write()  # end of tar stream
+        assert stdout.channel.recv_exit_status() == 0, \
+            f"Transfer to {remoteDir} failed: " + stderr.read().decode(errors='replace')
+        return sent
+
+    def downloadDirectory(self, remoteDir, localDir, compress=False):
+        """
+            streams the files of 'remoteDir' on the inpaint host back into 'localDir'
+            as a tar stream over the SSH channel, returns the number of files received
+        """
+        assert self.isConnected, "Client was not connected!"
+        os.makedirs(localDir, exist_ok=True)
+        flags = "-czf" if compress else "-cf"
+        stdin, stdout, stderr = self.exec_command(f"tar {flags} - -C {shlex.quote(remoteDir)} .")
+
+        n_files = 0
+        with tarfile.open(fileobj=stdout, mode='r|gz' if compress else 'r|') as tar:
+            for member in tar:
+                if not member.isfile(): continue
+                member.name = os.path.basename(member.name)   # flat result directory
+                tar.extract(member, localDir)
+                n_files += 1
+
+        assert stdout.channel.recv_exit_status() == 0, \
+            f"Transfer from {remoteDir} failed: " + stderr.read().decode(errors='replace')
+        return n_files
+
+    def disconnectInpaint(self, closeSessions=False):
+        # pooled sessions are kept alive for the next operation, unless requested
+        if closeSessions and self.hostConfig is not None:
+            self.pool.close(self.hostConfig['hostname'])
         self.isConnected = False
     
+    def cacheSettings(self):
+        return {'backend': type(self).__name__, 'scriptPath': self.c['scriptPath'], 
+                'optionsString': self.c['optionsString']}
+
+    def buildInpaintArgs(self, frameDirPath, maskDirPath, inputHeight=512, inputWidth=1024, optionsString=''):
+        # arguments of the inpaint script
+        if not optionsString:
+            optionsString = self.c['optionsString']
+
+        return [ "--frame_dir", frameDirPath, "--MASK_ROOT", maskDirPath,
+                 "--img_size", str(inputHeight), str(inputWidth) ] + shlex.split(optionsString)
+
+    def buildInpaintCommand(self,
+                   frameDirPath, maskDirPath, 
+                   inputHeight=512, inputWidth=1024,  # maximum size limited to 512x1024
+                   CUDA_VISIBLE_DEVICES='',   # specify specific device if required, otherwise default
+                   optionsString=''           # optional parameters string
+                ):
+        # exported, so that the inpaint process (not only the shell) sees the device
+        cudaString = f"export CUDA_VISIBLE_DEVICES={shlex.quote(str(CUDA_VISIBLE_DEVICES))}; " \
+                     if CUDA_VISIBLE_DEVICES != '' and CUDA_VISIBLE_DEVICES is not None else ""
+        args = self.buildInpaintArgs(frameDirPath, maskDirPath, inputHeight, inputWidth, optionsString)
+
+        # the job runs in its own process group, reported first ("INPAINT_PID <pgid>"),
+        # so that an abandoned job can be stopped (see killRemoteJob)
+        script = f"echo INPAINT_PID $$; exec {self.c['pythonPath']} {self.c['scriptPath']} " + \
+                 " ".join([ shlex.quote(a) for a in args ])
+
+        return cudaString + \
+               f"cd {self.c['workingDir']}; " + \
+               f"exec setsid -w sh -c {shlex.quote(script)}"
+
+    def killRemoteJob(self, pid, signal='TERM'):
+        """
+            Stops the process group 'pid' of a job on the inpaint host (all of its processes)
+        """
+        try:
+            stdin, stdout, stderr = self.exec_command(f"kill -{signal} -- -{int(pid)}")
+            return stdout.channel.recv_exit_status() == 0
+        except Exception:
+            return False
+
+    def daemonRequest(self, request, timeout=None):
+        """
+            Sends one request (dict) to the resident inpaint daemon, through a channel 
+            forwarded over the SSH session to its localhost port, returns the reply (dict)
+            'timeout': seconds to wait for the channel and each read of the reply
+        """
+        transport = self.session().get_transport()
+        channel = transport.open_channel('direct-tcpip', ('127.0.0.1', self.c['daemonPort']), ('127.0.0.1', 0),
+                                         timeout=timeout)
+        try:
+            channel.settimeout(timeout)
+            channel.sendall((json.dumps(request) + "\n").encode())
+            reply = b''
+            while not reply.endswith(b'\n'):
+                data = channel.recv(65536)
+                if not data:
+                    break
+                reply += data
+        finally:
+            channel.close()
+
+        reply = json.loads(reply.decode())
+        if 'error' in reply:
+            raise Exception(f"Inpaint daemon error: {reply['error']}")
+        return reply
+
+    def daemonAvailable(self, timeout=None):
+        try:
+            return self.daemonRequest({'cmd': 'ping'}, timeout=timeout).get('ok', False)
+        except Exception:
+            return False
+
+    def streamInpaintDaemon(self, args, pollInterval=1.0, stallTimeout=None):
+        """
+            Submits a job (inpaint script 'args') to the resident daemon and yields its
+            InpaintProgress every 'pollInterval' seconds, like streamInpaint.
+            The job's stdout and stderr are collected in 'stdoutLines' and 'stderrLines'.
+            A job abandoned before it finished (stream closed, e.g. stalled, or an error)
+            is cancelled on the daemon
+        """
+        assert self.isConnected, "Client was not connected!"
+
+        progress = InpaintProgress()
+        jobId = self.daemonRequest({'cmd': 'submit', 'args': args})['job']
+        offset = {'output': 0, 'errors': 0}
+        partial = {'output': '', 'errors': ''}
+
+        def consume(stream, text, final=False):
+            # progress bars redraw with carriage returns, treat them as line ends
+            *lines, partial[stream] = (partial[stream] + text).replace('\r', '\n').split('\n')
+            if final:
+                lines.append(partial[stream])
+            for l in lines:
+                if l.strip():
+                    (progress.stdoutLines if stream == 'output' else progress.stderrLines).append(l)
+                    progress.update(l)
+
+        finished = False
+        try:
+            while True:
+                status = self.daemonRequest({'cmd': 'status', 'job': jobId, 
+                                             'offset': offset['output'], 'errorOffset': offset['errors']})
+                offset['output'], offset['errors'] = status['offset'], status.get('errorOffset', 0)
+
+                finished = status['state'] in ('done', 'failed', 'cancelled')
+                for stream in ('output', 'errors'):
+                    consume(stream, status.get(stream, ''), final=finished)
+
+                if finished:
+                    progress.exit_status = 0 if status['state'] == 'done' else 1
+                    yield progress
+                    break
+
+                # a queued job waits for the daemon, it is not stalled
+                progress.stalled = stallTimeout is not None and status['state'] == 'running' and \
+                                   time() - progress.lastOutput > stallTimeout
+                yield progress
+                sleep(pollInterval)
+        finally:
+            if not finished:
+                try:
+                    self.daemonRequest({'cmd': 'cancel', 'job': jobId}, timeout=30)
+                except Exception as e:
+                    print(f"Could not cancel inpaint daemon job {jobId}: {e}", flush=True)
+
+    def streamInpaint(self, commandScript, pollInterval=1.0, stallTimeout=None):
+        """
+            Starts 'commandScript' and yields its InpaintProgress whenever remote output
+            was parsed (stdout and stderr are read as they arrive, progress bars 
+            included), or at least every 'pollInterval' seconds.
+            'progress.stalled' is set if no output arrived for 'stallTimeout' seconds
+            Closing the generator before the job finished (e.g. on a stall) closes the
+            channel and stops the job's remote process group ('progress.pid', reported
+            by commands of buildInpaintCommand, other commands are only disconnected)
+        """
+        assert self.isConnected, "Client was not connected!"
+
+        progress = InpaintProgress()
+        progress.stdin, stdout, stderr = self.exec_command(commandScript)  # non-blocking call
+        channel = stdout.channel
+        partial = {'stdout': '', 'stderr': ''}
+
+        def consume(stream, data):
+            # progress bars redraw with carriage returns, treat them as line ends
+            text = (partial[stream] + data.decode(errors='replace')).replace('\r', '\n')
+            *lines, partial[stream] = text.split('\n')
+            for l in lines:
+                if not l.strip(): continue
+                if progress.pid is None and l.startswith("INPAINT_PID "):
+                    progress.pid = int(l.split()[1])
+                    continue
+                (progress.stdoutLines if stream == 'stdout' else progress.stderrLines).append(l)
+                progress.update(l)
+            return len(lines) > 0
+
+        try:
+            while True:
+                select([channel], [], [], pollInterval)
+
+                changed = False
+                while channel.recv_ready():
+                    changed |= consume('stdout', channel.recv(65536))
+                while channel.recv_stderr_ready():
+                    changed |= consume('stderr', channel.recv_stderr(65536))
+
+                if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                    for stream in ('stdout', 'stderr'):
+                        consume(stream, b'\n')
+                    progress.exit_status = channel.recv_exit_status()
+                    yield progress
+                    break
+
+                progress.stalled = stallTimeout is not None and \
+                                   time() - progress.lastOutput > stallTimeout
+                yield progress
+        finally:
+            if progress.exit_status is None and progress.pid is not None:
+                self.killRemoteJob(progress.pid)    # abandoned, frees the GPU
+            channel.close()
+
     def runInpaint(self,
                    frameDirPath, maskDirPath, 
                    commandScript=None,                # default pre-baked script will be used
                    inputHeight=512, inputWidth=1024,  # maximum size limited to 512x1024
                    CUDA_VISIBLE_DEVICES='',   # specify specific device if required, otherwise default
-                   optionsString=''           # optional parameters string
+                   optionsString='',          # optional parameters string
+                   progressCallback=None,     # called with InpaintProgress as output arrives
+                   stallTimeout=None          # abort if no remote output for 'stallTimeout' seconds
                 ):
         """
             'runInpaint' will execute a 'pre-baked' formula for inpainting based on the example from
             the https://github.com/nbei/Deep-Flow-Guided-Video-Inpainting definition.
-
+            Returns (stdin, stdout lines, stderr lines)
         """
         assert self.isConnected, "Client was not connected!"
 
-        cudaString = f"CUDA_VISIBLE_DEVICES={CUDA_VISIBLE_DEVICES}; " if CUDA_VISIBLE_DEVICES else ""
-        if not optionsString:
-            optionsString = self.c['optionsString']
+        if self.useDaemon and commandScript is None:
+            # the device is fixed per daemon: one daemon per GPU, on distinct 'daemonPort's
+            if CUDA_VISIBLE_DEVICES != '' and CUDA_VISIBLE_DEVICES is not None:
+                raise Exception(f"CUDA_VISIBLE_DEVICES={CUDA_VISIBLE_DEVICES} cannot be applied to a daemon job, " + \
+                                "run one daemon per GPU and select it with 'daemonPort'")
+            stream = self.streamInpaintDaemon(self.buildInpaintArgs(frameDirPath, maskDirPath, 
+                                                                    inputHeight, inputWidth, optionsString),
+                                              stallTimeout=stallTimeout)
+        else:
+            if commandScript is None:
+                commandScript = self.buildInpaintCommand(frameDirPath, maskDirPath, 
+                                                         inputHeight=inputHeight, inputWidth=inputWidth,
+                                                         CUDA_VISIBLE_DEVICES=CUDA_VISIBLE_DEVICES,
+                                                         optionsString=optionsString)
+            stream = self.streamInpaint(commandScript, stallTimeout=stallTimeout)
 
-        if commandScript is None:
-            commandScript = cudaString + \
-                            f"cd {self.c['workingDir']}; " + \
-                            f"{self.c['pythonPath']} {self.c['scriptPath']} " + \
-                            f"--frame_dir {frameDirPath} --MASK_ROOT {maskDirPath} " + \
-                            f"--img_size {inputHeight} {inputWidth} " + \
-                            optionsString
-        
-        start = time()
-        stdin, stdout, stderr = self.exec_command(commandScript)  # non-blocking call
-        exit_status = stdout.channel.recv_exit_status() # blocking call
-        finish = time()
+        try:
+            for progress in stream:
+                if progressCallback is not None:
+                    progressCallback(progress)
+                if progress.stalled:
+                    raise Exception(f"Inpaint job stalled, no output for {stallTimeout}s:\n" + \
+                                    "\n".join((progress.stderrLines or progress.stdoutLines)[-10:]))
+        finally:
+            stream.close()      # an unfinished job is stopped, its channel closed
+
+        return (progress.stdin, progress.stdoutLines, progress.stderrLines)
+
+
+def temporalWindows(n_frames, windowSize=100, overlap=10):
+    """
+        Splits range(n_frames) into windows [(start, finish), ...] of at most 'windowSize'
+        frames, where consecutive windows share 'overlap' frames
+    """
+    assert windowSize > overlap >= 0, "windowSize must exceed overlap"
+    if n_frames <= windowSize:
+        return [(0, n_frames)]
+
+    windows = []
+    start = 0
+    while True:
+        finish = min(start + windowSize, n_frames)
+        windows.append((start, finish))
+        if finish == n_frames:
+            break
+        start = finish - overlap
+
+    return windows
+
+
+class InpaintHostPool:
+    """
+        Pool of inpaint hosts (worker dicts, as for InpaintChunkScheduler). A background
+        thread health-checks all hosts every 'checkInterval' seconds (testConnectionInpaint,
+        plus the daemon if used), each over its own session opened within 'checkTimeout'
+        seconds, so an unreachable host does not hold the shared session pool.
+        Hosts which failed a check or a job are out of service until a later check passes.
+        acquire() hands out the least-loaded healthy host: fewest active jobs, then the
+        highest recent throughput (frames/s over its last 'historySize' jobs)
+    """
+    def __init__(self, hosts, checkInterval=30, historySize=10, checkTimeout=10):
+        assert hosts, "No inpaint hosts given"
+        self.hosts = [ dict(h) for h in hosts ]
+        self.checkInterval = checkInterval
+        self.checkTimeout = checkTimeout
+        self.stats = [ {'healthy': None, 'active': 0, 'failures': 0, 'lastCheck': None,
+                        'history': deque(maxlen=historySize)} for _ in self.hosts ]
+        self.__cond = Condition()
+        self.__stop = Event()
+        self.__thread = Thread(target=self.__checkLoop, daemon=True)
+        self.__thread.start()
+
+    @staticmethod
+    def checkHost(host, timeout=10):
+        host = dict(host)
+        host.pop('CUDA_VISIBLE_DEVICES', None)
+        checkPool = None
+        try:
+            inpaint = host.pop('backend', InpaintRemote)()
+            if isinstance(inpaint, InpaintRemote):
+                checkPool = inpaint.pool = SSHSessionPool(poolSize=1, connectTimeout=timeout)
+            inpaint.connectInpaint(**host)
+            if isinstance(inpaint, InpaintRemote):
+                healthy = inpaint.testConnectionInpaint(hardErrors=False) is True
+                healthy = healthy and (not inpaint.useDaemon or inpaint.daemonAvailable(timeout=timeout))
+            else:
+                healthy = inpaint.testConnectionInpaint() is True
+            inpaint.disconnectInpaint()
+            return healthy
+        except Exception:
+            return False
+        finally:
+            if checkPool is not None:
+                checkPool.close()
+
+    def __checkLoop(self):
+        with ThreadPoolExecutor(max_workers=len(self.hosts)) as pool:
+            while not self.__stop.is_set():
+                checks = list(pool.map(lambda h: self.checkHost(h, self.checkTimeout), self.hosts))
+                with self.__cond:
+                    for st,healthy in zip(self.stats, checks):
+                        if healthy and not st['healthy']:
+                            st['failures'] = 0
+                        st['healthy'], st['lastCheck'] = healthy, time()
+                    self.__cond.notify_all()
+                self.__stop.wait(self.checkInterval)
+
+    def throughput(self, i):
+        history = self.stats[i]['history']
+        seconds = sum([ t for _,t in history ])
+        return sum([ n for n,_ in history ]) / seconds if seconds > 0 else None
+
+    def __load(self, i):
+        # hosts without a throughput yet are tried first
+        throughput = self.throughput(i)
+        return (self.stats[i]['active'], -throughput if throughput is not None else -float('inf'))
+
+    def acquire(self, timeout=None, avoid=()):
+        """
+            Returns (index, host) of the least-loaded healthy host, waits up to 'timeout'
+            seconds (None: forever) for one to become healthy
+            hosts in 'avoid' (indices, e.g. where a chunk failed) are only used if no other is healthy
+        """
+        deadline = time() + timeout if timeout is not None else None
+        with self.__cond:
+            while True:
+                healthy = [ i for i,st in enumerate(self.stats) if st['healthy'] ]
+                if healthy:
+                    i = min(healthy, key=lambda i: (i in avoid, *self.__load(i)))
+                    self.stats[i]['active'] += 1
+                    return i, self.hosts[i]
+
+                remaining = deadline - time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise Exception("No healthy inpaint host available")
+                self.__cond.wait(remaining)
+
+    def release(self, i, n_frames=0, seconds=0.0, ok=True):
+        """
+            Returns host 'i' after a job of 'n_frames' which took 'seconds', 
+            a failed job ('ok' False) takes the host out of service until its next check
+        """
+        with self.__cond:
+            st = self.stats[i]
+            st['active'] -= 1
+            if ok:
+                st['history'].append((n_frames, seconds))
+            else:
+                st['healthy'] = False
+                st['failures'] += 1
+            self.__cond.notify_all()
+
+    def close(self):
+        self.__stop.set()
+
+    def __str__(self):
+        status = []
+        for host,st,i in zip(self.hosts, self.stats, range(len(self.hosts))):
+            throughput = self.throughput(i)
+            name = host.get('hostname', 'inpaint') + (f":{host['CUDA_VISIBLE_DEVICES']}" if host.get('CUDA_VISIBLE_DEVICES') else "")
+            status.append(f"{name} {'up' if st['healthy'] else 'down'} {st['active']} active" + \
+                          (f" {throughput:.2f} frames/s" if throughput else ""))
+        return ", ".join(status)
+
+
+class InpaintChunkScheduler:
+    """
+        Inpaints a frame sequence as overlapping temporal windows (chunks), sent 
+        concurrently to a list of workers (inpaint hosts or GPU slots on a host).
+        Results are stitched with a linear cross-fade over the overlaps.
+        A failed chunk is retried on its own, up to 'retries' times, preferably on a worker
+        where it did not fail yet. At most two chunks overlap a frame (overlap <= windowSize/2).
+        'workers' = [ {'hostname': 'inpaint', 'CUDA_VISIBLE_DEVICES': '0', ...}, ... ]
+        (keys as for InpaintRemote.connectInpaint, plus CUDA_VISIBLE_DEVICES, and 'backend':
+        a factory of the InpaintBackend to use, InpaintRemote by default)
+        'workers' may also be an InpaintHostPool: each chunk then goes to the least-loaded
+        healthy host, failed hosts are avoided until they pass a health check again
+        (a chunk fails if no host is healthy for 'hostTimeout' seconds)
+        'cropROI': each chunk is cropped to the union of its masks plus 'roiPadding' 
+        pixels, only the crop is inpainted and pasted back into the full resolution frames
+        'cache': an InpaintCache, chunks are looked up and stored individually (keyed with
+        'cacheSettings', e.g. backend and options), so only changed chunks are recomputed
+        'stallTimeout': a chunk fails (and is retried) if its job gives no output for this many seconds
+    """
+    def __init__(self, workers, windowSize=100, overlap=10, retries=2, transferOverSSH=False,
+                 cropROI=False, roiPadding=32, maxInputSize=(512,1024), cache=None, cacheSettings=None,
+                 hostTimeout=600, stallTimeout=None):
+        assert workers, "No inpaint workers given"
+        assert 2 * overlap <= windowSize, "overlap must not exceed half the windowSize"
+        self.hostPool = workers if isinstance(workers, InpaintHostPool) else None
+        self.workers = workers.hosts if self.hostPool is not None else workers
+        self.hostTimeout = hostTimeout
+        self.stallTimeout = stallTimeout
+        self.windowSize = windowSize
+        self.overlap = overlap
+        self.retries = retries
+        self.transferOverSSH = transferOverSSH
+        self.cropROI = cropROI
+        self.roiPadding = roiPadding
+        self.maxInputSize = maxInputSize
+        self.cache = cache
+        self.cacheSettings = cacheSettings if cacheSettings is not None else {}
+        self.chunks = []
+        self.status = {}    # chunk index : 'queued', 'running', 'done', 'failed', 'cancelled' or InpaintProgress
+        self.finished = False       # as InpaintProgress: the last run succeeded,
+        self.exit_status = None     # 0 or 1 once it ended (None while running)
+        self.__finished = Condition()   # notified whenever a chunk finished (or failed)
+        self.__cancelled = Event()      # set when the run failed, running chunks are abandoned
+        self.__queued = Condition()     # notified whenever an item is queued ('__puts' counts them)
+        self.__puts = 0
+
+    def __str__(self):
+        states = list(self.status.values())
+        done = sum([ st == 'done' for st in states ])
+        running = [ f"{ci}: {st}" for ci,st in self.status.items() if isinstance(st, InpaintProgress) ]
+        return f"chunks {done}/{len(states)} done" + (" | " + " | ".join(running) if running else "") + \
+               (f" [{self.hostPool}]" if self.hostPool is not None else "")
+
+    @staticmethod
+    def __linkFiles(files, dirPath):
+        # chunk inputs are hard links to the full sequence files (no re-encoding)
+        os.makedirs(dirPath, exist_ok=True)
+        for f in files:
+            target = os.path.join(dirPath, os.path.basename(f))
+            try:
+                os.link(f, target)
+            except OSError:
+                shutil.copy(f, target)
+
+    @staticmethod
+    def __cropFiles(files, dirPath, roi):
+        os.makedirs(dirPath, exist_ok=True)
+        y0,y1,x0,x1 = roi
+        for f in files:
+            cv2.imwrite(os.path.join(dirPath, os.path.basename(f)), cv2.imread(f)[y0:y1,x0:x1])
+
+    def runChunk(self, worker, frameDir, maskDir, resultDir, 
+                 inputHeight=512, inputWidth=1024, progressCallback=None):
+        """
+            Inpaints one chunk on 'worker', the results are placed in 'resultDir'
+        """
+        worker = dict(worker)
+        cuda = worker.pop('CUDA_VISIBLE_DEVICES', '')
+        inpaint = worker.pop('backend', InpaintRemote)()
+        inpaint.connectInpaint(**worker)
+        transfer = self.transferOverSSH and isinstance(inpaint, InpaintRemote)
+        try:
+            if transfer:
+                remoteDir = inpaint.makeRemoteTempDir()
+                runFrameDir, runMaskDir = remoteDir + "/frames", remoteDir + "/masks"
+                inpaint.uploadDirectory(frameDir, runFrameDir)
+                inpaint.uploadDirectory(maskDir, runMaskDir, compress=True)
+            else:
+                runFrameDir, runMaskDir = frameDir, maskDir
+
+            try:
+                stdin, stdout, stderr = inpaint.runInpaint(runFrameDir, runMaskDir,
+                                                           inputHeight=inputHeight, inputWidth=inputWidth,
+                                                           CUDA_VISIBLE_DEVICES=cuda,
+                                                           progressCallback=progressCallback,
+                                                           stallTimeout=self.stallTimeout)
+                assert any(["Propagation has been finished" in l for l in stdout]), \
+                    "Could not determine if results were valid!\n" + "\n".join(stderr[-10:])
+
+                if transfer:
+                    inpaint.downloadDirectory(remoteDir + "/Inpaint_Res/inpaint_res", resultDir)
+            finally:
+                if transfer:
+                    inpaint.removeRemoteDir(remoteDir)
+        finally:
+            inpaint.disconnectInpaint()
+
+        return sorted(glob(os.path.join(resultDir, "*.png")))
+
+    def __put(self, queue, item):
+        queue.put(item)
+        with self.__queued:
+            self.__puts += 1
+            self.__queued.notify_all()
+
+    def __workerLoop(self, wi, worker, queue, results, errors):
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            ci, attempt, failedOn = item
+            chunk = self.chunks[ci]
+
+            if self.__cancelled.is_set():
+                self.status[ci] = 'cancelled'
+                queue.task_done()
+                continue
+
+            if self.hostPool is None and wi in failedOn and len(failedOn) < len(self.workers):
+                # retried chunk, left to the workers where it did not fail:
+                # put back, then wait for another item (or the end of the run)
+                with self.__queued:
+                    puts = self.__puts
+                queue.put(item)
+                queue.task_done()
+                with self.__queued:
+                    self.__queued.wait_for(lambda: self.__puts != puts or self.__cancelled.is_set())
+                continue
+
+            if self.hostPool is not None:
+                try:
+                    hostIndex, worker = self.hostPool.acquire(timeout=self.hostTimeout, avoid=failedOn)
+                except Exception as e:
+                    self.status[ci] = 'failed'
+                    with self.__finished:
+                        errors[ci] = e
+                        self.__finished.notify_all()
+                    queue.task_done()
+                    continue
+
+            def onProgress(progress, ci=ci):
+                # the job is abandoned (stopped by its backend) once the run failed
+                if self.__cancelled.is_set():
+                    raise Exception("Inpaint run failed, chunk abandoned")
+                self.status[ci] = progress
+
+            self.status[ci] = 'running'
+            started, ok = time(), False
+            try:
+                files = self.runChunk(worker, chunk['frameDir'], chunk['maskDir'], chunk['resultDir'],
+                                      inputHeight=chunk['inputSize'][0], inputWidth=chunk['inputSize'][1],
+                                      progressCallback=onProgress)
+                ok = True
+                if self.cache is not None:
+                    self.cache.put(chunk['cacheKey'], files)
+                self.status[ci] = 'done'
+                with self.__finished:
+                    results[ci] = files
+                    self.__finished.notify_all()
+            except Exception as e:
+                if attempt < self.retries and not self.__cancelled.is_set():
+                    print(f"Chunk {ci} failed on {worker.get('hostname')} (attempt {attempt + 1}), retrying: {e}")
+                    self.status[ci] = 'queued'
+                    self.__put(queue, (ci, attempt + 1, failedOn | {hostIndex if self.hostPool is not None else wi}))
+                else:
+                    self.status[ci] = 'cancelled' if self.__cancelled.is_set() else 'failed'
+                    with self.__finished:
+                        errors[ci] = e
+                        self.__finished.notify_all()
+            finally:
+                if self.hostPool is not None:
+                    window = chunk['window']
+                    self.hostPool.release(hostIndex, window[1] - window[0], time() - started, ok)
+                queue.task_done()
+
+    def run(self, frameDirPath, maskDirPath, resultDirPath, workDir=None, segments=None,
+            passthroughFiles=None, spliceFade=0, abandonTimeout=30):
+        """
+            Inpaints the frames/masks directories chunk-wise, the stitched results are
+            written to 'resultDirPath' (same layout as a single Deep-Flow job)
+            'segments' = [(start, finish), ...] restricts inpainting to these frame ranges
+            (see imu.maskedFrameRuns), frames outside are passed through untouched, or
+            taken from 'passthroughFiles' (e.g. previous results, see stitch)
+            Frames are stitched in order while chunks still run, each result file appears
+            complete (see imu.watchImageFiles to consume them as they are written)
+            If a chunk fails for good, queued chunks are dropped and running ones abandoned,
+            their workers are waited for at most 'abandonTimeout' seconds before raising
+            returns the number of result frames
+        """
+        frames = sorted(glob(os.path.join(frameDirPath, "*.png")))
+        masks = sorted(glob(os.path.join(maskDirPath, "*.png")))
+        assert len(frames) == len(masks), "Mismatch in number of frames versus number of masks"
+
+        if segments is None:
+            segments = [(0, len(frames))]
+        windows = [ (segStart + start, segStart + finish) for segStart,segFinish in segments
+                    for start,finish in temporalWindows(segFinish - segStart, self.windowSize, self.overlap) ]
+
+        self.status = {}
+        self.finished, self.exit_status = False, None
+        self.__cancelled.clear()
+        workDir = workDir if workDir is not None else os.path.dirname(os.path.abspath(frameDirPath))
+
+        queue = Queue()
+        results, errors = {}, {}
+        self.chunks = []
+        for ci,(start,finish) in enumerate(windows):
+            chunkDir = os.path.join(workDir, f"chunk_{ci:04d}")
+            chunk = { 'window': (start, finish), 'dir': chunkDir, 'roi': None,
+                      'frameDir': os.path.join(chunkDir, "frames"), 
+                      'maskDir': os.path.join(chunkDir, "masks"),
+                      'resultDir': os.path.join(chunkDir, "Inpaint_Res", "inpaint_res"),
+                      'inputSize': self.maxInputSize }
+
+            if self.cropROI:
+                chunk['roi'] = imu.maskUnionROI([ cv2.imread(f, cv2.IMREAD_GRAYSCALE) for f in masks[start:finish] ],
+                                                padding=self.roiPadding)
+            if chunk['roi'] is not None:
+                y0,y1,x0,x1 = chunk['roi']
+                chunk['inputSize'] = imu.inpaintInputSize((y1 - y0, x1 - x0), self.maxInputSize)
+                self.__cropFiles(frames[start:finish], chunk['frameDir'], chunk['roi'])
+                self.__cropFiles(masks[start:finish], chunk['maskDir'], chunk['roi'])
+            else:
+                self.__linkFiles(frames[start:finish], chunk['frameDir'])
+                self.__linkFiles(masks[start:finish], chunk['maskDir'])
+            self.chunks.append(chunk)
+
+            if self.cropROI and chunk['roi'] is None:
+                # nothing masked in this window: the originals are its result
+                # (never 'passthroughFiles', these frames may have lost their masks)
+                results[ci] = frames[start:finish]
+                self.status[ci] = 'done'
+                continue
+
+            if self.cache is not None:
+                chunk['cacheKey'] = self.cache.key(sorted(glob(os.path.join(chunk['frameDir'], "*.png"))),
+                                                   sorted(glob(os.path.join(chunk['maskDir'], "*.png"))),
+                                                   inputSize=chunk['inputSize'], **self.cacheSettings)
+                if self.cache.restore(chunk['cacheKey'], chunk['resultDir']):
+                    results[ci] = sorted(glob(os.path.join(chunk['resultDir'], "*.png")))
+                    self.status[ci] = 'done'
+                    continue
+            self.status[ci] = 'queued'
+            self.__put(queue, (ci, 0, frozenset()))
+
+        def waitFor(chunkIndices):
+            # blocks until the chunks have results, raises if one of them failed
+            with self.__finished:
+                while not all([ ci in results or ci in errors for ci in chunkIndices ]):
+                    self.__finished.wait()
+                failed = { ci: errors[ci] for ci in chunkIndices if ci in errors }
+            if failed:
+                raise Exception("Inpaint chunks failed: " + 
+                                ", ".join([f"{ci} ({windows[ci]}): {e}" for ci,e in failed.items()]))
+
+        threads = [ Thread(target=self.__workerLoop, args=(wi, w, queue, results, errors), daemon=True)
+                    for wi,w in enumerate(self.workers) ]
+        for t in threads:
+            t.start()
+
+        failed = True
+        try:
+            n = self.stitch(windows, results, resultDirPath, frames,
+                            passthroughFiles=passthroughFiles, spliceFade=spliceFade, waitFor=waitFor)
+            failed = False
+        finally:
+            if failed:
+                self.__cancelled.set()
+                try:
+                    while True:
+                        ci,_,_ = queue.get_nowait()
+                        self.status[ci] = 'cancelled'
+                        queue.task_done()
+                except Empty:
+                    pass
+            for _ in threads:
+                self.__put(queue, None)
+            deadline = time() + abandonTimeout
+            for t in threads:
+                t.join(max(0, deadline - time()) if failed else None)
+            if all([ not t.is_alive() for t in threads ]):     # else left to the workDir's owner
+                for chunk in self.chunks:
+                    shutil.rmtree(chunk['dir'], ignore_errors=True)
+            self.finished, self.exit_status = not failed, 1 if failed else 0
+
+        return n
+
+    def __loadResult(self, ci, files, i, frames):
+        # result of chunk 'ci' for frame i, ROI crops are pasted into the full resolution original
+        chunk = self.chunks[ci]
+        img = cv2.imread(files[i - chunk['window'][0]])
+        if chunk['roi'] is not None:
+            img = imu.pasteROI(cv2.imread(frames[i]), img, chunk['roi'])
+        return img
+
+    @staticmethod
+    def __spliceDistance(covered):
+        # per frame: number of frames to the nearest frame not covered by any chunk
+        n_frames = len(covered)
+        dist = [n_frames] * n_frames
+        last = None
+        for i in range(n_frames):
+            if not covered[i]:
+                last = i
+            elif last is not None:
+                dist[i] = i - last - 1
+        last = None
+        for i in reversed(range(n_frames)):
+            if not covered[i]:
+                last = i
+            elif last is not None:
+                dist[i] = min(dist[i], last - i - 1)
+        return dist
+
+    def stitch(self, windows, chunkResults, resultDirPath, frames, passthroughFiles=None, spliceFade=0,
+               waitFor=None):
+        """
+            Writes the result sequence for all 'frames', frames inside an overlap are 
+            cross-faded linearly from the earlier to the later chunk (at most two chunks
+            overlap, see temporalWindows with overlap <= windowSize/2), frames outside
+            of any chunk are taken from 'passthroughFiles' (default: the originals, 
+            resized to the inpaint result size). With 'passthroughFiles', the first and
+            last 'spliceFade' frames of each inpainted run are cross-faded from them
+            'chunkResults' holds the result files by chunk index, 'waitFor(chunkIndices)'
+            blocks until these chunks have results (frames are then written in order, while
+            later chunks still run). Each result file appears complete (renamed when written)
+        """
+        os.makedirs(resultDirPath, exist_ok=True)
+        n_frames = len(frames)
+        padlength = 5
+        if passthroughFiles is None:
+            passthroughFiles, spliceFade = frames, 0
+        assert len(passthroughFiles) == n_frames, "Mismatch in number of frames versus passed through frames"
+
+        # the result size is that of the first chunk of full frames, once it finished
+        shapeChunks = [ ci for ci,chunk in enumerate(self.chunks) if chunk['roi'] is None ][:1]
+        resultShape = {}
+
+        def loadPassthrough(i):
+            if not resultShape:
+                if waitFor is not None:
+                    waitFor(shapeChunks)
+                resultShape['shape'] = cv2.imread(chunkResults[shapeChunks[0]][0]).shape if shapeChunks else None
+            img = cv2.imread(passthroughFiles[i])
+            shape = resultShape['shape']
+            if shape is not None and img.shape != shape:
+                img = cv2.resize(img, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+            return img
+
+        covered = [ any([ start <= i < finish for start,finish in windows ]) for i in range(n_frames) ]
+        dist = self.__spliceDistance(covered)
+
+        for i in range(n_frames):
+            chunkIndices = [ ci for ci,(start,finish) in enumerate(windows) if start <= i < finish ]
+            if waitFor is not None:
+                waitFor(chunkIndices)
+            sources = [ (ci, windows[ci][0], windows[ci][1], chunkResults[ci]) for ci in chunkIndices ]
+            name = str(i).rjust(padlength,'0') + '.png'
+            target = os.path.join(resultDirPath, name)
+            tmpTarget = os.path.join(resultDirPath, "." + name)   # hidden until complete
+            fade = covered[i] and dist[i] < spliceFade
+
+            if len(sources) == 0:
+                img = loadPassthrough(i)
+            elif len(sources) == 1 and self.chunks[sources[0][0]]['roi'] is None and not fade:
+                ci,start,_,files = sources[0]
+                shutil.copy(files[i - start], tmpTarget)
+                os.replace(tmpTarget, target)
+                continue
+            elif len(sources) == 1:
+                ci,_,_,files = sources[0]
+                img = self.__loadResult(ci, files, i, frames)
+            else:
+                assert len(sources) == 2, f"Frame {i} is covered by more than two chunks"
+                (ciE,_,earlierFinish,filesE),(ciL,laterStart,_,filesL) = sources
+                weight = (i - laterStart + 1) / (earlierFinish - laterStart + 1)   # weight of the later chunk
+                img = cv2.addWeighted(self.__loadResult(ciE, filesE, i, frames), 1.0 - weight, 
+                                      self.__loadResult(ciL, filesL, i, frames), weight, 0)
+
+            if fade:
+                weight = (dist[i] + 1) / (spliceFade + 1)    # weight of the new result
+                img = cv2.addWeighted(loadPassthrough(i), 1.0 - weight, img, weight, 0)
+            cv2.imwrite(tmpTarget, img)
+            os.replace(tmpTarget, target)
+
+        return n_frames
+
+
+def __runJob(inpaint, frameDirPath, maskDirPath, resultDirPath, scheduler, schedulerArgs,
+             transferOverSSH, useDaemon, stallTimeout, inputSize, statusCallback, encode, outputFile):
+    # runs the job, streaming the results to 'encode' if given (see runInpaintJob)
+    transfer = scheduler is None and transferOverSSH and isinstance(inpaint, InpaintRemote)
+    stream = encode is not None and not transfer
+    progress = {'last': None}
+
+    def onProgress(p):
+        progress['last'] = p
+        if statusCallback is not None:
+            statusCallback(p)
+
+    remoteDir = None
+    try:
+        if scheduler is not None:
+            onProgress(scheduler)
+        else:
+            inpaint.connectInpaint(useDaemon=useDaemon)
+            if transfer:
+                # no shared volume: frames and masks are streamed to the inpaint host and back
+                remoteDir = inpaint.makeRemoteTempDir()
+                runFrameDir, runMaskDir = remoteDir + "/frames", remoteDir + "/masks"
+                inpaint.uploadDirectory(frameDirPath, runFrameDir)
+                inpaint.uploadDirectory(maskDirPath, runMaskDir, compress=True)
+            else:
+                runFrameDir, runMaskDir = frameDirPath, maskDirPath
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            if scheduler is not None:
+                job = pool.submit(scheduler.run, frameDirPath, maskDirPath, resultDirPath, **schedulerArgs)
+            else:
+                job = pool.submit(inpaint.runInpaint, frameDirPath=runFrameDir, maskDirPath=runMaskDir,
+                                  inputHeight=inputSize[0], inputWidth=inputSize[1],
+                                  progressCallback=onProgress, stallTimeout=stallTimeout)
+
+            encoder = None
+            if stream:
+                # encoding overlaps inpainting, frames are taken in order as they are written
+                # (backends and workers may write them in any order)
+                print(f"streaming results to {outputFile}", flush=True)
+                n_frames = len(glob(os.path.join(frameDirPath, "*.png")))
+                encoder = pool.submit(encode, imu.watchImageFiles(resultDirPath, job.done, n_frames=n_frames))
+
+            print("working:", end='', flush=True)
+            while not job.done() or (encoder is not None and not encoder.done()):
+                if progress['last'] is not None:
+                    print(f"\r{progress['last']}".ljust(80), end='', flush=True)
+                sleep(1)
+            print("\nfinished")
+
+            res = job.result()      # the job's own errors are reported first
+            if scheduler is None:
+                stdin, stdout, stderr = res
+                for l in stdout:
+                    print(l.strip())
+                assert any(["Propagation has been finished" in l for l in stdout]), \
+                    "Could not determine if results were valid!\n" + "\n".join(stderr[-10:])
+                if transfer:
+                    inpaint.downloadDirectory(remoteDir + "/Inpaint_Res/inpaint_res", resultDirPath)
+            if encoder is not None:
+                encoder.result()
+
+    except Exception:
+        if stream and outputFile is not None and os.path.exists(outputFile):
+            os.remove(outputFile)   # partial output
+        raise
+
+    finally:
+        if scheduler is None:
+            if remoteDir is not None:
+                inpaint.removeRemoteDir(remoteDir)
+            inpaint.disconnectInpaint()
+
+    return stream
+
+
+
+def runInpaintJob(inpaint, frameDirPath, maskDirPath, resultDirPath, scheduler=None, schedulerArgs=None,
+                  transferOverSSH=False, useDaemon=False, stallTimeout=None, inputSize=(512,1024),
+                  cropROI=False, roiPadding=32, cache=None,
+                  statusCallback=None, encode=None, outputFile=None, streamResults=True):
+    """
+        Runs and checks the inpaint job of the frames/masks directories, the results are
+        placed in 'resultDirPath': chunk-wise on 'scheduler' (InpaintChunkScheduler.run with
+        the 'schedulerArgs' dict), or as a single job on the 'inpaint' backend
+        ('transferOverSSH': inputs and results are streamed over the SSH connection,
+        'inputSize': (height, width) the single job inpaints at, chunk sizes are the scheduler's).
+        Without 'scheduler', restricted jobs ('segments' or 'passthroughFiles' in 'schedulerArgs',
+        or 'cropROI' with 'roiPadding') run on a scheduler with the single worker 'inpaint',
+        one chunk per segment.
+        'cache': an InpaintCache, a single job is looked up and stored as a whole
+        (a scheduler made here caches its chunks, a given 'scheduler' uses its own cache).
+        The progress is printed every second and passed to 'statusCallback' (the scheduler,
+        or the InpaintProgress of the single job).
+        'encode(results)' writes 'outputFile': with 'streamResults' from the result frames
+        (an iterator, in order) while the job is running (not with 'transferOverSSH', results
+        then arrive at the end), else from the result files once they are complete.
+        If the job or the streamed encoding fails, the partially written 'outputFile' is removed.
+        Returns True if the results were streamed, raises if the job failed
+    """
+    schedulerArgs = dict(schedulerArgs or {})
+    frames = sorted(glob(os.path.join(frameDirPath, "*.png")))
+
+    if scheduler is None and (cropROI or schedulerArgs.get('segments') is not None
+                              or schedulerArgs.get('passthroughFiles') is not None):
+        # one job per segment on 'inpaint'
+        scheduler = InpaintChunkScheduler([{'backend': lambda: inpaint, 'useDaemon': useDaemon}],
+                                          windowSize=len(frames) + 1, overlap=0, transferOverSSH=transferOverSSH,
+                                          cropROI=cropROI, roiPadding=roiPadding, stallTimeout=stallTimeout,
+                                          maxInputSize=inputSize, cache=cache, cacheSettings=inpaint.cacheSettings())
+
+    cacheKey, cached = None, None
+    if cache is not None and scheduler is None:
+        cacheKey = cache.key(frames, sorted(glob(os.path.join(maskDirPath, "*.png"))),
+                             inputSize=inputSize, **inpaint.cacheSettings())
+        cached = cache.restore(cacheKey, resultDirPath)
+
+    streamed = False
+    if cached:
+        print(f"Inpaint results taken from the cache ({cached} frames)")
+    else:
+        streamed = __runJob(inpaint, frameDirPath, maskDirPath, resultDirPath, scheduler, schedulerArgs,
+                            transferOverSSH, useDaemon, stallTimeout, inputSize, statusCallback,
+                            encode if streamResults else None, outputFile)
+        if cacheKey is not None:
+            cache.put(cacheKey, sorted(glob(os.path.join(resultDirPath, "*.png"))))
+
+    if encode is not None and not streamed:
+        print(f"\n....Writing results to {outputFile}")
+        encode(sorted(glob(os.path.join(resultDirPath, "*.png"))))
 
-        return (stdin, stdout, stderr)
+    return streamed
 
 if __name__ == "__main__":
     pass
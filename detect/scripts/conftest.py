@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the ObjectDetection package is imported from this directory (as demo.py does)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# manual scripts, they need the inpaint container
+collect_ignore = ["test_sshparamiko.py"]
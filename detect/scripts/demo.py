@@ -2,31 +2,40 @@
 # run full video object removal from the command line
 import os
 import sys
-import cv2
 import argparse
 import tempfile
-from glob import glob
-from time import sleep
 import numpy as np
 import ObjectDetection.imutils as imu
 from ObjectDetection.detect import GroupSequence 
-from ObjectDetection.inpaintRemote import InpaintRemote
-from threading import Thread
+from ObjectDetection.inpaintRemote import InpaintRemote, InpaintChunkScheduler, InpaintHostPool, runInpaintJob
+from ObjectDetection.inpaintLocal import InpaintLocal, InpaintPlate
+from ObjectDetection.inpaintCache import InpaintCache
 
 # ------------
 # helper functions
 
-class ThreadWithReturnValue(Thread):
-    def __init__(self, group=None, target=None, name=None,
-                 args=(), kwargs={}, Verbose=None):
-        Thread.__init__(self, group, target, name, args, kwargs)
-        self._return = None
-    def run(self):
-        if self._target is not None:
-            self._return = self._target(*self._args, **self._kwargs)
-    def join(self, *args):
-        Thread.join(self, *args)
-        return self._return
+def makeBackend(args):
+    # inpaint backend selected by --inpaintBackend
+    if args.inpaintBackend == 'local':
+        return InpaintLocal(method=args.localMethod)
+    elif args.inpaintBackend == 'plate':
+        return InpaintPlate(windowSize=args.plateWindow, fallbackMethod=args.localMethod)
+    return InpaintRemote()
+
+
+def parseWorkers(workerList, args):
+    # 'host' or 'host:gpu' -> InpaintChunkScheduler worker dicts
+    # (with --useDaemon, GPU n is served by the daemon on port 48200+n)
+    workers = []
+    for w in workerList:
+        hostname, _, gpu = w.partition(':')
+        worker = {'hostname': hostname, 'useDaemon': args.useDaemon, 'backend': lambda: makeBackend(args)}
+        if args.useDaemon and gpu:
+            worker['daemonPort'] = 48200 + int(gpu)
+        else:
+            worker['CUDA_VISIBLE_DEVICES'] = gpu
+        workers.append(worker)
+    return workers
 
 
 # ------------
@@ -68,6 +77,68 @@ parser.add_argument('--annotateOnly', action='store_true',
 parser.add_argument('--sequenceOnly', action='store_true',
                     help="Perform detection, sequencing,  skip inpainting")
 
+parser.add_argument('--stallTimeout', type=int, default=None,
+                    help="abort inpainting if the remote job produces no output for this many seconds")
+
+parser.add_argument('--transferOverSSH', action='store_true',
+                    help="send frames/masks to the inpaint host over SSH (no shared volume required)")
+
+parser.add_argument('--inpaintBackend', type=str, default='remote', choices=['remote','local','plate'],
+                    help="'remote': Deep-Flow in the inpaint container, 'local': cv2.inpaint on this machine (fast preview), "
+                         "'plate': background plate from other frames (static camera only)")
+
+parser.add_argument('--localMethod', type=str, default='telea', choices=['telea','ns'],
+                    help="cv2.inpaint method of the local backend (fallback of the plate backend)")
+
+parser.add_argument('--plateWindow', type=int, default=31,
+                    help="frames sampled for the background plate")
+
+parser.add_argument('--useDaemon', action='store_true',
+                    help="submit jobs to the resident inpaint daemon (inpaint/scripts/inpaint_daemon.py), " + \
+                         "one daemon per GPU n on port 48200+n for 'host:gpu' workers")
+
+parser.add_argument('--inpaintWorkers', type=str, nargs='+', default=None,
+                    help="inpaint in temporal chunks on these workers, 'host' or 'host:gpu' (e.g. inpaint:0 inpaint:1)")
+
+parser.add_argument('--healthCheckInterval', type=int, default=30,
+                    help="seconds between health checks of the --inpaintWorkers (chunks go to the least-loaded healthy worker)")
+
+parser.add_argument('--chunkSize', type=int, default=100,
+                    help="frames per chunk when using --inpaintWorkers")
+
+parser.add_argument('--chunkOverlap', type=int, default=10,
+                    help="frames shared (cross-faded) by consecutive chunks")
+
+parser.add_argument('--skipEmptyFrames', action='store_true',
+                    help="inpaint only runs of frames with masks (+/- contextMargin), pass other frames through")
+
+parser.add_argument('--contextMargin', type=int, default=5,
+                    help="context frames kept around masked frames with --skipEmptyFrames")
+
+parser.add_argument('--cropROI', action='store_true',
+                    help="inpaint only the region around the masks, pasted back at full resolution")
+
+parser.add_argument('--roiPadding', type=int, default=32,
+                    help="pixels added around the mask region with --cropROI")
+
+parser.add_argument('--compositeFullRes', action='store_true',
+                    help="blend only the inpainted (masked) pixels into the full resolution frames")
+
+parser.add_argument('--preResize', action='store_true',
+                    help="write frames and masks at the inpaint working size (512x1024), --compositeFullRes restores the original resolution")
+
+parser.add_argument('--streamResults', action='store_true',
+                    help="encode result frames while the inpaint job is still running (also chunk-wise, not with --transferOverSSH or --smartRender)")
+
+parser.add_argument('--cacheDir', type=str, default=None,
+                    help="reuse inpaint results for identical frames, masks and settings (per chunk when chunking)")
+
+parser.add_argument('--cacheSize', type=float, default=20,
+                    help="maximum size of the inpaint cache in GB (least recently used entries are evicted)")
+
+parser.add_argument('--smartRender', action='store_true',
+                    help="Output the full input video, re-encoding only GOPs with masked frames (video input only, results are composited at full resolution)")
+
 if __name__ == '__main__':
 
     #--------------
@@ -181,40 +252,62 @@ if __name__ == '__main__':
         frameDirPath =os.path.join(tempdir,"frames")
         maskDirPath = os.path.join(tempdir,"masks")
         resultDirPath = os.path.join(os.path.join(tempdir,"Inpaint_Res"),"inpaint_res")
+        smartRender = args.smartRender and not os.path.isdir(vfile)
+        inputSize = (512,1024)      # inpaint working size (Deep-Flow maximum)
 
-        groupseq.write_ImageMaskSequence(
-            writeImagesToDirectory=frameDirPath,
-            writeMasksToDirectory=maskDirPath)
-
-        rinpaint = InpaintRemote() 
-        rinpaint.connectInpaint()
+        def encodeResults(results):
+            # 'results': result frames or file paths, in frame order
+            imu.writeInpaintResultsToVideo(results, args.outfile, fps=fps, useFFMPEGdirect=True,
+                                           originals=groupseq.imglist if args.compositeFullRes else None,
+                                           maskList=groupseq.combinedMaskList)
 
-        trd1 = ThreadWithReturnValue(target=rinpaint.runInpaint,
-                                 kwargs={'frameDirPath':frameDirPath,'maskDirPath':maskDirPath})
-        trd1.start() 
+        if groupseq.combinedMaskList is None:
+            groupseq.combine_MaskSequence()
 
-        print("working:",end='',flush=True)
-        while trd1.is_alive():
-            print('.',end='',flush=True)
-            sleep(1)
-
-        print("\nfinished")
-        rinpaint.disconnectInpaint()
-
-        stdin,stdout,stderr = trd1.join()
-        ok = False
-        for l in stdout:
-            if "Propagation has been finished" in l: 
-                ok = True
-            print(l.strip())
-        
-        assert ok, "Could not determine if results were valid!"
-        
-        print(f"\n....Writing results to {args.outfile}")
-
-        resultfiles = sorted(glob(os.path.join(resultDirPath,"*.png")))
-        imgres = [ cv2.imread(f) for f in resultfiles]
-        imu.writeFramesToVideo(imgres, filePath=args.outfile, fps=fps)
+        groupseq.write_ImageMaskSequence(
+            writeImagesToDirectory=frameDirPath,
+            writeMasksToDirectory=maskDirPath,
+            resizeTo=inputSize if args.preResize else None)
+
+        segments = None
+        if args.skipEmptyFrames:
+            segments = imu.maskedFrameRuns(groupseq.combinedMaskList, margin=args.contextMargin)
+            print(f"Inpainting {sum([f - s for s,f in segments])} of {len(groupseq.combinedMaskList)} frames")
+
+        cache = InpaintCache(args.cacheDir, maxBytes=int(args.cacheSize * 2**30)) if args.cacheDir else None
+
+        # overlapping temporal chunks, inpainted concurrently on all workers
+        # (without workers: one job per segment on the default inpaint host, see runInpaintJob)
+        scheduler = None
+        if args.inpaintWorkers:
+            hostPool = InpaintHostPool(parseWorkers(args.inpaintWorkers, args), 
+                                       checkInterval=args.healthCheckInterval)
+            scheduler = InpaintChunkScheduler(hostPool,
+                                              windowSize=args.chunkSize,
+                                              overlap=args.chunkOverlap,
+                                              transferOverSSH=args.transferOverSSH,
+                                              cropROI=args.cropROI, roiPadding=args.roiPadding,
+                                              cache=cache, cacheSettings=makeBackend(args).cacheSettings(),
+                                              stallTimeout=args.stallTimeout, maxInputSize=inputSize)
+
+        if smartRender:
+            encode = lambda resultfiles: imu.smartRenderInpaintResults(vfile, resultfiles, groupseq.imglist,
+                                                                       groupseq.combinedMaskList,
+                                                                       filePath=args.outfile, startframe=startframe)
+        else:
+            encode = encodeResults
+
+        try:
+            runInpaintJob(makeBackend(args), frameDirPath, maskDirPath, resultDirPath,
+                          scheduler=scheduler, schedulerArgs={'workDir': tempdir, 'segments': segments},
+                          transferOverSSH=args.transferOverSSH, useDaemon=args.useDaemon,
+                          stallTimeout=args.stallTimeout, inputSize=inputSize,
+                          cropROI=args.cropROI, roiPadding=args.roiPadding, cache=cache,
+                          encode=encode, outputFile=args.outfile,
+                          streamResults=args.streamResults and not smartRender)
+        finally:
+            if scheduler is not None and scheduler.hostPool is not None:
+                scheduler.hostPool.close()
         print(f"Finished writing {args.outfile} ")
 
     print("Done")
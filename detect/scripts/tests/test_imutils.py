@@ -0,0 +1,144 @@
+import os
+import random
+import shutil
+from threading import Thread
+from time import sleep
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+import ObjectDetection.imutils as imu
+
+
+def frame(i, h=8, w=12):
+    return np.full((h, w, 3), i, dtype=np.uint8)
+
+
+def test_watchImageFiles_out_of_order(tmp_path):
+    n = 20
+    order = list(range(n))
+    random.Random(0).shuffle(order)
+    done = []
+
+    def writer():
+        for i in order:
+            cv2.imwrite(str(tmp_path / (str(i).rjust(5, '0') + ".png")), frame(i))
+            sleep(0.01)
+        done.append(True)
+
+    t = Thread(target=writer)
+    t.start()
+    images = list(imu.watchImageFiles(str(tmp_path), lambda: bool(done), n_frames=n, pollInterval=0.02))
+    t.join()
+
+    assert [int(img[0, 0, 0]) for img in images] == list(range(n))
+
+
+def test_watchImageFiles_missing_frame(tmp_path):
+    for i in (0, 2):
+        cv2.imwrite(str(tmp_path / f"{i:05d}.png"), frame(i))
+    with pytest.raises(Exception, match="frame 1 is missing"):
+        list(imu.watchImageFiles(str(tmp_path), lambda: True, pollInterval=0.01))
+
+
+def test_frameRuns_margin_and_merge():
+    flags = [False] * 10
+    flags[2] = flags[5] = True
+    assert imu.frameRuns(flags, margin=1) == [(1, 7)]     # touching runs are merged
+    assert imu.frameRuns([True] + [False] * 8 + [True], margin=2) == [(0, 3), (7, 10)]
+    assert imu.frameRuns([False] * 4) == []
+
+
+def test_maskedFrameRuns():
+    masks = [np.zeros((4, 4), bool) for _ in range(8)]
+    masks[6][1, 1] = True
+    assert imu.maskedFrameRuns(masks, margin=1) == [(5, 8)]
+
+
+def test_maskUnionROI():
+    mask = np.zeros((100, 200), bool)
+    mask[40:50, 60:80] = True
+    other = np.zeros_like(mask)
+    other[45, 100] = True
+    # union rows 40..49, cols 60..100, padded by 4 and rounded out to multiples of 8
+    assert imu.maskUnionROI([mask, other], padding=4, multiple=8) == (32, 56, 56, 112)
+    assert imu.maskUnionROI([np.zeros_like(mask)]) is None
+    assert imu.maskUnionROI([mask], padding=64) == (0, 100, 0, 144)    # rows clipped to the frame
+
+
+def test_inpaintInputSize():
+    assert imu.inpaintInputSize((100, 200)) == (128, 256)     # not upscaled, rounded up
+    assert imu.inpaintInputSize((1080, 1920)) == (512, 960)   # downscaled to fit 512x1024
+    assert imu.inpaintInputSize((2000, 100)) == (512, 64)
+
+
+def test_pasteROI():
+    im = np.zeros((20, 30, 3), np.uint8)
+    res = imu.pasteROI(im, np.full((5, 5, 3), 200, np.uint8), (4, 14, 10, 20))
+    assert (res[4:14, 10:20] == 200).all()        # resized to the region
+    assert res[:4].max() == 0 and res[:, :10].max() == 0
+    assert im.max() == 0                          # pasted into a copy
+
+
+def test_resizeMask_keeps_thin_masks():
+    mask = np.zeros((100, 100), bool)
+    mask[50, :] = True                            # one pixel thin line
+    small = imu.resizeMask(mask, (10, 10))
+    assert small.dtype == bool and small.shape == (10, 10)
+    assert small[5].all() and small.sum() == 10
+    big = imu.resizeMask(small, (100, 100))
+    assert big.shape == (100, 100) and big[50:60].all() and big.sum() == 1000
+
+
+@pytest.mark.parametrize("bitDepth", [1, 8])
+def test_mask_bitDepth_round_trip(tmp_path, bitDepth):
+    rng = np.random.default_rng(0)
+    masks = [rng.random((16, 24)) > 0.5 for _ in range(3)]
+    masks.append(masks[0].astype(np.uint8) * 255)
+    imu.writeMasksToDirectory(masks, str(tmp_path), bitDepth=bitDepth)
+    files = sorted(os.listdir(str(tmp_path)))
+    assert files == ["0.png", "1.png", "2.png", "3.png"]
+    for fname, msk in zip(files, masks):
+        img = cv2.imread(str(tmp_path / fname), cv2.IMREAD_GRAYSCALE)
+        assert np.array_equal(img > 0, msk.astype(bool))
+
+
+def test_FrameStore_round_trip(tmp_path):
+    path = str(tmp_path / "frames.store")
+    frames = [frame(i, 6, 10) for i in range(5)]
+    store = imu.FrameStore.fromFrames(path, (f for f in frames), fps=25.0)   # count not known upfront
+    assert imu.isFrameStore(path) and not imu.isFrameStore(str(tmp_path))
+    assert len(store) == 5 and store.shape == (5, 6, 10, 3) and store.fps == 25.0
+    assert all(np.array_equal(a, b) for a, b in zip(store, frames))
+
+    writable = imu.FrameStore(path, mode='r+')
+    writable[2] = frame(99, 6, 10)
+    writable.close()
+    assert imu.FrameStore(path)[2][0, 0, 0] == 99
+
+    empty = imu.FrameStore.create(str(tmp_path / "empty.store"), 3, (4, 5), channels=1)
+    assert empty.shape == (3, 4, 5, 1) and empty[1].max() == 0
+
+
+def test_masksToLabelMap():
+    a = np.zeros((4, 4), bool)
+    a[0, :] = True
+    b = np.zeros((4, 4), np.uint8)
+    b[:, 0] = 255
+    labels = imu.masksToLabelMap([a, [], b], heightWidth=(4, 4))
+    assert labels.dtype == np.uint16
+    assert labels[0, 1] == 1 and labels[0, 0] == 3 and labels[3, 3] == 0
+
+
+@pytest.mark.skipif(shutil.which("ffprobe") is None, reason="smartRenderVideo needs ffmpeg/ffprobe")
+def test_smartRenderVideo_frame_count(tmp_path):
+    source = str(tmp_path / "source.mp4")
+    frames = [frame(i * 8, 64, 96) for i in range(30)]
+    imu.writeFramesToVideo(frames, filePath=source, fps=30, useFFMPEGdirect=True)
+    masks = [np.zeros((64, 96), bool) for _ in frames]
+    masks[15][10:20, 10:20] = True
+    out = str(tmp_path / "out.mp4")
+    res = imu.smartRenderVideo(source, frames, masks, filePath=out)
+    assert res['reencoded'] + res['copied'] == len(frames) and res['reencoded'] > 0
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from ObjectDetection.inpaintCache import InpaintCache, InpaintHistory
+
+
+def writeFiles(dirPath, values):
+    os.makedirs(dirPath, exist_ok=True)
+    files = []
+    for i, v in enumerate(values):
+        files.append(os.path.join(dirPath, f"{i:05d}.png"))
+        cv2.imwrite(files[-1], np.full((4, 6, 3), v, dtype=np.uint8))
+    return files
+
+
+def test_cache_key_covers_content_and_settings(tmp_path):
+    frames = writeFiles(str(tmp_path / "frames"), [1, 2])
+    masks = writeFiles(str(tmp_path / "masks"), [0, 255])
+    key = InpaintCache.key(frames, masks, inputSize=(512, 1024))
+    assert key == InpaintCache.key(frames, masks, inputSize=(512, 1024))
+    assert key != InpaintCache.key(frames, masks, inputSize=(256, 512))
+    writeFiles(str(tmp_path / "masks"), [0, 0])
+    assert key != InpaintCache.key(frames, masks, inputSize=(512, 1024))
+
+
+def test_cache_miss_put_restore(tmp_path):
+    cache = InpaintCache(str(tmp_path / "cache"))
+    results = writeFiles(str(tmp_path / "results"), [10, 20, 30])
+    assert cache.get("k") is None and cache.restore("k", str(tmp_path / "out")) is None
+
+    cache.put("k", results)
+    assert [os.path.basename(f) for f in cache.get("k")] == [os.path.basename(f) for f in results]
+    assert cache.restore("k", str(tmp_path / "out")) == 3
+    assert int(cv2.imread(str(tmp_path / "out" / "00002.png"))[0, 0, 0]) == 30
+
+
+def test_cache_empty_entries_are_misses(tmp_path):
+    cache = InpaintCache(str(tmp_path / "cache"))
+    cache.put("k", [])
+    assert cache.get("k") is None
+    os.makedirs(os.path.join(cache.cacheDir, "k"))      # e.g. left by an interrupted run
+    assert cache.restore("k", str(tmp_path / "out")) is None
+    cache.put("k", writeFiles(str(tmp_path / "results"), [1]))
+    assert len(cache.get("k")) == 1
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = InpaintCache(str(tmp_path / "cache"))
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, writeFiles(str(tmp_path / key), [i]))
+        os.utime(os.path.join(cache.cacheDir, key), (i, i))
+    cache.get("a")                                      # recently used
+    cache.maxBytes = cache.size() - 1
+    cache.evict()
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_history_changed_runs(tmp_path):
+    history = InpaintHistory(str(tmp_path / "history"))
+    masks = [np.zeros((4, 6), bool) for _ in range(20)]
+    assert history.changedRuns("seq", masks) is None    # no previous run
+
+    history.update("seq", masks, writeFiles(str(tmp_path / "results"), range(20)))
+    assert history.changedRuns("seq", masks) == []
+    assert history.changedRuns("other", masks) is None
+    assert history.changedRuns("seq", masks[:10]) is None
+
+    changed = [m.copy() for m in masks]
+    changed[10][1, 1] = True
+    assert history.changedRuns("seq", changed, margin=2) == [(8, 13)]
+
+
+def test_history_survives_restart(tmp_path):
+    masks = [np.zeros((3, 13), bool) for _ in range(4)]
+    masks[2][1, 12] = True                              # packed rows are not byte aligned
+    InpaintHistory(str(tmp_path / "history")).update("seq", masks,
+                                                     writeFiles(str(tmp_path / "results"), range(4)))
+
+    history = InpaintHistory(str(tmp_path / "history"))
+    assert history.lastKey == "seq" and len(history.resultFiles()) == 4
+    assert all(np.array_equal(a, b) for a, b in zip(history.masks, masks))
+    assert history.changedRuns("seq", masks) == []
+
+
+def test_history_incomplete_state_is_ignored(tmp_path):
+    history = InpaintHistory(str(tmp_path / "history"))
+    history.update("seq", [np.zeros((2, 2), bool)] * 2, writeFiles(str(tmp_path / "results"), range(2)))
+    os.remove(history.resultFiles()[0])                 # results no longer match the state
+    assert not InpaintHistory(str(tmp_path / "history")).load()
+    os.remove(history.statePath)
+    assert InpaintHistory(str(tmp_path / "history")).lastKey is None
@@ -0,0 +1,126 @@
+from threading import Event, Thread
+
+import pytest
+
+pytest.importorskip("paramiko")
+pytest.importorskip("cv2")
+
+import ObjectDetection.inpaintRemote as ir
+from ObjectDetection.inpaintRemote import SSHSessionPool, InpaintHostPool
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+        self._channels = []
+
+    def is_active(self):
+        return self.active
+
+
+class FakeClient:
+    def __init__(self):
+        self.transport = FakeTransport()
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.transport.active = False
+
+
+class FakePool(SSHSessionPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened = []
+        self.blocking = {}     # hostname : Event released to finish the connect
+
+    def connect(self, hostname, port, username, password, timeout=None):
+        if hostname in self.blocking:
+            self.blocking[hostname].wait(5)
+        client = FakeClient()
+        self.opened.append((hostname, client))
+        return client
+
+
+def borrow(pool, hostname="inpaint"):
+    return pool.borrow(hostname, "appuser", "appuser")
+
+
+def test_sessionPool_reuses_idle_session():
+    pool = FakePool(poolSize=2)
+    first = borrow(pool)
+    assert borrow(pool) is first
+    assert len(pool.opened) == 1
+
+
+def test_sessionPool_opens_more_sessions_when_busy():
+    pool = FakePool(poolSize=2)
+    first = borrow(pool)
+    first.transport._channels.append(object())
+    second = borrow(pool)
+    assert second is not first
+    second.transport._channels.extend([object(), object()])
+    assert borrow(pool) is first    # pool full, least busy session
+    assert len(pool.opened) == 2
+
+
+def test_sessionPool_replaces_dead_session():
+    pool = FakePool(poolSize=1)
+    first = borrow(pool)
+    first.close()
+    assert borrow(pool) is not first
+
+
+def test_sessionPool_connects_outside_lock():
+    pool = FakePool(poolSize=1)
+    pool.blocking["slow"] = Event()
+    t = Thread(target=borrow, args=(pool, "slow"))
+    t.start()
+    try:
+        got = []
+        other = Thread(target=lambda: got.append(borrow(pool, "fast")))
+        other.start()
+        other.join(2)
+        assert got, "a slow connect blocked the pool"
+    finally:
+        pool.blocking["slow"].set()
+        t.join()
+
+
+def test_checkHost_does_not_use_shared_pool(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("health check borrowed from the shared session pool")
+    monkeypatch.setattr(ir.sessionPool, "borrow", fail)
+
+    opened = []
+    monkeypatch.setattr(SSHSessionPool, "connect",
+                        lambda self, *args, **kwargs: opened.append(self.connectTimeout) or FakeClient())
+    monkeypatch.setattr(ir.InpaintRemote, "testConnectionInpaint", lambda self, hardErrors=True: True)
+
+    assert InpaintHostPool.checkHost({'hostname': "inpaint"}, timeout=3) is True
+    assert opened == [3]
+
+
+def test_checkHost_unreachable():
+    assert InpaintHostPool.checkHost({'hostname': "127.0.0.1", 'port': 1}, timeout=2) is False
+
+
+def test_streamInpaintDaemon_cancels_abandoned_job(monkeypatch):
+    requests = []
+
+    def daemonRequest(self, request, timeout=None):
+        requests.append(request['cmd'])
+        if request['cmd'] == 'submit':
+            return {'job': 7}
+        if request['cmd'] == 'status':
+            return {'state': 'running', 'output': "", 'offset': 0, 'errors': "", 'errorOffset': 0}
+        return {'state': 'running'}
+    monkeypatch.setattr(ir.InpaintRemote, "daemonRequest", daemonRequest)
+
+    inpaint = ir.InpaintRemote()
+    inpaint.isConnected = True
+    stream = inpaint.streamInpaintDaemon([], pollInterval=0)
+    next(stream)
+    stream.close()
+    assert requests == ['submit', 'status', 'cancel']
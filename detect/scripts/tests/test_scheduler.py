@@ -0,0 +1,175 @@
+import os
+import shutil
+from glob import glob
+from time import time, sleep
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("paramiko")
+
+from ObjectDetection.inpaintBackend import InpaintBackend, InpaintProgress
+from ObjectDetection.inpaintCache import InpaintCache
+from ObjectDetection.inpaintRemote import InpaintChunkScheduler, runInpaintJob
+
+
+class CopyBackend(InpaintBackend):
+    """
+        Copies the frames as results, 'fail(frameDirPath)' may raise or block first
+    """
+    def __init__(self, fail=None):
+        self.fail = fail
+
+    def connectInpaint(self, **kwargs):
+        self.isConnected = True
+
+    def runInpaint(self, frameDirPath, maskDirPath, progressCallback=None, stallTimeout=None, **kwargs):
+        progress = InpaintProgress()
+        if self.fail is not None:
+            self.fail(frameDirPath, lambda: progressCallback(progress))
+        resultDir = os.path.join(os.path.dirname(frameDirPath), "Inpaint_Res", "inpaint_res")
+        os.makedirs(resultDir, exist_ok=True)
+        for f in sorted(glob(os.path.join(frameDirPath, "*.png"))):
+            shutil.copy(f, os.path.join(resultDir, os.path.basename(f)))
+        progress.stdoutLines.append("Propagation has been finished")
+        progressCallback(progress)
+        return (None, progress.stdoutLines, progress.stderrLines)
+
+
+def writeSequence(dirPath, n_frames, h=8, w=12):
+    frameDir, maskDir = os.path.join(dirPath, "frames"), os.path.join(dirPath, "masks")
+    os.makedirs(frameDir)
+    os.makedirs(maskDir)
+    for i in range(n_frames):
+        cv2.imwrite(os.path.join(frameDir, f"{i:03d}.png"), np.full((h, w, 3), i, dtype=np.uint8))
+        cv2.imwrite(os.path.join(maskDir, f"{i:03d}.png"), np.full((h, w), 255, dtype=np.uint8))
+    return frameDir, maskDir
+
+
+def chunkIndex(frameDirPath):
+    return int(os.path.basename(os.path.dirname(frameDirPath)).split("_")[1])
+
+
+def test_run_retries_on_other_worker(tmp_path):
+    frameDir, maskDir = writeSequence(str(tmp_path), 30)
+
+    def fail(frameDirPath, progress):
+        raise Exception("worker 0 is broken")
+
+    workers = [{'backend': lambda: CopyBackend(fail)}, {'backend': CopyBackend}]
+    scheduler = InpaintChunkScheduler(workers, windowSize=10, overlap=2, retries=1)
+    resultDir = os.path.join(str(tmp_path), "results")
+    assert scheduler.run(frameDir, maskDir, resultDir) == 30
+
+    results = sorted(glob(os.path.join(resultDir, "*.png")))
+    assert [int(cv2.imread(f)[0, 0, 0]) for f in results] == list(range(30))
+    assert set(scheduler.status.values()) == {'done'}
+
+
+def test_run_failure_abandons_running_chunks(tmp_path):
+    frameDir, maskDir = writeSequence(str(tmp_path), 20)
+
+    def fail(frameDirPath, progress):
+        if chunkIndex(frameDirPath) == 0:
+            sleep(0.2)
+            raise Exception("chunk 0 is broken")
+        for _ in range(600):      # a long job, reporting progress
+            progress()
+            sleep(0.1)
+
+    workers = [{'backend': lambda: CopyBackend(fail)} for _ in range(2)]
+    scheduler = InpaintChunkScheduler(workers, windowSize=10, overlap=0, retries=0)
+    started = time()
+    with pytest.raises(Exception, match="chunk 0 is broken"):
+        scheduler.run(frameDir, maskDir, os.path.join(str(tmp_path), "results"))
+    assert time() - started < 10
+    assert scheduler.status[1] == 'cancelled'
+
+
+def test_run_exit_status(tmp_path):
+    frameDir, maskDir = writeSequence(str(tmp_path), 12)
+    scheduler = InpaintChunkScheduler([{'backend': CopyBackend}], windowSize=10, overlap=2)
+    assert scheduler.exit_status is None
+    scheduler.run(frameDir, maskDir, os.path.join(str(tmp_path), "results"))
+    assert scheduler.finished and scheduler.exit_status == 0
+
+
+def test_runInpaintJob_cache_and_encode(tmp_path):
+    frameDir, maskDir = writeSequence(str(tmp_path), 6)
+    resultDir = os.path.join(str(tmp_path), "Inpaint_Res", "inpaint_res")
+    cache = InpaintCache(os.path.join(str(tmp_path), "cache"))
+    jobs, encoded = [], []
+
+    def fail(frameDirPath, progress):
+        jobs.append(frameDirPath)
+
+    for _ in range(2):
+        shutil.rmtree(resultDir, ignore_errors=True)
+        streamed = runInpaintJob(CopyBackend(fail), frameDir, maskDir, resultDir, cache=cache,
+                                 encode=lambda files: encoded.append([os.path.basename(f) for f in files]),
+                                 streamResults=False)
+        assert not streamed
+    assert len(jobs) == 1           # the second run is restored from the cache
+    assert encoded == [[f"{i:03d}.png" for i in range(6)]] * 2
+
+
+def test_runInpaintJob_segments_stream(tmp_path):
+    frameDir, maskDir = writeSequence(str(tmp_path), 10)
+    resultDir = os.path.join(str(tmp_path), "results")
+    encoded = []
+    streamed = runInpaintJob(CopyBackend(), frameDir, maskDir, resultDir,
+                             schedulerArgs={'workDir': str(tmp_path), 'segments': [(2, 5), (7, 9)]},
+                             encode=lambda frames: encoded.extend([int(img[0, 0, 0]) for img in frames]))
+    assert streamed
+    assert encoded == list(range(10))   # inpainted segments and passed through frames
+
+
+def test_temporalWindows():
+    from ObjectDetection.inpaintRemote import temporalWindows
+    assert temporalWindows(5, windowSize=10, overlap=2) == [(0, 5)]
+    windows = temporalWindows(25, windowSize=10, overlap=2)
+    assert windows == [(0, 10), (8, 18), (16, 25)]
+    assert all(b[0] == a[1] - 2 for a, b in zip(windows, windows[1:]))
+
+
+def writeConstant(dirPath, values, h=8, w=12):
+    os.makedirs(dirPath, exist_ok=True)
+    files = []
+    for i, v in enumerate(values):
+        files.append(os.path.join(dirPath, f"{i:03d}.png"))
+        cv2.imwrite(files[-1], np.full((h, w, 3), v, dtype=np.uint8))
+    return files
+
+
+def test_stitch_cross_fades_overlaps(tmp_path):
+    frames = writeConstant(str(tmp_path / "frames"), [50] * 20)
+    earlier = writeConstant(str(tmp_path / "earlier"), [0] * 10)
+    later = writeConstant(str(tmp_path / "later"), [200] * 10)
+
+    scheduler = InpaintChunkScheduler([{}], windowSize=10, overlap=4)
+    windows = [(0, 10), (6, 16)]
+    scheduler.chunks = [{'window': w, 'roi': None} for w in windows]
+    resultDir = str(tmp_path / "results")
+    assert scheduler.stitch(windows, {0: earlier, 1: later}, resultDir, frames) == 20
+
+    values = [int(cv2.imread(f)[0, 0, 0]) for f in sorted(glob(os.path.join(resultDir, "*.png")))]
+    assert values[:6] == [0] * 6
+    assert values[6:10] == [40, 80, 120, 160]   # later chunk weighted 1/5 .. 4/5
+    assert values[10:16] == [200] * 6
+    assert values[16:] == [50] * 4              # not covered: passed through
+    assert not glob(os.path.join(resultDir, ".*"))
+
+
+def test_stitch_splices_into_passthrough(tmp_path):
+    frames = writeConstant(str(tmp_path / "frames"), [50] * 10)
+    previous = writeConstant(str(tmp_path / "previous"), [100] * 10)
+    chunk = writeConstant(str(tmp_path / "chunk"), [0] * 4)
+
+    scheduler = InpaintChunkScheduler([{}], windowSize=10, overlap=0)
+    scheduler.chunks = [{'window': (3, 7), 'roi': None}]
+    resultDir = str(tmp_path / "results")
+    scheduler.stitch([(3, 7)], {0: chunk}, resultDir, frames, passthroughFiles=previous, spliceFade=1)
+
+    values = [int(cv2.imread(f)[0, 0, 0]) for f in sorted(glob(os.path.join(resultDir, "*.png")))]
+    assert values == [100, 100, 100, 50, 0, 0, 50, 100, 100, 100]   # run ends cross-faded by half
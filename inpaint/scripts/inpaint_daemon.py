@@ -0,0 +1,279 @@
+# Resident Deep-Flow inpaint worker, to be run from within the inpaint container:
+#
+#   /usr/bin/python3 /home/appuser/scripts/inpaint_daemon.py --port 48200 &
+#
+# Jobs are queued and run one at a time inside this process, so the interpreter start,
+# the torch/CUDA initialization and reading the pretrained checkpoints (torch.load is
+# memoized while a job runs) are paid once, instead of once per 'video_inpaint.py' process.
+# The models themselves are still built by each job, from the cached checkpoints.
+# Run one daemon per GPU for several GPUs: CUDA_VISIBLE_DEVICES=n ... --port 4820n
+# (the port demo.py uses for a 'host:n' worker with --useDaemon)
+#
+# Protocol: one JSON request per line on 127.0.0.1:<port>, one JSON reply per line
+#   {"cmd": "submit", "args": [...video_inpaint.py arguments...]}  -> {"job": id}
+#   {"cmd": "status", "job": id, "offset": n, "errorOffset": e}
+#       -> {"state": s, "output": stdout from byte n, "offset": m, "errors": stderr from byte e, "errorOffset": f}
+#   {"cmd": "cancel", "job": id}               -> {"state": s}
+#   {"cmd": "list"}                            -> {"jobs": {id: state, ...}, "queued": n}
+#   {"cmd": "ping"}                            -> {"ok": true}
+# states: 'queued', 'running', 'done', 'failed', 'cancelled'
+# A cancelled queued job is never started, a running one is interrupted by an exception
+# raised in the worker thread (taking effect once the job is back in python code)
+# (the container runs python 3.5: no f-strings)
+import os
+import sys
+import gc
+import copy
+import json
+import runpy
+import ctypes
+import argparse
+import itertools
+import threading
+import traceback
+import socketserver
+from queue import Queue
+
+parser = argparse.ArgumentParser(description='Resident Deep-Flow inpaint worker')
+
+parser.add_argument('--port', type=int, default=48200,
+                    help="port to listen on (localhost only, reached through SSH forwarding)")
+
+parser.add_argument('--workingDir', type=str, default="/home/appuser/Deep-Flow",
+                    help="Deep-Flow directory")
+
+parser.add_argument('--scriptPath', type=str, default="/home/appuser/Deep-Flow/tools/video_inpaint.py",
+                    help="inpaint script executed for each job")
+
+parser.add_argument('--logDir', type=str, default="/tmp/inpaint_jobs",
+                    help="directory for the job output logs")
+
+
+class CheckpointCache:
+    """
+        Memoizes torch.load by file path (and map_location), checkpoints are
+        read and deserialized once. Each call returns a deep copy, so a job
+        cannot change the cached checkpoint (nested state dicts included).
+        Replaces torch.load only while a job runs (see InpaintJobs.run)
+    """
+    def __init__(self, torch):
+        self.load = torch.load
+        self.lock = threading.Lock()
+        self.cache = {}
+
+    def __call__(self, f, map_location=None, *args, **kwargs):
+        if not isinstance(f, str) or args or kwargs or \
+           not (map_location is None or isinstance(map_location, str)):
+            return self.load(f, map_location, *args, **kwargs)
+
+        key = (os.path.abspath(f), map_location)
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = self.load(f, map_location)
+            return copy.deepcopy(self.cache[key])
+
+
+class ThreadOutput:
+    """
+        Stands in for sys.stdout/sys.stderr: writes of a thread which set 'local.stream'
+        go there (the job's log), all other threads write to the original stream
+    """
+    local = threading.local()
+
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.name = name
+
+    def target(self):
+        return getattr(self.local, self.name, None) or self.stream
+
+    def write(self, data):
+        return self.target().write(data)
+
+    def flush(self):
+        return self.target().flush()
+
+    def __getattr__(self, attr):
+        return getattr(self.target(), attr)
+
+
+class JobCancelled(BaseException):
+    # not an Exception, so that the job's own error handling does not swallow it
+    pass
+
+
+def raiseInThread(threadId, exceptionType):
+    # 'exceptionType' None clears a pending exception
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(threadId),
+                                               ctypes.py_object(exceptionType) if exceptionType else None)
+
+
+class InpaintJobs:
+    """
+        Job queue, executed by a single worker thread (one job on the GPU at a time)
+    """
+    def __init__(self, scriptPath, logDir, checkpoints=None):
+        self.scriptPath = scriptPath
+        self.logDir = logDir
+        self.checkpoints = checkpoints
+        self.queue = Queue()
+        self.state = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.running = None     # (jobId, worker thread id) while a job's script runs
+        self.cancelRequests = set()
+        os.makedirs(logDir, exist_ok=True)
+
+    def logPath(self, jobId, ext='log'):
+        # stdout in <id>.log, stderr in <id>.err
+        return os.path.join(self.logDir, "{}.{}".format(jobId, ext))
+
+    def submit(self, args):
+        jobId = next(self.ids)
+        self.state[jobId] = 'queued'
+        for ext in ('log', 'err'):
+            open(self.logPath(jobId, ext), 'w').close()
+        self.queue.put((jobId, [str(a) for a in args]))
+        return jobId
+
+    def read(self, jobId, ext, offset):
+        with open(self.logPath(jobId, ext), 'rb') as f:
+            f.seek(offset)
+            return f.read()
+
+    def status(self, jobId, offset=0, errorOffset=0):
+        state = self.state[jobId]   # before reading, so a finished job's logs are complete
+        data = self.read(jobId, 'log', offset)
+        errors = self.read(jobId, 'err', errorOffset)
+        return { 'state': state,
+                 'output': data.decode(errors='replace'),
+                 'offset': offset + len(data),
+                 'errors': errors.decode(errors='replace'),
+                 'errorOffset': errorOffset + len(errors) }
+
+    def cancel(self, jobId):
+        with self.lock:
+            state = self.state[jobId]
+            if state == 'queued':
+                self.state[jobId] = 'cancelled'     # skipped by the worker
+            elif state == 'running' and jobId not in self.cancelRequests:
+                self.cancelRequests.add(jobId)
+                if self.running is not None and self.running[0] == jobId:
+                    raiseInThread(self.running[1], JobCancelled)
+            return state
+
+    def run(self):
+        while True:
+            jobId, args = self.queue.get()
+            with self.lock:
+                if self.state[jobId] == 'cancelled':
+                    continue
+                self.state[jobId] = 'running'
+
+            torch = sys.modules.get('torch')
+            with open(self.logPath(jobId, 'log'), 'w', buffering=1) as log, \
+                 open(self.logPath(jobId, 'err'), 'w', buffering=1) as err:
+                # only this thread's output goes to the job logs (see ThreadOutput)
+                ThreadOutput.local.stdout, ThreadOutput.local.stderr = log, err
+                savedArgv = sys.argv
+                sys.argv = [self.scriptPath] + args
+                if torch is not None and self.checkpoints is not None:
+                    torch.load = self.checkpoints
+
+                state = self.execute(jobId)
+
+                if torch is not None and self.checkpoints is not None:
+                    torch.load = self.checkpoints.load
+                sys.argv = savedArgv
+                ThreadOutput.local.stdout = ThreadOutput.local.stderr = None
+
+            self.state[jobId] = state
+            self.cancelRequests.discard(jobId)
+            self.release()
+
+    def execute(self, jobId):
+        """
+            Runs the script (set up by run), returns the final job state.
+            cancel() raises JobCancelled in this thread only while 'running' is set, it is
+            caught wherever it lands, the loop clears 'running' and any undelivered cancel
+        """
+        state = None
+        while True:
+            try:
+                if state is None:
+                    state = 'failed'
+                    try:
+                        with self.lock:
+                            self.running = (jobId, threading.get_ident())
+                            if jobId in self.cancelRequests:    # cancelled while being set up
+                                raise JobCancelled()
+                        runpy.run_path(self.scriptPath, run_name='__main__')
+                        state = 'done'
+                    except SystemExit as e:
+                        state = 'done' if e.code in (None, 0) else 'failed'
+                    except Exception:
+                        traceback.print_exc()
+                with self.lock:
+                    self.running = None
+                    raiseInThread(threading.get_ident(), None)
+                return state
+            except JobCancelled:
+                print("Job {} cancelled".format(jobId), file=sys.stderr)
+                state = 'cancelled'
+
+    @staticmethod
+    def release():
+        # models of the finished job are dropped, cached checkpoints remain
+        gc.collect()
+        torch = sys.modules.get('torch')
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def makeHandler(jobs):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    req = json.loads(line.decode())
+                    if req['cmd'] == 'submit':
+                        reply = {'job': jobs.submit(req['args'])}
+                    elif req['cmd'] == 'status':
+                        reply = jobs.status(int(req['job']), int(req.get('offset', 0)),
+                                            int(req.get('errorOffset', 0)))
+                    elif req['cmd'] == 'cancel':
+                        reply = {'state': jobs.cancel(int(req['job']))}
+                    elif req['cmd'] == 'list':
+                        reply = {'jobs': jobs.state, 'queued': jobs.queue.qsize()}
+                    elif req['cmd'] == 'ping':
+                        reply = {'ok': True}
+                    else:
+                        reply = {'error': "Unknown command: {}".format(req['cmd'])}
+                except Exception as e:
+                    reply = {'error': repr(e)}
+                self.wfile.write((json.dumps(reply) + "\n").encode())
+    return Handler
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    os.chdir(args.workingDir)
+    sys.path.insert(0, args.workingDir)
+
+    sys.stdout = ThreadOutput(sys.stdout, 'stdout')
+    sys.stderr = ThreadOutput(sys.stderr, 'stderr')
+
+    # loaded once for all jobs
+    import torch
+    checkpoints = CheckpointCache(torch)
+    if torch.cuda.is_available():
+        torch.cuda.init()
+
+    jobs = InpaintJobs(args.scriptPath, args.logDir, checkpoints)
+    threading.Thread(target=jobs.run, daemon=True).start()
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', args.port), makeHandler(jobs))
+    print("Inpaint daemon listening on 127.0.0.1:{}".format(args.port), flush=True)
+    server.serve_forever()
@@ -2,14 +2,19 @@ import argparse
 from glob import glob
 import cv2
 import os
+import sys
 import numpy as np
 import subprocess as sp
 import ffmpeg
 
+libpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),"../detect/scripts")
+sys.path.insert(1,libpath)
+import ObjectDetection.imutils as imu
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--input_dir', type=str, required=True, default=None,
-                        help="input directory of frames (assuming numeric ordering)")
+                        help="input directory of frames (assuming numeric ordering) or frame store (.frames)")
 
     parser.add_argument('--mask_dir', type=str, required=False, default=None,
                         help="(optional) input directory of masks (assuming numeric ordering)")
@@ -19,6 +24,11 @@ def parse_args():
     parser.add_argument('--fps', type=int, default=25, help="frames per second encoding speed (default=25 fps)")
     parser.add_argument('--output_file', type=str, default=None,
                         help="name of output mp4 file (default = input directory name")
+    parser.add_argument('--segments', type=int, default=0,
+                        help="encode in N parallel GOP-aligned segments, joined by concat (default=0, single process)")
+    parser.add_argument('--gop', type=int, default=250, help="GOP size (keyframe interval) for segmented encoding (default=250)")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="time single process versus segmented encoding (requires --segments)")
 
     args = parser.parse_args()
 
@@ -95,14 +105,17 @@ if __name__ == '__main__':
     inputdir = args.input_dir
 
     imgfiles = []
-    for ftype in ("*.jpg", "*.png"):
-        imgfiles = sorted(glob(os.path.join(inputdir,ftype)))
-        if imgfiles: break
+    if imu.isFrameStore(inputdir):
+        imgfiles = imu.FrameStore(inputdir)   # indexable frames, read through the memory map
+    else:
+        for ftype in ("*.jpg", "*.png"):
+            imgfiles = sorted(glob(os.path.join(inputdir,ftype)))
+            if imgfiles: break
 
-    assert imgfiles, f"Could not find any suitable *.jpg or *.png files in {inputdir}" 
+    assert len(imgfiles), f"Could not find any suitable *.jpg or *.png files in {inputdir}" 
 
     # DAN, you left off here!
-    if arg.mask_dir is not None:
+    if args.mask_dir is not None:
         assert os.path.exists(args.mask_dir), f"Mask directory specified, but could not be found = {args.mask_dir}"
 
     fps = args.fps
@@ -112,11 +125,38 @@ if __name__ == '__main__':
         video_name = args.output_file
     else:
         video_name = os.path.basename(inputdir)
+        if video_name.endswith(".frames"): video_name = video_name[:-len(".frames")]
     if not video_name.endswith(".mp4"): video_name = video_name + ".mp4"
 
+    outputfile = os.path.join(currdir,video_name)
+
+    if args.segments > 0:
+        def rotate(frame):
+            if args.rotate_left:
+                return cv2.rotate(frame,cv2.ROTATE_90_COUNTERCLOCKWISE)
+            elif args.rotate_right:
+                return cv2.rotate(frame,cv2.ROTATE_90_CLOCKWISE)
+            return frame
+
+        if args.benchmark:
+            res = imu.compareSegmentedEncoding(imgfiles, outputfile, fps=fps, n_segments=args.segments,
+                                               gopSize=args.gop, transform=rotate)
+            print(f"single process: {res['single']:.2f}s, {args.segments} segments: {res['segmented']:.2f}s, " + \
+                  f"speedup={res['speedup']:.2f}x")
+        else:
+            imu.writeFramesToVideoSegmented(imgfiles, outputfile, fps=fps, n_segments=args.segments,
+                                            gopSize=args.gop, transform=rotate)
+
+        print(f"\nVideo output file:{outputfile}")
+        print("\nCompleted successfully")
+        sys.exit(0)
+
     for imgfile in imgfiles:
-        print(imgfile)
-        out_frame = cv2.imread(imgfile)
+        if isinstance(imgfile,str):
+            print(imgfile)
+            out_frame = cv2.imread(imgfile)
+        else:
+            out_frame = imgfile
 
         if args.rotate_left:
             out_frame = cv2.rotate(out_frame,cv2.ROTATE_90_COUNTERCLOCKWISE)
@@ -128,8 +168,6 @@ if __name__ == '__main__':
 
     final_clip = np.stack(out_frames)
 
-    outputfile = os.path.join(currdir,video_name)
-
     #createVideoClip(final_clip, outputfile, [shape[0], shape[1]])
     createVideoClip_Cmd(final_clip, outputfile, fps, [shape[0], shape[1]])
     print(f"\nVideo output file:{outputfile}")
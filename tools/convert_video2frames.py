@@ -1,9 +1,14 @@
 import argparse
 import cv2
 import os
+import sys
 import numpy as np
 from math import log10, ceil
 
+libpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),"../detect/scripts")
+sys.path.insert(1,libpath)
+import ObjectDetection.imutils as imu
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--input_file', type=str, required=True, default=None,
@@ -13,11 +18,34 @@ def parse_args():
     parser.add_argument('--image_type', type=str, default='png', help="output frame file type (def=png)")
     parser.add_argument('--output_dir', type=str, default=None,
                         help="name of output directory (default = base of input file name")
+    parser.add_argument('--frame_store', action='store_true',
+                        help="write a single memory-mapped frame store (<output>.frames) instead of image files")
+    parser.add_argument('--backend', type=str, default='opencv', choices=['opencv','ffmpeg'],
+                        help="decode backend, cv2.VideoCapture or multithreaded ffmpeg rawvideo pipe (def=opencv)")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="compare the decode rate of the opencv and ffmpeg backends, then exit")
 
     args = parser.parse_args()
 
     return args
 
+def decode_frames(inputfile):
+    # frames are written (or copied to the store) before the next is decoded, 
+    # so the ffmpeg backend can reuse a small ring of buffers
+    if args.backend == 'ffmpeg':
+        frames = imu.FFMPEGFrameReader(inputfile, ringSize=2)
+    else:
+        frames = imu.get_frame(inputfile, n_frames=None, startframe=0, finishframe=float('inf'))
+
+    for frame in frames:
+        if args.rotate_left:
+            frame = cv2.rotate(frame,cv2.ROTATE_90_COUNTERCLOCKWISE)
+        elif args.rotate_right:
+            frame = cv2.rotate(frame,cv2.ROTATE_90_CLOCKWISE)
+
+        yield frame
+
+
 def video_to_frames(inputfile,outputdir,imagetype='png'):
 
     if not os.path.exists(outputdir):
@@ -27,23 +55,12 @@ def video_to_frames(inputfile,outputdir,imagetype='png'):
             if not os.path.exists(dout):
                 os.mkdir(dout)
 
-    cap = cv2.VideoCapture(inputfile)
-
-    length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    length = imu.get_nframes(inputfile)
 
     padlength = ceil(log10(length))
 
     n = 0
-    while True:
-        ret, frame = cap.read() 
-
-        if not ret: break
-
-        if args.rotate_left:
-            frame = cv2.rotate(frame,cv2.ROTATE_90_COUNTERCLOCKWISE)
-        elif args.rotate_right:
-            frame = cv2.rotate(frame,cv2.ROTATE_90_CLOCKWISE)
-        
+    for frame in decode_frames(inputfile):
         fname = str(n).rjust(padlength,'0') + '.' + imagetype
         cv2.imwrite(os.path.join(outputdir,fname),frame) 
 
@@ -52,20 +69,36 @@ def video_to_frames(inputfile,outputdir,imagetype='png'):
     return n  # number of frames processed
 
 
+def video_to_frameStore(inputfile,outputfile):
+    store = imu.FrameStore.fromFrames(outputfile, decode_frames(inputfile), fps=imu.get_fps(inputfile))
+    return len(store)  # number of frames processed
+
+
 if __name__ == '__main__':
     args = parse_args()
 
     assert os.path.exists(args.input_file), f"Could not find input file = {args.input_file}"
     inputfile = args.input_file
 
+    if args.benchmark:
+        res = imu.compareDecodeBackends(inputfile)
+        print(f"opencv: {res['opencv']:.1f} frames/s, ffmpeg: {res['ffmpeg']:.1f} frames/s, " + \
+              f"speedup={res['speedup']:.2f}x")
+        sys.exit(0)
+
     currdir = os.path.abspath(os.curdir)
 
     if args.output_dir is not None:
         outputdir = args.output_dir
     else:
-        outputdir = os.path.basename(inputdir).split('.')[0]
+        outputdir = os.path.basename(inputfile).split('.')[0]
         outputdir = os.path.join(currdir,outputdir + "_frames") 
 
-    n = video_to_frames(inputfile,outputdir,imagetype=args.image_type) 
+    if args.frame_store:
+        outputfile = outputdir.rstrip('/') + ".frames"
+        n = video_to_frameStore(inputfile,outputfile)
+        print(f"\nFrame store: {outputfile}")
+    else:
+        n = video_to_frames(inputfile,outputdir,imagetype=args.image_type) 
 
     print(f"\nCompleted successfully, processed {n} frames")
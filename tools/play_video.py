@@ -1,9 +1,14 @@
 import os
+import sys
 import cv2
 import argparse
 from glob import glob
 from time import time, sleep
 
+libpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),"../detect/scripts")
+sys.path.insert(1,libpath)
+import ObjectDetection.imutils as imu
+
 fontconfig = {
     "font"         : cv2.FONT_HERSHEY_SIMPLEX,
     "rel_coords"   : (0.8, 0.05),
@@ -17,10 +22,13 @@ fontconfig = {
 parser = argparse.ArgumentParser()
 
 parser.add_argument('--infile', type=str, required=None, 
-                    help="input file in .mp4, .avi, .mov, or .mkv format")
+                    help="input file in .mp4, .avi, .mov, or .mkv format, or a frame store (.frames)")
 
 parser.add_argument('--maskdir', type=str, required=None, 
-                    help="mask directory (*.jpg or *.png), total must be same as frame count")
+                    help="mask directory (*.jpg or *.png) or mask video (.mkv), total must be same as frame count")
+
+parser.add_argument('--mask_alpha', type=float, default=None, 
+                    help="blend a red mask overlay with this opacity (default: masked pixels get a full red channel)")
 
 parser.add_argument('--fps', type=int, default=None, 
                     help="video replay frame rate, frames per second (default=60 fps)")
@@ -46,7 +54,9 @@ parser.add_argument('other', nargs=argparse.REMAINDER) # catch unnamed arguments
 
 ##### Helper functions #####
 def get_fps(vfile):
-    if not os.path.isdir(vfile):
+    if imu.isFrameStore(vfile):
+        return imu.get_fps(vfile)
+    elif not os.path.isdir(vfile):
         cap = cv2.VideoCapture(vfile)
         fps = cap.get(cv2.CAP_PROP_FPS)
         print(f"File spec FPS ={fps}")
@@ -56,7 +66,9 @@ def get_fps(vfile):
         return None
 
 def get_nframes(vfile):
-    if not os.path.isdir(vfile):
+    if imu.isFrameStore(vfile):
+        n_frames = imu.get_nframes(vfile)
+    elif not os.path.isdir(vfile):
         cap = cv2.VideoCapture(vfile)
         n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         print(f"File spec n_frames ={n_frames}")
@@ -72,7 +84,12 @@ def get_nframes(vfile):
 
 
 def get_frame(vfile, n_frames, startframe=0, finishframe=None):
-    if os.path.isdir(vfile):
+    if imu.isFrameStore(vfile):
+        # frames are copied, since they are modified for display
+        for frame in imu.get_frame(vfile, n_frames, startframe, finishframe):
+            yield frame.copy()
+
+    elif os.path.isdir(vfile):
         images = glob(os.path.join(vfile, '*.jp*'))
         if not images:
             images = glob(os.path.join(vfile, '*.png'))
@@ -112,6 +129,11 @@ def get_frame(vfile, n_frames, startframe=0, finishframe=None):
                 break
 
 def get_mask(maskdir,n_frames, startframe=0, finishframe=None):
+    if imu.isMaskVideo(maskdir):
+        # single lossless mask video, masks are returned as (h,w) bool arrays
+        yield from imu.readMaskVideo(maskdir, startframe, finishframe)
+        return
+
     assert os.path.isdir(maskdir), \
         "Use masks specified, however supplied path was not a directory:\n{maskdir}"
     
@@ -177,6 +199,8 @@ if __name__ == '__main__':
     
     assert finishframe > startframe, f"Invalid definition of 'start'={startframe} and 'finish'={finishframe}, start > finish"
 
+    maskLUT = imu.colorLUT([(0,0,255)])  # red (BGR)
+
     replay = 1 
 
     while replay:
@@ -204,7 +228,10 @@ if __name__ == '__main__':
             if mask is not None:
                 if len(mask.shape) == 3:
                     mask = mask[:,:,0]
-                frame[:, :, 2] = (mask > 0) * 255 + (mask == 0) * frame[:, :, 2]
+                if args.mask_alpha is None:
+                    frame[:, :, 2] = (mask > 0) * 255 + (mask == 0) * frame[:, :, 2]
+                else:
+                    imu.overlayLabels(frame, mask > 0, maskLUT, alpha=args.mask_alpha, out=frame)
 
             ### optional rotations
             if args.rotate_left: